@@ -1,16 +1,73 @@
 from dotenv import load_dotenv
-from edgedb import create_async_client
 from fastapi import FastAPI
 
+from libauthproxy import (
+    create_db_client,
+    DB_MAX_CONCURRENCY,
+    DB_CONNECT_TIMEOUT,
+    DB_WAIT_UNTIL_AVAILABLE,
+    DB_RETRY_ATTEMPTS,
+    METRICS_PATH,
+    TOKEN_CLAIMS,
+    REVOCATION_REFRESH_INTERVAL,
+    HOST,
+    PORT,
+)
+from libauthproxy.health import register_health_routes
+from libauthproxy.metrics import InstrumentedExecutor, MetricsMiddleware, handle_metrics
+from libauthproxy.utils import L
+from libauthproxy.proxy import register_proxy_routes
 from libauthproxy.routes import register_routes
 
 
+def register_metrics(app: FastAPI, **kwargs) -> bool:
+    metrics_path = kwargs.get("metrics_path", METRICS_PATH)
+    if not metrics_path:
+        return False
+    L.info(f"Registering GET http://{kwargs.get('host', HOST)}:{kwargs.get('port', PORT)}{metrics_path}")
+    app.add_middleware(MetricsMiddleware)
+    app.add_route(metrics_path, handle_metrics, methods=["GET"], include_in_schema=False)
+    return True
+
+
 def init_app(*args, **kwargs) -> FastAPI:
     load_dotenv()
     app = kwargs.get("app", FastAPI())
-    conn = kwargs.get("db", create_async_client())
     kwargs_copy = kwargs.copy()
     kwargs_copy.pop("app", None) # None so this does not raise
-    kwargs_copy.pop("db", None)
+    conn = kwargs_copy.pop("db", None)
+    if conn is None:
+        conn = create_db_client(
+            max_concurrency=kwargs.get("db_max_concurrency", DB_MAX_CONCURRENCY),
+            timeout=kwargs.get("db_connect_timeout", DB_CONNECT_TIMEOUT),
+            wait_until_available=kwargs.get("db_wait_until_available", DB_WAIT_UNTIL_AVAILABLE),
+            retry_attempts=kwargs.get("db_retry_attempts", DB_RETRY_ATTEMPTS),
+        )
+        # a client handed in is expected to be ready, tests hand in mocks
+        register_health_routes(app, conn, **kwargs_copy)
+    if register_metrics(app, **kwargs_copy):
+        conn = InstrumentedExecutor(conn)
     register_routes(app, conn, **kwargs_copy)
     return app
+
+
+def init_proxy_app(*args, **kwargs) -> FastAPI:
+    load_dotenv()
+    app = kwargs.get("app", FastAPI(openapi_url=None, docs_url=None, redoc_url=None))
+    kwargs_copy = kwargs.copy()
+    kwargs_copy.pop("app", None)
+    conn = kwargs_copy.pop("db", None)
+    # revocations are loaded from EdgeDB, as are the scope dictionaries that resolve compact tokens
+    needs_db = kwargs.get("revocation_refresh_interval", REVOCATION_REFRESH_INTERVAL) > 0 or \
+        kwargs.get("token_claims", TOKEN_CLAIMS) == "compact"
+    if conn is None and needs_db:
+        conn = create_db_client(
+            max_concurrency=kwargs.get("db_max_concurrency", DB_MAX_CONCURRENCY),
+            timeout=kwargs.get("db_connect_timeout", DB_CONNECT_TIMEOUT),
+            wait_until_available=kwargs.get("db_wait_until_available", DB_WAIT_UNTIL_AVAILABLE),
+            retry_attempts=kwargs.get("db_retry_attempts", DB_RETRY_ATTEMPTS),
+        )
+    if register_metrics(app, **kwargs_copy) and conn is not None:
+        conn = InstrumentedExecutor(conn)
+    register_proxy_routes(app, conn, **kwargs_copy)
+    return app
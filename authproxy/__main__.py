@@ -1,7 +1,58 @@
+import os
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from importlib.util import find_spec
+
 from uvicorn import run
-from authproxy import init_app
-from libauthproxy import HOST, PORT
+from libauthproxy import HOST, PORT, WORKERS, BACKLOG, KEEP_ALIVE_TIMEOUT, FORWARDED_ALLOW_IPS, INVALIDATION_SOCKET_DIR
+from libauthproxy.utils import L
+
+FACTORIES = {
+    "api": "authproxy:init_app",
+    "proxy": "authproxy:init_proxy_app",
+}
 
 if __name__ == '__main__':
-    app = init_app()
-    run(app, host=HOST, port=PORT)
+    parser = ArgumentParser(prog="authproxy")
+    parser.add_argument("mode", nargs="?", choices=tuple(FACTORIES), default="api",
+                        help="api serves the admin and token routes, proxy validates tokens and forwards "
+                             "requests to the upstreams in $PROXY_ROUTES")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="worker processes sharing the listening socket, 0 means one per core")
+    parser.add_argument("--backlog", type=int, default=BACKLOG,
+                        help="connections the kernel queues before accept")
+    parser.add_argument("--keep-alive", type=int, default=KEEP_ALIVE_TIMEOUT,
+                        help="seconds an idle keep-alive connection stays open")
+    parser.add_argument("--forwarded-allow-ips", default=FORWARDED_ALLOW_IPS,
+                        help="reverse proxies whose X-Forwarded-For is the client address, comma separated or *")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    socket_dir = None
+    if workers > 1 and not INVALIDATION_SOCKET_DIR:
+        # the workers inherit the environment, so they find each other in here
+        socket_dir = os.environ["INVALIDATION_SOCKET_DIR"] = tempfile.mkdtemp(prefix="authproxy-")
+    loop = "uvloop" if find_spec("uvloop") else "asyncio"
+    http = "httptools" if find_spec("httptools") else "h11"
+    L.info(f"Starting {workers} {args.mode} workers on http://{args.host}:{args.port} (loop={loop}, http={http})")
+
+    # every worker imports and calls the factory itself, so each one gets its own EdgeDB pool
+    run(
+        FACTORIES[args.mode],
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        # the login rate limits and the https check for plaintext passwords see the client behind the proxy
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        loop=loop,
+        http=http,
+    )
+    if socket_dir is not None:
+        shutil.rmtree(socket_dir, ignore_errors=True)
@@ -0,0 +1,50 @@
+"""
+Compares encode and decode throughput of the JWT backends.
+
+    poetry run python3 -m benchmarks.bench_jwt [--seconds 1.0]
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from libauthproxy.jwt_backends import JWT_BACKENDS
+
+CLAIMS = {
+    "sub": "buffy",
+    "tenant": "aldi",
+    "email": "buffy@buff.com",
+    "disabled": False,
+    "scopes": [f"service-{i}:read" for i in range(20)],
+}
+SECRET = "0b5e0ba8c1c2b2a1d1cdf1a8b7b7d1e6a1b1c1d1e1f1a1b1c1d1e1f1a1b1c1d1"
+
+
+def ops_per_second(fn, seconds: float) -> float:
+    ops = 0
+    started = perf_counter()
+    deadline = started + seconds
+    while perf_counter() < deadline:
+        for _ in range(100):
+            fn()
+        ops += 100
+    return ops / (perf_counter() - started)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=1.0, help="how long to run each case")
+    args = parser.parse_args()
+
+    claims = {**CLAIMS, "exp": datetime.utcnow() + timedelta(hours=1)}
+    print(f"{'backend':<8} {'alg':<6} {'encode/s':>12} {'decode/s':>12}")
+    for algorithm in ("HS256", "HS512"):
+        for name, backend_class in JWT_BACKENDS.items():
+            backend = backend_class()
+            token = backend.encode(claims, SECRET, algorithm)
+            encode = ops_per_second(lambda: backend.encode(claims, SECRET, algorithm), args.seconds)
+            decode = ops_per_second(lambda: backend.decode(token, SECRET, [algorithm]), args.seconds)
+            print(f"{name:<8} {algorithm:<6} {encode:>12,.0f} {decode:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
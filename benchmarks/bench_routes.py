@@ -0,0 +1,228 @@
+"""
+Latency and throughput of the token, validation and admin routes against an in-memory stand-in
+for EdgeDB that answers after a configurable latency.
+
+    poetry run python3 -m benchmarks.bench_routes [--scenario users_me] [--save] [--compare]
+
+--save writes the results to benchmarks/baselines/routes.json, commit it alongside changes to the
+hot paths so that regressions show up in review. --compare prints the change against that file.
+"""
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+from argparse import ArgumentParser
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import perf_counter
+from uuid import UUID
+
+import httpx
+from passlib.context import CryptContext
+
+from authproxy import init_app
+from db import (
+    CheckSessionResult,
+    GetUserByEmailResultRolesItem,
+    GetUserByEmailResultTenant,
+    GetUserByUsernameResult,
+    ListUsersResult,
+    ListUsersResultRolesItem,
+)
+from libauthproxy import create_access_token
+
+BASELINE = Path(__file__).parent / "baselines" / "routes.json"
+SECRET = "0b5e0ba8c1c2b2a1d1cdf1a8b7b7d1e6a1b1c1d1e1f1a1b1c1d1e1f1a1b1c1d1"
+PASSWORD = "password"
+TENANT = GetUserByEmailResultTenant(id=UUID(int=1), name="aldi")
+
+
+class LatencyDBMock:
+    """
+    Answers the queries the benchmarked routes issue from a synthetic tenant, after sleeping for
+    `latency` plus up to `jitter` seconds drawn from a seeded generator.
+    """
+
+    def __init__(self, users: int, password_hash: str, latency: float, jitter: float, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.queries = 0
+        roles = [GetUserByEmailResultRolesItem(id=UUID(int=2), name="reader", scopes=["service:read"])]
+        created_at = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        self.users = {}
+        self.rows = []
+        for i in range(users):
+            username = f"user-{i}"
+            self.users[username] = GetUserByUsernameResult(
+                id=UUID(int=1000 + i), username=username, email=f"{username}@aldi.com", first_name="first",
+                last_name="last", password_hash=password_hash, disabled=False, tenant=TENANT, roles=roles,
+            )
+            self.rows.append(ListUsersResult(
+                id=UUID(int=1000 + i), username=username, created_at=created_at, tenant=TENANT,
+                first_name="first", last_name="last", email=f"{username}@aldi.com", disabled=False,
+                roles=[ListUsersResultRolesItem(id=UUID(int=2), name="reader", scopes=["service:read"])],
+            ))
+        self.ids = [row.id for row in self.rows]
+
+    async def _wait(self):
+        self.queries += 1
+        await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+
+    async def query_single(self, query: str, **kwargs):
+        await self._wait()
+        if "roles_version" in query:
+            user = self.users.get(kwargs["username"])
+            return user and CheckSessionResult(id=user.id, disabled=user.disabled, roles_version=None)
+        if "username" in kwargs:
+            return self.users.get(kwargs["username"])
+        return None
+
+    async def query(self, query: str, **kwargs):
+        await self._wait()
+        if "limit" in kwargs:
+            start = bisect_right(self.ids, kwargs["after"]) if kwargs.get("after") else 0
+            return self.rows[start:start + kwargs["limit"]]
+        return []
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_scenario(client: httpx.AsyncClient, request, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = perf_counter()
+            res = await request(client, i)
+            latencies.append(perf_counter() - start)
+            if res.status_code >= 400:
+                errors += 1
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "requests_per_second": round(requests / seconds, 1),
+    }
+
+
+def create_scenarios(users: int, list_page_size: int):
+    tokens = [
+        create_access_token(SECRET, "HS256", {"sub": f"user-{i}", "tenant": "aldi", "scopes": ["service:read"]},
+                            timedelta(hours=1))
+        for i in range(min(users, 1000))
+    ]
+
+    async def login(client, i):
+        return await client.post("/tokens", data={"username": f"user-{i % users}", "password": PASSWORD,
+                                                  "tenant": "aldi"})
+
+    async def users_me(client, i):
+        return await client.get("/users/me/", headers={"authorization": f"Bearer {tokens[i % len(tokens)]}"})
+
+    async def forward_auth(client, i):
+        return await client.get("/auth", headers={"authorization": f"Bearer {tokens[i % len(tokens)]}"})
+
+    async def list_users(client, i):
+        # walks the tenant page by page, each request is one page
+        res = await client.get("/tenants/aldi/users", params={"limit": list_page_size, **list_users.cursor},
+                               auth=("admin", "admin"))
+        cursor = res.headers.get("x-next-cursor")
+        list_users.cursor = {"cursor": cursor} if cursor else {}
+        return res
+
+    list_users.cursor = {}
+
+    mix = random.Random(0)
+
+    async def mixed(client, i):
+        pick = mix.random()
+        if pick < 0.05:
+            return await login(client, i)
+        if pick < 0.10:
+            return await list_users(client, i)
+        if pick < 0.55:
+            return await forward_auth(client, i)
+        return await users_me(client, i)
+
+    # name: (request, share of --requests, app kwargs)
+    return {
+        "login": (login, 0.05, {}),
+        "users_me": (users_me, 1, {}),
+        "forward_auth": (forward_auth, 1, {}),
+        "list_users": (list_users, 0.2, {"read_cache_size": 0}),
+        "list_users_cached": (list_users, 0.2, {}),
+        "mixed": (mixed, 0.5, {}),
+    }
+
+
+async def main():
+    parser = ArgumentParser()
+    parser.add_argument("--scenario", action="append", help="run only these scenarios, may be repeated")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario, login runs 5%% of it")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=50000, help="users in the synthetic tenant")
+    parser.add_argument("--list-page-size", type=int, default=100)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="seconds every query takes")
+    parser.add_argument("--db-jitter", type=float, default=0.002, help="up to this many seconds are added")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--save", action="store_true", help=f"write the results to {BASELINE}")
+    parser.add_argument("--compare", action="store_true", help=f"print the change against {BASELINE}")
+    args = parser.parse_args()
+    # route registration and every request log at INFO
+    logging.disable(logging.INFO)
+
+    password_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=args.bcrypt_rounds).hash(PASSWORD)
+    scenarios = create_scenarios(args.users, args.list_page_size)
+    baseline = json.loads(BASELINE.read_text())["scenarios"] if args.compare and BASELINE.exists() else {}
+
+    results = {}
+    print(f"{'scenario':<18} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>10}")
+    for name, (request, share, app_kwargs) in scenarios.items():
+        if args.scenario and name not in args.scenario:
+            continue
+        db = LatencyDBMock(args.users, password_hash, args.db_latency, args.db_jitter)
+        app = init_app(db=db, secret_key=SECRET, admin_username="admin", admin_password="admin",
+                       revocation_refresh_interval=0, metrics_path="", login_ip_rate=0,
+                       login_tenant_rate=0, **app_kwargs)
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            result = await run_scenario(client, request, max(1, int(args.requests * share)), args.concurrency)
+        result["db_queries"] = db.queries
+        results[name] = result
+
+        line = (f"{name:<18} {result['requests']:>8} {result['errors']:>6} {result['p50_ms']:>9.3f} "
+                f"{result['p99_ms']:>9.3f} {result['requests_per_second']:>10,.1f}")
+        if name in baseline:
+            change = result["requests_per_second"] / baseline[name]["requests_per_second"] - 1
+            line += f"  {change:+.1%} req/s, p99 {baseline[name]['p99_ms']:.3f} -> {result['p99_ms']:.3f}"
+        print(line)
+
+    if args.save:
+        BASELINE.parent.mkdir(exist_ok=True)
+        BASELINE.write_text(json.dumps({
+            "environment": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "arguments": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+            "scenarios": results,
+        }, indent=2) + "\n")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
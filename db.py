@@ -1,5 +1,8 @@
 # AUTOGENERATED FROM:
+#     'queries/users/check_session.edgeql'
+#     'queries/tokens/create_refresh_token.edgeql'
 #     'queries/roles/create_role.edgeql'
+#     'queries/scopes/create_scope_dictionary.edgeql'
 #     'queries/tenants/create_tenant.edgeql'
 #     'queries/users/create_user.edgeql'
 #     'queries/roles/delete_role.edgeql'
@@ -7,13 +10,26 @@
 #     'queries/users/delete_user.edgeql'
 #     'queries/users/get_user_by_email.edgeql'
 #     'queries/users/get_user_by_username.edgeql'
+#     'queries/roles/import_roles.edgeql'
+#     'queries/users/import_users.edgeql'
+#     'queries/changes/list_changes.edgeql'
+#     'queries/tokens/list_revocations.edgeql'
 #     'queries/roles/list_roles.edgeql'
+#     'queries/scopes/list_scopes.edgeql'
 #     'queries/tenants/list_tenants.edgeql'
 #     'queries/users/list_users.edgeql'
+#     'queries/tokens/read_refresh_token.edgeql'
 #     'queries/roles/read_role.edgeql'
+#     'queries/scopes/read_scope_dictionary.edgeql'
 #     'queries/tenants/read_tenant.edgeql'
 #     'queries/users/read_user.edgeql'
+#     'queries/changes/record_change.edgeql'
+#     'queries/tokens/revoke_all_tokens.edgeql'
+#     'queries/tokens/revoke_refresh_token_family.edgeql'
+#     'queries/tokens/revoke_token.edgeql'
+#     'queries/users/update_password_hash.edgeql'
 #     'queries/tenants/update_tenant.edgeql'
+#     'queries/tokens/use_refresh_token.edgeql'
 # WITH:
 #     $ edgedb-py --file db.py
 
@@ -34,11 +50,28 @@ class NoPydanticValidation:
         return []
 
 
+@dataclasses.dataclass
+class CheckSessionResult(NoPydanticValidation):
+    id: uuid.UUID
+    disabled: bool
+    roles_version: datetime.datetime | None
+
+
+@dataclasses.dataclass
+class CreateRefreshTokenResult(NoPydanticValidation):
+    id: uuid.UUID
+
+
 @dataclasses.dataclass
 class CreateRoleResult(NoPydanticValidation):
     id: uuid.UUID
 
 
+@dataclasses.dataclass
+class CreateScopeDictionaryResult(NoPydanticValidation):
+    id: uuid.UUID
+
+
 @dataclasses.dataclass
 class CreateTenantResult(NoPydanticValidation):
     id: uuid.UUID
@@ -88,6 +121,41 @@ class GetUserByUsernameResult(NoPydanticValidation):
     roles: list[GetUserByEmailResultRolesItem]
 
 
+@dataclasses.dataclass
+class ListChangesResult(NoPydanticValidation):
+    changes: list[ListChangesResultChangesItem]
+    now: datetime.datetime
+
+
+@dataclasses.dataclass
+class ListChangesResultChangesItem(NoPydanticValidation):
+    id: uuid.UUID
+    event: str
+    created_at: datetime.datetime
+
+
+@dataclasses.dataclass
+class ListRevocationsResult(NoPydanticValidation):
+    tokens: list[ListRevocationsResultTokensItem]
+    rules: list[ListRevocationsResultRulesItem]
+    now: datetime.datetime
+
+
+@dataclasses.dataclass
+class ListRevocationsResultRulesItem(NoPydanticValidation):
+    id: uuid.UUID
+    tenant: GetUserByEmailResultTenant
+    username: str | None
+    not_before: datetime.datetime
+
+
+@dataclasses.dataclass
+class ListRevocationsResultTokensItem(NoPydanticValidation):
+    id: uuid.UUID
+    jti: str
+    expires_at: datetime.datetime
+
+
 @dataclasses.dataclass
 class ListRolesResult(NoPydanticValidation):
     id: uuid.UUID
@@ -113,7 +181,6 @@ class ListUsersResult(NoPydanticValidation):
     first_name: str
     last_name: str
     email: str
-    password_hash: str
     disabled: bool
     roles: list[ListUsersResultRolesItem]
 
@@ -125,6 +192,108 @@ class ListUsersResultRolesItem(NoPydanticValidation):
     name: str
 
 
+@dataclasses.dataclass
+class ReadRefreshTokenResult(NoPydanticValidation):
+    id: uuid.UUID
+    family: uuid.UUID
+    used: bool
+
+
+@dataclasses.dataclass
+class ReadUserResult(NoPydanticValidation):
+    id: uuid.UUID
+    username: str
+    created_at: datetime.datetime
+    tenant: GetUserByEmailResultTenant
+    first_name: str
+    last_name: str
+    email: str
+    password_hash: str
+    disabled: bool
+    roles: list[ListUsersResultRolesItem]
+
+
+@dataclasses.dataclass
+class RecordChangeResult(NoPydanticValidation):
+    id: uuid.UUID
+    pruned: int
+
+
+@dataclasses.dataclass
+class RevokeAllTokensResult(NoPydanticValidation):
+    id: uuid.UUID
+    not_before: datetime.datetime
+    refresh_tokens: int
+
+
+@dataclasses.dataclass
+class RevokeTokenResult(NoPydanticValidation):
+    id: uuid.UUID
+
+
+@dataclasses.dataclass
+class UseRefreshTokenResult(NoPydanticValidation):
+    id: uuid.UUID
+    family: uuid.UUID
+    expires_at: datetime.datetime
+    user: UseRefreshTokenResultUser
+
+
+@dataclasses.dataclass
+class UseRefreshTokenResultUser(NoPydanticValidation):
+    id: uuid.UUID
+    username: str
+    email: str
+    disabled: bool
+    tenant: GetUserByEmailResultTenant
+    roles: list[GetUserByEmailResultRolesItem]
+
+
+async def check_session(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    username: str,
+    tenant: str,
+) -> CheckSessionResult | None:
+    return await executor.query_single(
+        """\
+        SELECT User {
+        	id,
+        	disabled,
+        	roles_version := max({.updated_at, .roles.updated_at})
+        } FILTER .tenant = (SELECT Tenant FILTER .name = <str>$tenant) AND .username = <str>$username LIMIT 1;\
+        """,
+        username=username,
+        tenant=tenant,
+    )
+
+
+async def create_refresh_token(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    user_id: uuid.UUID,
+    token_hash: str,
+    family: uuid.UUID,
+    expires_at: datetime.datetime,
+) -> CreateRefreshTokenResult:
+    return await executor.query_single(
+        """\
+        WITH user := (SELECT User FILTER .id = <uuid>$user_id)
+        INSERT RefreshToken {
+        	token_hash := <str>$token_hash,
+        	family := <uuid>$family,
+        	expires_at := <datetime>$expires_at,
+        	user := user,
+        	tenant := user.tenant,
+        };\
+        """,
+        user_id=user_id,
+        token_hash=token_hash,
+        family=family,
+        expires_at=expires_at,
+    )
+
+
 async def create_role(
     executor: edgedb.AsyncIOExecutor,
     *,
@@ -146,6 +315,27 @@ async def create_role(
     )
 
 
+async def create_scope_dictionary(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    tenant: str,
+    version: str,
+    scopes: list[str],
+) -> CreateScopeDictionaryResult | None:
+    return await executor.query_single(
+        """\
+        INSERT ScopeDictionary {
+        	tenant := (SELECT Tenant FILTER .name = <str>$tenant),
+        	version := <str>$version,
+        	scopes := <array<str>>$scopes,
+        } UNLESS CONFLICT ON (.tenant, .version);\
+        """,
+        tenant=tenant,
+        version=version,
+        scopes=scopes,
+    )
+
+
 async def create_tenant(
     executor: edgedb.AsyncIOExecutor,
     *,
@@ -174,14 +364,15 @@ async def create_user(
 ) -> CreateUserResult:
     return await executor.query_single(
         """\
+        WITH tenant := (SELECT Tenant FILTER .name = <str>$tenant_name)
         INSERT User {
           username := <str>$username,
           email := <str>$email,
           first_name := <str>$first_name,
           last_name := <str>$last_name,
           password_hash := <str>$password_hash,
-          tenant := (SELECT Tenant FILTER Tenant.name = <str>$tenant_name),
-          roles := (SELECT Role FILTER Role.tenant.name = <str>$tenant_name AND Role.name in <str>$roles)
+          tenant := tenant,
+          roles := (SELECT Role FILTER .tenant = tenant AND .name = <str>$roles)
         };\
         """,
         username=username,
@@ -204,7 +395,7 @@ async def delete_role(
         """\
         DELETE Role
         FILTER
-        .name = <str>$name AND .tenant.name = <str>$tenant LIMIT 1;\
+        .tenant = (SELECT Tenant FILTER .name = <str>$tenant) AND .name = <str>$name LIMIT 1;\
         """,
         name=name,
         tenant=tenant,
@@ -257,7 +448,7 @@ async def get_user_by_email(
         	disabled,
         	roles: { name, scopes},
         	tenant: { name }
-        } FILTER .email = <str>$email AND .tenant.name = <str>$tenant LIMIT 1;\
+        } FILTER .tenant = (SELECT Tenant FILTER .name = <str>$tenant) AND .email = <str>$email LIMIT 1;\
         """,
         email=email,
         tenant=tenant,
@@ -287,23 +478,140 @@ async def get_user_by_username(
         	  name,
         	  scopes
         	}
-        } FILTER .username = <str>$username AND .tenant.name = <str>$tenant LIMIT 1;\
+        } FILTER .tenant = (SELECT Tenant FILTER .name = <str>$tenant) AND .username = <str>$username LIMIT 1;\
         """,
         username=username,
         tenant=tenant,
     )
 
 
+async def import_roles(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    tenant: str,
+    roles: str,
+) -> list[CreateRoleResult]:
+    return await executor.query(
+        """\
+        WITH
+        	tenant := (SELECT Tenant FILTER .name = <str>$tenant),
+        FOR role IN json_array_unpack(<json>$roles) UNION (
+        	INSERT Role {
+        		name := <str>role['name'],
+        		scopes := <array<str>>role['scopes'],
+        		tenant := tenant,
+        	}
+        );\
+        """,
+        tenant=tenant,
+        roles=roles,
+    )
+
+
+async def import_users(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    tenant: str,
+    users: str,
+) -> list[CreateUserResult]:
+    return await executor.query(
+        """\
+        WITH
+        	tenant := (SELECT Tenant FILTER .name = <str>$tenant),
+        	tenant_roles := (SELECT Role FILTER .tenant = tenant),
+        FOR user IN json_array_unpack(<json>$users) UNION (
+        	INSERT User {
+        		username := <str>user['username'],
+        		email := <str>user['email'],
+        		first_name := <str>user['first_name'],
+        		last_name := <str>user['last_name'],
+        		password_hash := <str>user['password_hash'],
+        		tenant := tenant,
+        		roles := (SELECT tenant_roles FILTER .name = <str>user['roles'])
+        	}
+        );\
+        """,
+        tenant=tenant,
+        users=users,
+    )
+
+
+async def list_changes(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    since: datetime.datetime | None = None,
+) -> ListChangesResult:
+    return await executor.query_single(
+        """\
+        WITH since := <optional datetime>$since ?? datetime_of_statement()
+        SELECT {
+        	changes := (
+        		SELECT Change {event, created_at}
+        		FILTER .created_at > since
+        		ORDER BY .created_at
+        	),
+        	now := datetime_of_statement(),
+        };\
+        """,
+        since=since,
+    )
+
+
+async def list_revocations(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    since: datetime.datetime | None = None,
+) -> ListRevocationsResult:
+    return await executor.query_single(
+        """\
+        WITH since := <optional datetime>$since ?? <datetime>'1970-01-01T00:00:00Z'
+        SELECT {
+        	tokens := (
+        		SELECT RevokedToken {jti, expires_at}
+        		FILTER .created_at > since AND .expires_at > datetime_of_statement()
+        	),
+        	rules := (
+        		SELECT RevocationRule {tenant: {name}, username, not_before}
+        		FILTER .created_at > since
+        	),
+        	now := datetime_of_statement(),
+        };\
+        """,
+        since=since,
+    )
+
+
 async def list_roles(
     executor: edgedb.AsyncIOExecutor,
     *,
     tenant: str,
+    after: uuid.UUID | None = None,
+    limit: int,
 ) -> list[ListRolesResult]:
     return await executor.query(
         """\
         SELECT Role {name,scopes,tenant,created_at}
         FILTER
-        .tenant.name = <str>$tenant;\
+        .tenant = (SELECT Tenant FILTER .name = <str>$tenant)
+        AND .id > (<optional uuid>$after ?? <uuid>'00000000-0000-0000-0000-000000000000')
+        ORDER BY .id
+        LIMIT <int64>$limit;\
+        """,
+        tenant=tenant,
+        after=after,
+        limit=limit,
+    )
+
+
+async def list_scopes(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    tenant: str,
+) -> list[str]:
+    return await executor.query(
+        """\
+        WITH tenant := (SELECT Tenant FILTER .name = <str>$tenant)
+        SELECT DISTINCT array_unpack((SELECT Role FILTER .tenant = tenant).scopes);\
         """,
         tenant=tenant,
     )
@@ -311,11 +619,19 @@ async def list_roles(
 
 async def list_tenants(
     executor: edgedb.AsyncIOExecutor,
+    *,
+    after: uuid.UUID | None = None,
+    limit: int,
 ) -> list[ListTenantsResult]:
     return await executor.query(
         """\
-        SELECT Tenant{name,created_at};\
+        SELECT Tenant{name,created_at}
+        FILTER .id > (<optional uuid>$after ?? <uuid>'00000000-0000-0000-0000-000000000000')
+        ORDER BY .id
+        LIMIT <int64>$limit;\
         """,
+        after=after,
+        limit=limit,
     )
 
 
@@ -323,12 +639,33 @@ async def list_users(
     executor: edgedb.AsyncIOExecutor,
     *,
     tenant: str,
+    after: uuid.UUID | None = None,
+    limit: int,
 ) -> list[ListUsersResult]:
     return await executor.query(
         """\
-        SELECT User{username,created_at,tenant:{name}, first_name,last_name,email,password_hash,disabled,roles:{scopes,name}} FILTER .tenant = (SELECT Tenant FILTER Tenant.name = <str> $tenant);\
+        SELECT User{username,created_at,tenant:{name}, first_name,last_name,email,disabled,roles:{scopes,name}}
+        FILTER .tenant = (SELECT Tenant FILTER Tenant.name = <str> $tenant)
+        AND .id > (<optional uuid>$after ?? <uuid>'00000000-0000-0000-0000-000000000000')
+        ORDER BY .id
+        LIMIT <int64>$limit;\
         """,
         tenant=tenant,
+        after=after,
+        limit=limit,
+    )
+
+
+async def read_refresh_token(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    token_hash: str,
+) -> ReadRefreshTokenResult | None:
+    return await executor.query_single(
+        """\
+        SELECT RefreshToken {family, used} FILTER .token_hash = <str>$token_hash LIMIT 1;\
+        """,
+        token_hash=token_hash,
     )
 
 
@@ -342,13 +679,29 @@ async def read_role(
         """\
         SELECT Role {name,scopes,tenant,created_at}
         FILTER
-        .name = <str>$name AND .tenant.name = <str>$tenant LIMIT 1;\
+        .tenant = (SELECT Tenant FILTER .name = <str>$tenant) AND .name = <str>$name LIMIT 1;\
         """,
         name=name,
         tenant=tenant,
     )
 
 
+async def read_scope_dictionary(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    tenant: str,
+    version: str,
+) -> list[str] | None:
+    return await executor.query_single(
+        """\
+        WITH tenant := (SELECT Tenant FILTER .name = <str>$tenant)
+        SELECT (SELECT ScopeDictionary FILTER .tenant = tenant AND .version = <str>$version LIMIT 1).scopes;\
+        """,
+        tenant=tenant,
+        version=version,
+    )
+
+
 async def read_tenant(
     executor: edgedb.AsyncIOExecutor,
     *,
@@ -367,7 +720,7 @@ async def read_user(
     *,
     username: str,
     tenant: str,
-) -> ListUsersResult | None:
+) -> ReadUserResult | None:
     return await executor.query_single(
         """\
         SELECT User{username,created_at,tenant:{name}, first_name,last_name,email,password_hash,disabled,roles:{scopes,name}} FILTER .username = <str>$username AND .tenant = (SELECT Tenant FILTER Tenant.name = <str> $tenant) LIMIT 1;\
@@ -377,6 +730,108 @@ async def read_user(
     )
 
 
+async def record_change(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    event: str,
+) -> RecordChangeResult:
+    return await executor.query_single(
+        """\
+        WITH pruned := (
+        	DELETE Change FILTER .created_at < datetime_of_statement() - <duration>'24 hours'
+        )
+        SELECT (
+        	INSERT Change {
+        		event := <json>$event,
+        	}
+        ) {
+        	pruned := count(pruned),
+        };\
+        """,
+        event=event,
+    )
+
+
+async def revoke_all_tokens(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    tenant: str,
+    username: str | None = None,
+) -> RevokeAllTokensResult:
+    return await executor.query_single(
+        """\
+        WITH
+        	tenant := (SELECT Tenant FILTER .name = <str>$tenant),
+        	username := <optional str>$username,
+        	refresh_tokens := (
+        		DELETE RefreshToken FILTER .tenant = tenant AND ((.user.username = username) ?? true)
+        	),
+        SELECT (
+        	INSERT RevocationRule {
+        		tenant := tenant,
+        		username := username,
+        		not_before := datetime_of_statement(),
+        	}
+        ) {
+        	not_before,
+        	refresh_tokens := count(refresh_tokens),
+        };\
+        """,
+        tenant=tenant,
+        username=username,
+    )
+
+
+async def revoke_refresh_token_family(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    family: uuid.UUID,
+) -> list[CreateRefreshTokenResult]:
+    return await executor.query(
+        """\
+        DELETE RefreshToken FILTER .family = <uuid>$family;\
+        """,
+        family=family,
+    )
+
+
+async def revoke_token(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    jti: str,
+    expires_at: datetime.datetime,
+) -> RevokeTokenResult | None:
+    return await executor.query_single(
+        """\
+        INSERT RevokedToken {
+        	jti := <str>$jti,
+        	expires_at := <datetime>$expires_at,
+        } UNLESS CONFLICT ON .jti;\
+        """,
+        jti=jti,
+        expires_at=expires_at,
+    )
+
+
+async def update_password_hash(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    id: uuid.UUID,
+    old_password_hash: str,
+    password_hash: str,
+) -> CreateUserResult | None:
+    return await executor.query_single(
+        """\
+        UPDATE User
+        FILTER .id = <uuid>$id AND .password_hash = <str>$old_password_hash
+        SET { password_hash := <str>$password_hash };\
+        """,
+        id=id,
+        old_password_hash=old_password_hash,
+        password_hash=password_hash,
+    )
+
+
 async def update_tenant(
     executor: edgedb.AsyncIOExecutor,
     *,
@@ -392,3 +847,35 @@ async def update_tenant(
         tenant=tenant,
         new_tenant=new_tenant,
     )
+
+
+async def use_refresh_token(
+    executor: edgedb.AsyncIOExecutor,
+    *,
+    token_hash: str,
+) -> UseRefreshTokenResult | None:
+    return await executor.query_single(
+        """\
+        SELECT (
+        	UPDATE RefreshToken
+        	FILTER .token_hash = <str>$token_hash AND NOT .used
+        	SET { used := true }
+        ) {
+        	family,
+        	expires_at,
+        	user: {
+        		username,
+        		email,
+        		disabled,
+        		tenant: {
+        		 name
+        		},
+        		roles: {
+        		  name,
+        		  scopes
+        		}
+        	}
+        };\
+        """,
+        token_hash=token_hash,
+    )
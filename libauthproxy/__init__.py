@@ -1,89 +1,392 @@
-from datetime import timedelta, datetime
+import json
+from datetime import timedelta, datetime, timezone
+from functools import partial
+from math import floor
 from os import environ
+from time import perf_counter
+from uuid import uuid4
 
-from edgedb import AsyncIOClient
-from fastapi import Depends, HTTPException
-from fastapi.security import OAuth2PasswordBearer
+from edgedb import AsyncIOClient, EdgeDBError, RetryOptions, create_async_client
+from fastapi import Depends, FastAPI, HTTPException
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from starlette import status
 from typing_extensions import Annotated
 
-from db import get_user_by_username, GetUserByUsernameResult
-from libauthproxy.utils import catch, L
-
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
-OAUTH2 = OAuth2PasswordBearer(tokenUrl="token")
+from db import GetUserByUsernameResult, CheckSessionResult, update_password_hash
+from libauthproxy.cache import ReadCache, TokenCache, TokenCacheEntry
+from libauthproxy.claims import ScopeDictionaries
+from libauthproxy.hashing import HasherOverloaded, PasswordHasher, PasswordPolicies, crypt_context
+from libauthproxy.invalidation import EdgeDBPollTransport, InvalidationBus, UnixSocketTransport
+from libauthproxy.jwt_backends import JWTBackend, create_jwt_backend
+from libauthproxy.keys import KeySet, load_key_set
+from libauthproxy.metrics import JWT_SECONDS
+from libauthproxy.ratelimit import LoginRateLimiter, TokenBuckets
+from libauthproxy.queries import check_session, get_user_by_username
+from libauthproxy.revocation import RevocationList
+from libauthproxy.utils import catch, L, OAUTH2
 
 # to get a string like this run:
 # openssl rand -hex 32
 SECRET_KEY = environ.get("SECRET_KEY")
 JWT_ALGORITHM = environ.get("JWT_ALGORITHM", "HS256")
+# jose, or hmac for the precomputed HS256/HS384/HS512 implementation
+JWT_BACKEND = environ.get("JWT_BACKEND", "jose")
+# when set, tokens are signed with this PEM key (RSA, EC or Ed25519) instead of $SECRET_KEY
+JWT_PRIVATE_KEY = environ.get("JWT_PRIVATE_KEY")
+# defaults to the RFC 7638 thumbprint of the key
+JWT_KEY_ID = environ.get("JWT_KEY_ID")
+# comma separated PEM files of retired keys that tokens may still be verified with
+JWT_PUBLIC_KEYS = [path for path in environ.get("JWT_PUBLIC_KEYS", "").split(",") if path]
+JWKS_MAX_AGE = int(environ.get("JWKS_MAX_AGE", "300"))
 ACCESS_TOKEN_EXPIRY = int(environ.get("ACCESS_TOKEN_EXPIRY", "3600"))
+# full, or compact to replace the scopes by a bitmap over the tenant's scope dictionary and leave out the email
+TOKEN_CLAIMS = environ.get("TOKEN_CLAIMS", "full")
+# 0 disables refresh tokens
+REFRESH_TOKEN_EXPIRY = int(environ.get("REFRESH_TOKEN_EXPIRY", str(30 * 24 * 3600)))
 ADMIN_USERNAME = environ.get("ADMIN_USERNAME")
 ADMIN_PASSWORD = environ.get("ADMIN_PASSWORD")
 HOST = environ.get("HOST", "0.0.0.0")
 PORT = int(environ.get("PORT", "1337"))
 DEBUG = bool(environ.get("DEBUG", ""))
+# 0 lets the client use the concurrency the server suggests
+DB_MAX_CONCURRENCY = int(environ.get("DB_MAX_CONCURRENCY", "0"))
+# seconds to establish a connection, and to keep retrying when the server is unavailable
+DB_CONNECT_TIMEOUT = int(environ.get("DB_CONNECT_TIMEOUT", "10"))
+DB_WAIT_UNTIL_AVAILABLE = int(environ.get("DB_WAIT_UNTIL_AVAILABLE", "30"))
+# attempts for queries and transactions that fail with a transient error
+DB_RETRY_ATTEMPTS = int(environ.get("DB_RETRY_ATTEMPTS", "3"))
+# connections opened on startup, /readyz answers 503 until they are
+DB_WARM_CONNECTIONS = int(environ.get("DB_WARM_CONNECTIONS", "4"))
+# where Prometheus scrapes the metrics of the worker it reaches, empty disables the instrumentation
+METRICS_PATH = environ.get("METRICS_PATH", "/metrics")
+# 0 means one worker process per core
+WORKERS = int(environ.get("WORKERS", "0"))
+BACKLOG = int(environ.get("BACKLOG", "2048"))
+KEEP_ALIVE_TIMEOUT = int(environ.get("KEEP_ALIVE_TIMEOUT", "5"))
+# the reverse proxies whose X-Forwarded-For and X-Forwarded-Proto are trusted, comma separated or *
+FORWARDED_ALLOW_IPS = environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+# one of inline, thread or process
+PASSWORD_EXECUTOR = environ.get("PASSWORD_EXECUTOR", "thread")
+# 0 means one worker per core
+PASSWORD_WORKERS = int(environ.get("PASSWORD_WORKERS", "0"))
+PASSWORD_QUEUE_SIZE = int(environ.get("PASSWORD_QUEUE_SIZE", "64"))
+# whether POST /users and /users/import accept a plaintext password: off, tls (https as seen by
+# uvicorn, which honours X-Forwarded-Proto from --forwarded-allow-ips) or any for local development
+PLAINTEXT_PASSWORDS = environ.get("PLAINTEXT_PASSWORDS", "tls")
+# JSON object of passlib CryptContext arguments, argon2 needs argon2-cffi installed
+PASSWORD_POLICY = environ.get("PASSWORD_POLICY", '{"schemes": ["bcrypt"], "deprecated": "auto"}')
+# JSON object of tenant name -> CryptContext arguments for the tenants that hash differently
+PASSWORD_TENANT_POLICIES = environ.get("PASSWORD_TENANT_POLICIES", "{}")
+# login attempts per second and burst per client address, tenant and user, a rate of 0 disables the limit;
+# off per address by default, behind a reverse proxy not named in FORWARDED_ALLOW_IPS all logins share its address
+LOGIN_IP_RATE = float(environ.get("LOGIN_IP_RATE", "0"))
+LOGIN_IP_BURST = float(environ.get("LOGIN_IP_BURST", "20"))
+LOGIN_TENANT_RATE = float(environ.get("LOGIN_TENANT_RATE", "50"))
+LOGIN_TENANT_BURST = float(environ.get("LOGIN_TENANT_BURST", "200"))
+LOGIN_USER_RATE = float(environ.get("LOGIN_USER_RATE", "0.2"))
+LOGIN_USER_BURST = float(environ.get("LOGIN_USER_BURST", "10"))
+# keys each login limit keeps track of before it starts evicting idle ones
+LOGIN_RATE_LIMIT_SLOTS = int(environ.get("LOGIN_RATE_LIMIT_SLOTS", "65536"))
+# a size of 0 disables the verified-token cache
+TOKEN_CACHE_SIZE = int(environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(environ.get("TOKEN_CACHE_TTL", "30"))
+TOKEN_CACHE_NEGATIVE_SIZE = int(environ.get("TOKEN_CACHE_NEGATIVE_SIZE", "1000"))
+TOKEN_CACHE_NEGATIVE_TTL = float(environ.get("TOKEN_CACHE_NEGATIVE_TTL", "5"))
+# caches the admin read routes, a size of 0 disables it
+READ_CACHE_SIZE = int(environ.get("READ_CACHE_SIZE", "10000"))
+READ_CACHE_TTL = float(environ.get("READ_CACHE_TTL", "60"))
+# workers on one host broadcast cache invalidations through datagram sockets in this directory
+INVALIDATION_SOCKET_DIR = environ.get("INVALIDATION_SOCKET_DIR", "")
+# seconds between polling EdgeDB for the invalidations of other hosts, 0 disables it
+INVALIDATION_POLL_INTERVAL = float(environ.get("INVALIDATION_POLL_INTERVAL", "0"))
+# makes /auth look up whether the user still exists and is enabled instead of trusting the token alone
+FORWARD_AUTH_CHECK_USER = bool(environ.get("FORWARD_AUTH_CHECK_USER", ""))
+# JSON list of {"prefix": ..., "upstream": ..., "scopes": [...], "strip_prefix": false} used by the proxy mode
+PROXY_ROUTES = environ.get("PROXY_ROUTES", "")
+PROXY_MAX_CONNECTIONS = int(environ.get("PROXY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE_CONNECTIONS = int(environ.get("PROXY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+PROXY_KEEPALIVE_EXPIRY = float(environ.get("PROXY_KEEPALIVE_EXPIRY", "5"))
+PROXY_TIMEOUT = float(environ.get("PROXY_TIMEOUT", "30"))
+LIST_PAGE_SIZE = int(environ.get("LIST_PAGE_SIZE", "100"))
+LIST_MAX_PAGE_SIZE = int(environ.get("LIST_MAX_PAGE_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(environ.get("IMPORT_BATCH_SIZE", "500"))
+# seconds between loading newly revoked tokens, 0 disables revocation checks
+REVOCATION_REFRESH_INTERVAL = float(environ.get("REVOCATION_REFRESH_INTERVAL", "5"))
+
+
+DEFAULT_JWT_BACKEND = create_jwt_backend(JWT_BACKEND)
+
+
+def create_password_policies(
+        default: str | dict = PASSWORD_POLICY,
+        tenants: str | dict = PASSWORD_TENANT_POLICIES
+) -> PasswordPolicies:
+    return PasswordPolicies(
+        json.loads(default) if isinstance(default, str) else default,
+        json.loads(tenants) if isinstance(tenants, str) else tenants,
+    )
+
+
+DEFAULT_PASSWORD_POLICIES = create_password_policies()
+PWD_CONTEXT = crypt_context(DEFAULT_PASSWORD_POLICIES.default)
+
+
+def create_db_client(
+        max_concurrency: int = DB_MAX_CONCURRENCY,
+        timeout: int = DB_CONNECT_TIMEOUT,
+        wait_until_available: int = DB_WAIT_UNTIL_AVAILABLE,
+        retry_attempts: int = DB_RETRY_ATTEMPTS
+) -> AsyncIOClient:
+    client = create_async_client(
+        max_concurrency=max_concurrency or None,
+        timeout=timeout,
+        wait_until_available=wait_until_available,
+    )
+    return client.with_retry_options(RetryOptions(attempts=retry_attempts))
+
+
+def verify_password(plain_password, hashed_password, policy: str | None = None):
+    context = crypt_context(policy) if policy else PWD_CONTEXT
+    return context.verify(plain_password, hashed_password)
+
+
+def hash_password(plain_password: str, policy: str | None = None) -> str:
+    context = crypt_context(policy) if policy else PWD_CONTEXT
+    return context.hash(plain_password)
 
 
-def verify_password(plain_password, hashed_password):
-    return PWD_CONTEXT.verify(plain_password, hashed_password)
+def create_password_hasher(
+        mode: str = PASSWORD_EXECUTOR,
+        workers: int = PASSWORD_WORKERS,
+        queue_size: int = PASSWORD_QUEUE_SIZE
+) -> PasswordHasher:
+    return PasswordHasher(verify_password, hash_password, mode=mode, workers=workers, queue_size=queue_size)
 
 
-def hash_password(plain_password: str) -> str:
-    return PWD_CONTEXT.hash(plain_password)
+def create_login_rate_limiter(
+        ip: tuple[float, float] = (LOGIN_IP_RATE, LOGIN_IP_BURST),
+        tenant: tuple[float, float] = (LOGIN_TENANT_RATE, LOGIN_TENANT_BURST),
+        user: tuple[float, float] = (LOGIN_USER_RATE, LOGIN_USER_BURST),
+        slots: int = LOGIN_RATE_LIMIT_SLOTS
+) -> LoginRateLimiter:
+    def buckets(rate: float, burst: float) -> TokenBuckets | None:
+        return TokenBuckets(rate, burst, slots) if rate > 0 else None
+
+    return LoginRateLimiter(ip=buckets(*ip), tenant=buckets(*tenant), user=buckets(*user))
+
+
+def create_token_cache(
+        maxsize: int = TOKEN_CACHE_SIZE,
+        ttl: float = TOKEN_CACHE_TTL,
+        negative_maxsize: int = TOKEN_CACHE_NEGATIVE_SIZE,
+        negative_ttl: float = TOKEN_CACHE_NEGATIVE_TTL
+) -> TokenCache | None:
+    if maxsize <= 0:
+        return None
+    return TokenCache(maxsize=maxsize, ttl=ttl, negative_maxsize=negative_maxsize, negative_ttl=negative_ttl)
+
+
+def create_read_cache(maxsize: int = READ_CACHE_SIZE, ttl: float = READ_CACHE_TTL) -> ReadCache:
+    return ReadCache(maxsize=maxsize, ttl=ttl)
+
+
+def create_invalidation_bus(
+        db: AsyncIOClient,
+        socket_dir: str = INVALIDATION_SOCKET_DIR,
+        poll_interval: float = INVALIDATION_POLL_INTERVAL
+) -> InvalidationBus:
+    transports = []
+    if socket_dir:
+        transports.append(UnixSocketTransport(socket_dir))
+    if poll_interval > 0:
+        transports.append(EdgeDBPollTransport(db, poll_interval))
+    return InvalidationBus(transports)
+
+
+def create_revocation_list(refresh_interval: float = REVOCATION_REFRESH_INTERVAL) -> RevocationList | None:
+    if refresh_interval <= 0:
+        return None
+    return RevocationList(refresh_interval)
+
+
+async def upgrade_password_hash(db: AsyncIOClient, user: GetUserByUsernameResult, password: str, policy: str,
+                                hasher: PasswordHasher | None = None, invalidations: InvalidationBus | None = None):
+    try:
+        if hasher is None:
+            password_hash = hash_password(password, policy)
+        else:
+            password_hash = await hasher.hash(password, policy)
+        # only replaces the hash that was verified, a password change in the meantime wins
+        updated = await update_password_hash(db, id=user.id, old_password_hash=user.password_hash,
+                                             password_hash=password_hash)
+        if updated is not None and invalidations is not None:
+            await invalidations.publish("user", tenant=user.tenant.name, username=user.username)
+    except HasherOverloaded as err:
+        # the next login tries again
+        L.warning("upgrade_password_hash: Skipping the upgrade of user=%s, %s", user.id, err)
+    except EdgeDBError as err:
+        L.error("upgrade_password_hash(IV): Storing the new hash of user=%s failed=%s", user.id, err)
 
 
 async def authenticate_user(db: AsyncIOClient, username: str, password: str,
-                            tenant: str) -> bool | GetUserByUsernameResult:
+                            tenant: str, hasher: PasswordHasher | None = None,
+                            policies: PasswordPolicies | None = None,
+                            invalidations: InvalidationBus | None = None) -> bool | GetUserByUsernameResult:
+    policies = policies or DEFAULT_PASSWORD_POLICIES
     user = await get_user_by_username(db, username=username, tenant=tenant)
     if not user:
         return False
-    if not verify_password(password, user.password_hash):
+    policy = policies.policy(tenant)
+    if hasher is None:
+        verified = verify_password(password, user.password_hash, policy)
+    else:
+        verified = await hasher.verify(password, user.password_hash, policy)
+    if not verified:
         return False
+    if policies.needs_update(tenant, user.password_hash):
+        policies.upgrade_in_background(upgrade_password_hash(db, user, password, policy, hasher, invalidations))
     return user
 
 
-def create_access_token(secret: str, algorithm: str, data: dict, expires_delta: timedelta):
+def create_key_set(
+        private_key: str | None = JWT_PRIVATE_KEY,
+        key_id: str | None = JWT_KEY_ID,
+        public_keys: list[str] = JWT_PUBLIC_KEYS,
+        algorithm: str = JWT_ALGORITHM
+) -> KeySet | None:
+    if not private_key:
+        return None
+    return load_key_set(private_key, key_id, public_keys, algorithm)
+
+
+def create_access_token(secret: str | KeySet, algorithm: str, data: dict, expires_delta: timedelta,
+                        backend: JWTBackend | None = None):
+    backend = backend or DEFAULT_JWT_BACKEND
     to_encode = data.copy()
-    expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, secret, algorithm=algorithm)
+    now = datetime.utcnow()
+    # milliseconds, so that revoke-all rules can tell tokens issued in the same second apart
+    issued_at = floor(now.replace(tzinfo=timezone.utc).timestamp() * 1000) / 1000
+    to_encode.update({"exp": now + expires_delta, "iat": issued_at, "jti": uuid4().hex})
+    start = perf_counter()
+    if isinstance(secret, KeySet):
+        key = secret.signing_key
+        encoded_jwt = backend.encode(to_encode, key.key, key.algorithm, headers={"kid": key.kid})
+    else:
+        encoded_jwt = backend.encode(to_encode, secret, algorithm)
+    JWT_SECONDS.labels("encode").observe(perf_counter() - start)
     return encoded_jwt
 
 
-async def get_current_user(
-        db: AsyncIOClient,
-        secret: str,
-        algorithm: str,
-        token: Annotated[str, Depends(OAUTH2)]
-):
-    credentials_exception = HTTPException(
+def verify_jwt(token: str, secret: str | KeySet, algorithm: str, backend: JWTBackend | None = None) -> dict:
+    backend = backend or DEFAULT_JWT_BACKEND
+    start = perf_counter()
+    try:
+        if isinstance(secret, KeySet):
+            key = secret.get(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise JWTError("Unknown key id")
+            return backend.decode(token, key.verifier, [key.algorithm])
+        return backend.decode(token, secret, [algorithm])
+    finally:
+        JWT_SECONDS.labels("decode").observe(perf_counter() - start)
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_access_token(secret: str | KeySet, algorithm: str, token: str, cache: TokenCache | None = None,
+                        revocations: RevocationList | None = None) -> TokenCacheEntry:
+    digest = None
+    if cache is not None:
+        digest = cache.digest(token)
+        entry = cache.get(digest)
+        if entry is not None:
+            if not entry.valid:
+                raise credentials_exception()
+            if revocations is not None and revocations.is_revoked(entry.claims):
+                L.error("decode_access_token(IV): Token was revoked (username,tenant)=%s",
+                        (entry.claims["sub"], entry.claims["tenant"]))
+                cache.set_invalid(digest)
+                raise credentials_exception()
+            return entry
+
     with catch(JWTError) as errs:
-        payload = jwt.decode(token, secret, algorithms=[algorithm])
+        payload = verify_jwt(token, secret, algorithm)
         username: str = payload.get("sub")
         tenant: str = payload.get("tenant")
 
         if not username or not tenant:
-            L.error("get_current_user(IV): Username or tenant not set (username,tenant)=%s", (username, tenant))
-            raise credentials_exception
+            L.error("decode_access_token(IV): Username or tenant not set (username,tenant)=%s", (username, tenant))
+            if cache is not None:
+                cache.set_invalid(digest)
+            raise credentials_exception()
 
+        if revocations is not None and revocations.is_revoked(payload):
+            L.error("decode_access_token(IV): Token was revoked (username,tenant)=%s", (username, tenant))
+            if cache is not None:
+                cache.set_invalid(digest)
+            raise credentials_exception()
+
+        if cache is not None:
+            return cache.set_valid(digest, payload)
+        return TokenCacheEntry(payload)
+
+    if errs.err:
+        L.error("decode_access_token(IV): Something went wrong=%s", errs.err)
+        if cache is not None:
+            cache.set_invalid(digest)
+        raise credentials_exception()
+
+
+async def get_current_user(
+        db: AsyncIOClient,
+        secret: str | KeySet,
+        algorithm: str,
+        token: Annotated[str, Depends(OAUTH2)],
+        cache: TokenCache | None = None,
+        revocations: RevocationList | None = None,
+) -> GetUserByUsernameResult:
+    entry = decode_access_token(secret, algorithm, token, cache, revocations)
+    if entry.user is None:
+        username, tenant = entry.claims["sub"], entry.claims["tenant"]
         user = await get_user_by_username(db, username=username, tenant=tenant)
 
         if user is None:
             L.error("get_current_user(IV): User not found for (username,tenant)=%s", (username, tenant))
-            raise credentials_exception
+            if cache is not None:
+                cache.set_invalid(entry.digest)
+            raise credentials_exception()
 
-        return user
+        entry.user = user
+    return entry.user
 
-    if errs.err:
-        L.error("get_current_user(IV): Something went wrong=%s", errs.err)
-        raise credentials_exception
+
+async def get_current_session(
+        db: AsyncIOClient,
+        secret: str | KeySet,
+        algorithm: str,
+        token: Annotated[str, Depends(OAUTH2)],
+        cache: TokenCache | None = None,
+        revocations: RevocationList | None = None,
+) -> CheckSessionResult:
+    entry = decode_access_token(secret, algorithm, token, cache, revocations)
+    if entry.session is None:
+        username, tenant = entry.claims["sub"], entry.claims["tenant"]
+        session = await check_session(db, username=username, tenant=tenant)
+
+        if session is None:
+            L.error("get_current_session(IV): User not found for (username,tenant)=%s", (username, tenant))
+            if cache is not None:
+                cache.set_invalid(entry.digest)
+            raise credentials_exception()
+
+        entry.session = session
+    return entry.session
 
 
 def get_current_active_user(
@@ -92,3 +395,60 @@ def get_current_active_user(
     if current_user.disabled:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
     return current_user
+
+
+class TokenValidator:
+    """
+    How both apps validate bearer tokens, so that every path checks the same: the signature, the
+    revocations and, for compact tokens, that their scope dictionary resolves.
+    """
+
+    def __init__(self, key_set: KeySet | None, secret_key: str | KeySet, jwt_algorithm: str,
+                 token_cache: TokenCache | None, revocations: RevocationList | None,
+                 scope_dictionaries: ScopeDictionaries):
+        self.key_set = key_set
+        self.secret_key = secret_key
+        self.jwt_algorithm = jwt_algorithm
+        self.token_cache = token_cache
+        self.revocations = revocations
+        self.scope_dictionaries = scope_dictionaries
+
+    async def validate(self, token: str) -> TokenCacheEntry:
+        entry = decode_access_token(self.secret_key, self.jwt_algorithm, token, self.token_cache, self.revocations)
+        if not await self.scope_dictionaries.expand(entry):
+            raise credentials_exception()
+        return entry
+
+
+def register_token_validator(app: FastAPI, db: AsyncIOClient | None, **kwargs) -> TokenValidator:
+    """
+    Sets up token validation from the same kwargs and environment as register_routes. Without a
+    db there are no revocations to load and compact tokens cannot be resolved.
+    """
+    jwt_algorithm = kwargs.get("jwt_algorithm", JWT_ALGORITHM)
+    key_set = kwargs.get("key_set") or create_key_set(
+        private_key=kwargs.get("jwt_private_key", JWT_PRIVATE_KEY),
+        key_id=kwargs.get("jwt_key_id", JWT_KEY_ID),
+        public_keys=kwargs.get("jwt_public_keys", JWT_PUBLIC_KEYS),
+        algorithm=jwt_algorithm,
+    )
+    # the key set takes precedence over the shared secret
+    secret_key = key_set or kwargs.get("secret_key", SECRET_KEY)
+    token_cache = kwargs.get("token_cache") or create_token_cache(
+        maxsize=kwargs.get("token_cache_size", TOKEN_CACHE_SIZE),
+        ttl=kwargs.get("token_cache_ttl", TOKEN_CACHE_TTL),
+        negative_maxsize=kwargs.get("token_cache_negative_size", TOKEN_CACHE_NEGATIVE_SIZE),
+        negative_ttl=kwargs.get("token_cache_negative_ttl", TOKEN_CACHE_NEGATIVE_TTL),
+    )
+    revocations = kwargs.get("revocations")
+    if revocations is None and db is not None:
+        revocations = create_revocation_list(kwargs.get("revocation_refresh_interval", REVOCATION_REFRESH_INTERVAL))
+    if revocations is not None and db is not None:
+        app.add_event_handler("startup", partial(revocations.start, db))
+        app.add_event_handler("shutdown", revocations.stop)
+    # tokens of either claims mode are accepted, so switching modes does not log anybody out
+    scope_dictionaries = kwargs.get("scope_dictionaries") or ScopeDictionaries(db)
+    validator = TokenValidator(key_set, secret_key, jwt_algorithm, token_cache, revocations, scope_dictionaries)
+    # what require_scopes validates tokens with
+    app.state.decode_token = validator.validate
+    return validator
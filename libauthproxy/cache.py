@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+
+from libauthproxy.singleflight import SingleFlight
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A size bounded LRU mapping whose entries expire after `ttl` seconds.
+
+    Not thread safe, it is meant to be used from a single event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        deadline, value = item
+        if deadline <= monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def values(self) -> Iterable:
+        return [value for _, value in self._data.values()]
+
+    def clear(self):
+        self._data.clear()
+
+
+class TokenCacheEntry:
+    """
+    What is known about a token: its claims and, once somebody needed them, the session or the
+    full user it resolves to and its compiled scopes.
+    """
+    __slots__ = ("digest", "claims", "session", "user", "scope_set")
+
+    def __init__(self, claims: Optional[dict] = None, digest: Optional[bytes] = None):
+        self.digest = digest
+        self.claims = claims
+        self.session = None
+        self.user = None
+        self.scope_set = None
+
+    @property
+    def valid(self) -> bool:
+        return self.claims is not None
+
+
+INVALID_TOKEN = TokenCacheEntry()
+
+
+class TokenCache:
+    """
+    Validated bearer tokens by digest, until their `exp` or `ttl`. Invalid tokens go into a
+    smaller LRU of their own, so garbage tokens cannot evict the valid ones.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30, negative_maxsize: int = 1000,
+                 negative_ttl: float = 5):
+        self.positive = LRUCache(maxsize, ttl)
+        self.negative = LRUCache(negative_maxsize, negative_ttl)
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, digest: bytes) -> Optional[TokenCacheEntry]:
+        entry = self.positive.get(digest)
+        if entry is None:
+            entry = self.negative.get(digest)
+        return entry
+
+    def set_valid(self, digest: bytes, claims: dict) -> TokenCacheEntry:
+        entry = TokenCacheEntry(claims, digest)
+        exp = claims.get("exp")
+        self.positive.set(digest, entry, ttl=None if exp is None else exp - time())
+        return entry
+
+    def set_invalid(self, digest: bytes):
+        self.positive.pop(digest)
+        self.negative.set(digest, INVALID_TOKEN)
+
+    def _forget_resolved(self, matches: Callable[[dict], bool]):
+        # the claims stay valid, only what was looked up for them may have changed
+        for entry in self.positive.values():
+            if matches(entry.claims):
+                entry.session = None
+                entry.user = None
+
+    def invalidate_tenant(self, tenant: str):
+        self._forget_resolved(lambda claims: claims.get("tenant") == tenant)
+
+    def invalidate_user(self, tenant: str, username: str):
+        self.invalidate_users(tenant, (username,))
+
+    def invalidate_roles(self, tenant: str, **_):
+        # users embed their roles, and who holds a role is not known here
+        self.invalidate_tenant(tenant)
+
+    def invalidate_users(self, tenant: str, usernames: Iterable[str]):
+        usernames = set(usernames)
+        self._forget_resolved(lambda claims: claims.get("tenant") == tenant and claims.get("sub") in usernames)
+
+    def clear(self):
+        self.positive.clear()
+        self.negative.clear()
+
+
+class ReadCache:
+    """
+    Caches the admin reads and the first page of each list. Keys embed the versions of the tenant,
+    roles and users they depend on, so a write bumps a version and the stale entries age out.
+    A `maxsize` of 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.lru = LRUCache(maxsize, ttl)
+        self.writes = 0
+        self.flight = SingleFlight("read_cache")
+        self._versions: dict[Hashable, int] = {}
+
+    def _version(self, namespace: Hashable) -> int:
+        return self._versions.get(namespace, 0)
+
+    def _bump(self, namespace: Hashable):
+        self._versions[namespace] = self._version(namespace) + 1
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        value = self.lru.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        # misses only share a fetch that started after the latest write
+        return await self.flight.do((key, self.writes), self._fetch, key, fetch)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        writes = self.writes
+        value = await fetch()
+        # a fetch that overlapped a write may have read either side of it
+        if writes == self.writes:
+            self.lru.set(key, value)
+        return value
+
+    def tenant_key(self, tenant: str) -> Hashable:
+        return "tenant", tenant
+
+    def tenants_key(self, limit: int) -> Hashable:
+        return "tenants", self._version("tenants"), limit
+
+    def role_key(self, tenant: str, name: str) -> Hashable:
+        return "role", self._version(("tenant", tenant)), tenant, name
+
+    def roles_key(self, tenant: str, limit: int) -> Hashable:
+        return "roles", self._version(("tenant", tenant)), self._version(("roles", tenant)), tenant, limit
+
+    def user_key(self, tenant: str, username: str) -> Hashable:
+        return "user", self._version(("tenant", tenant)), self._version(("roles", tenant)), tenant, username
+
+    def users_key(self, tenant: str, limit: int) -> Hashable:
+        return ("users", self._version(("tenant", tenant)), self._version(("roles", tenant)),
+                self._version(("users", tenant)), tenant, limit)
+
+    def invalidate_tenant(self, tenant: str):
+        self.writes += 1
+        self.lru.pop(self.tenant_key(tenant))
+        self._bump(("tenant", tenant))
+        self._bump("tenants")
+
+    def invalidate_role(self, tenant: str, name: str):
+        self.writes += 1
+        self.lru.pop(self.role_key(tenant, name))
+        self._bump(("roles", tenant))
+
+    def invalidate_user(self, tenant: str, username: str):
+        self.writes += 1
+        self.lru.pop(self.user_key(tenant, username))
+        self._bump(("users", tenant))
+
+    def invalidate_roles(self, tenant: str, names: Iterable[str]):
+        for name in names:
+            self.invalidate_role(tenant, name)
+
+    def invalidate_users(self, tenant: str, usernames: Iterable[str]):
+        for username in usernames:
+            self.invalidate_user(tenant, username)
+
+    def clear(self):
+        self.writes += 1
+        self.lru.clear()
@@ -0,0 +1,129 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+from edgedb import AsyncIOClient
+
+from db import create_scope_dictionary
+from libauthproxy.cache import LRUCache, TokenCacheEntry
+from libauthproxy.queries import list_scopes, read_scope_dictionary
+from libauthproxy.scopes import normalize_scope
+from libauthproxy.utils import L
+
+CLAIMS_MODES = ("full", "compact")
+# the claims a compact token carries instead of "scopes"
+VERSION_CLAIM = "sv"
+BITMAP_CLAIM = "sb"
+
+
+def encode_bitmap(indexes: Iterable[int]) -> str:
+    bits = 0
+    for index in indexes:
+        bits |= 1 << index
+    return urlsafe_b64encode(bits.to_bytes((bits.bit_length() + 7) // 8, "little")).rstrip(b"=").decode()
+
+
+def decode_bitmap(bitmap: str) -> int:
+    return int.from_bytes(urlsafe_b64decode(bitmap + "=" * (-len(bitmap) % 4)), "little")
+
+
+class ScopeDictionary:
+    """
+    Every scope of a tenant's roles, sorted, so that a token can carry the indexes of its scopes
+    as a bitmap. The version is a hash of the content, so every worker that builds the dictionary
+    from the same roles arrives at the same version without coordinating.
+    """
+    __slots__ = ("version", "scopes", "_index")
+
+    def __init__(self, scopes: Iterable[str]):
+        self.scopes = tuple(sorted({normalize_scope(scope) for scope in scopes} - {""}))
+        self.version = blake2b(json.dumps(self.scopes).encode(), digest_size=8).hexdigest()
+        self._index = {scope: i for i, scope in enumerate(self.scopes)}
+
+    def encode(self, scopes: Iterable[str]) -> Optional[str]:
+        """
+        :return: None if one of `scopes` is not in the dictionary.
+        """
+        try:
+            return encode_bitmap(self._index[scope] for scope in scopes)
+        except KeyError:
+            return None
+
+    def decode(self, bitmap: str) -> list[str]:
+        bits = decode_bitmap(bitmap)
+        return [scope for i, scope in enumerate(self.scopes) if bits >> i & 1]
+
+
+class ScopeDictionaries:
+    """
+    The current scope dictionary of every tenant that issued tokens here, and the versions that
+    tokens referred to. Versions are stored in EdgeDB when first used, so that any instance can
+    resolve the tokens of any other, and are immutable, so they are only evicted for space.
+
+    :param db: None makes every compact token unresolvable, for proxies without a database.
+    """
+
+    def __init__(self, db: Optional[AsyncIOClient], maxsize: int = 1024):
+        self.db = db
+        self._current: dict[str, ScopeDictionary] = {}
+        self._versions = LRUCache(maxsize, float("inf"))
+
+    async def current(self, tenant: str) -> ScopeDictionary:
+        dictionary = self._current.get(tenant)
+        if dictionary is None:
+            dictionary = ScopeDictionary(await list_scopes(self.db, tenant=tenant))
+            if self._versions.get((tenant, dictionary.version)) is None:
+                await create_scope_dictionary(self.db, tenant=tenant, version=dictionary.version,
+                                              scopes=list(dictionary.scopes))
+                self._versions.set((tenant, dictionary.version), dictionary)
+            self._current[tenant] = dictionary
+        return dictionary
+
+    def invalidate(self, tenant: str, **_):
+        self._current.pop(tenant, None)
+
+    async def compact(self, tenant: str, scopes: list[str]) -> Optional[dict]:
+        """
+        :return: The claims that stand for `scopes`, or None if they cannot be encoded, in which
+            case the token has to carry them in full.
+        """
+        dictionary = await self.current(tenant)
+        bitmap = dictionary.encode(scopes)
+        if bitmap is None:
+            # a role gained a scope since the dictionary was built
+            self.invalidate(tenant)
+            dictionary = await self.current(tenant)
+            bitmap = dictionary.encode(scopes)
+        if bitmap is None:
+            L.warning("ScopeDictionaries: Scopes of a login in tenant=%s changed while issuing, using full claims",
+                      tenant)
+            return None
+        return {VERSION_CLAIM: dictionary.version, BITMAP_CLAIM: bitmap}
+
+    async def version(self, tenant: str, version: str) -> Optional[ScopeDictionary]:
+        dictionary = self._versions.get((tenant, version))
+        if dictionary is None and self.db is not None:
+            scopes = await read_scope_dictionary(self.db, tenant=tenant, version=version)
+            if scopes is not None:
+                dictionary = ScopeDictionary(scopes)
+                self._versions.set((tenant, version), dictionary)
+        return dictionary
+
+    async def expand(self, entry: TokenCacheEntry) -> bool:
+        """
+        Puts the "scopes" of a compact token into its claims, once per cache entry.
+
+        :return: False if the token refers to a dictionary that cannot be found.
+        """
+        claims = entry.claims
+        if "scopes" in claims or BITMAP_CLAIM not in claims:
+            return True
+        dictionary = await self.version(claims["tenant"], claims.get(VERSION_CLAIM, ""))
+        if dictionary is None:
+            L.error("ScopeDictionaries(IV): Unknown scope dictionary of (tenant,version)=%s",
+                    (claims["tenant"], claims.get(VERSION_CLAIM)))
+            return False
+        claims["scopes"] = dictionary.decode(claims[BITMAP_CLAIM])
+        entry.scope_set = None
+        return True
@@ -0,0 +1,157 @@
+import asyncio
+import json
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from os import cpu_count
+from time import perf_counter
+from functools import lru_cache
+from typing import Callable, Coroutine, Optional
+
+from passlib.context import CryptContext
+
+from libauthproxy.metrics import PASSWORD_QUEUE_SECONDS, PASSWORD_SECONDS
+
+EXECUTOR_MODES = ("inline", "thread", "process")
+
+
+class HasherOverloaded(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def crypt_context(policy: str) -> CryptContext:
+    """
+    :param policy: JSON object of CryptContext keyword arguments. Policies travel to the workers as
+        strings, so every process builds each context once.
+    """
+    return CryptContext(**json.loads(policy))
+
+
+class PasswordPolicies:
+    """
+    The passlib policy of every tenant, falling back to `default`. New hashes use the first scheme
+    of a policy, hashes with another scheme or other settings verify as long as their scheme is
+    listed too, and are replaced after the next successful login.
+
+    :param default: CryptContext keyword arguments, e.g. {"schemes": ["argon2", "bcrypt"],
+        "deprecated": "auto", "argon2__memory_cost": 65536}.
+    :param tenants: Tenant name -> CryptContext keyword arguments.
+    """
+
+    def __init__(self, default: dict, tenants: Optional[dict[str, dict]] = None):
+        self.default = json.dumps(default, sort_keys=True)
+        self.tenants = {tenant: json.dumps(policy, sort_keys=True) for tenant, policy in (tenants or {}).items()}
+        # building the contexts up front fails on startup on a typo instead of on the first login
+        for policy in (self.default, *self.tenants.values()):
+            crypt_context(policy)
+        self.upgrades = 0
+        self._upgrading: set[asyncio.Task] = set()
+
+    def policy(self, tenant: Optional[str]) -> str:
+        return self.tenants.get(tenant, self.default)
+
+    def needs_update(self, tenant: Optional[str], hashed_password: str) -> bool:
+        return crypt_context(self.policy(tenant)).needs_update(hashed_password)
+
+    def upgrade_in_background(self, upgrade: Coroutine) -> asyncio.Task:
+        """
+        Runs `upgrade` without making the login wait for it, and keeps a reference until it is done.
+        """
+        self.upgrades += 1
+        task = asyncio.ensure_future(upgrade)
+        self._upgrading.add(task)
+        task.add_done_callback(self._upgrading.discard)
+        return task
+
+
+def _timed(fn, *args):
+    # runs in the worker, so the caller can tell the time spent queueing from the time spent hashing
+    start = perf_counter()
+    return fn(*args), perf_counter() - start
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification off the event loop.
+
+    bcrypt releases the GIL, so the thread mode already scales across cores; the process mode
+    is there for hash schemes that do not. Every call waits only on its own job, and at most
+    `workers + queue_size` jobs are accepted at once, anything beyond that raises HasherOverloaded.
+
+    :param verify: A picklable callable (plain_password, hashed_password, *args) -> bool.
+    :param hash: A picklable callable (plain_password, *args) -> str. The extra arguments of
+        `verify` and `hash` are passed on, which is how the policy of a tenant gets to the worker.
+    :param mode: One of "inline", "thread" or "process".
+    :param workers: Size of the pool, defaults to the number of cores.
+    :param queue_size: How many jobs may wait for a free worker.
+    """
+
+    def __init__(
+            self,
+            verify: Callable[[str, str], bool],
+            hash: Callable[[str], str],
+            mode: str = "thread",
+            workers: Optional[int] = None,
+            queue_size: int = 64,
+    ):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"mode has to be one of {EXECUTOR_MODES}, got {mode!r}")
+        self._verify = verify
+        self._hash = hash
+        self.mode = mode
+        self.workers = workers or cpu_count() or 1
+        self.queue_size = queue_size
+        self.pending = 0
+        # moving average of the time a job spends in a worker
+        self.average_seconds = 0.0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.pending - self.workers)
+
+    def retry_after(self) -> float:
+        """
+        Roughly how long until the jobs that are pending now are done.
+        """
+        return self.pending * self.average_seconds / self.workers
+
+    def _observe(self, operation: str, seconds: float):
+        PASSWORD_SECONDS.labels(operation).observe(seconds)
+        self.average_seconds = seconds if not self.average_seconds else 0.9 * self.average_seconds + 0.1 * seconds
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwd")
+        return self._executor
+
+    async def _run(self, operation: str, fn, *args):
+        if self.mode == "inline":
+            result, seconds = _timed(fn, *args)
+            self._observe(operation, seconds)
+            return result
+        if self.pending >= self.workers + self.queue_size:
+            raise HasherOverloaded(f"{self.pending} password jobs pending")
+        self.pending += 1
+        start = perf_counter()
+        try:
+            result, seconds = await asyncio.get_running_loop().run_in_executor(self.executor, _timed, fn, *args)
+        finally:
+            self.pending -= 1
+        self._observe(operation, seconds)
+        PASSWORD_QUEUE_SECONDS.labels(operation).observe(max(0.0, perf_counter() - start - seconds))
+        return result
+
+    async def verify(self, plain_password: str, hashed_password: str, *args) -> bool:
+        return await self._run("verify", self._verify, plain_password, hashed_password, *args)
+
+    async def hash(self, plain_password: str, *args) -> str:
+        return await self._run("hash", self._hash, plain_password, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
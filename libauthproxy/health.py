@@ -0,0 +1,85 @@
+import asyncio
+from typing import Optional
+
+from edgedb import AsyncIOClient, EdgeDBError
+from fastapi import FastAPI
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from libauthproxy import HOST, PORT, DB_WARM_CONNECTIONS
+from libauthproxy.utils import L
+
+
+class Readiness:
+    """
+    Opens `warm_connections` pool connections before the app reports ready, so the first
+    requests after a deploy do not pay for the connection setup.
+    """
+
+    def __init__(self, db: AsyncIOClient, warm_connections: int):
+        self.db = db
+        self.warm_connections = warm_connections
+        self.ready = False
+        self._warming: Optional[asyncio.Task] = None
+
+    async def _warm_up(self):
+        try:
+            await self.db.ensure_connected()
+            # concurrent queries each check out a connection of their own
+            await asyncio.gather(*(self.db.query_single("SELECT 1") for _ in range(self.warm_connections)))
+        except (EdgeDBError, OSError) as err:
+            L.error("Readiness(IV): Warming up the EdgeDB pool failed=%s", err)
+            return
+        self.ready = True
+
+    def warm_up(self) -> asyncio.Task:
+        if self._warming is None or self._warming.done():
+            self._warming = asyncio.ensure_future(self._warm_up())
+        return self._warming
+
+    def pool(self) -> dict:
+        max_concurrency = self.db.max_concurrency
+        free = self.db.free_size
+        if not max_concurrency:
+            return {"max_concurrency": max_concurrency, "free": free, "in_use": None, "saturation": None}
+        return {
+            "max_concurrency": max_concurrency,
+            "free": free,
+            "in_use": max_concurrency - free,
+            "saturation": round((max_concurrency - free) / max_concurrency, 3),
+        }
+
+
+def register_health_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
+    host = kwargs.get("host", HOST)
+    port = kwargs.get("port", PORT)
+    readiness = Readiness(db, kwargs.get("db_warm_connections", DB_WARM_CONNECTIONS))
+    # how long a probe may wait for the pool to come up when the startup warm-up failed
+    readiness_timeout = kwargs.get("readiness_timeout", 1.0)
+
+    async def warm_up():
+        await readiness.warm_up()
+
+    app.add_event_handler("startup", warm_up)
+
+    L.info(f"Registering GET http://{host}:{port}/healthz")
+
+    async def handle_healthz(req: Request) -> Response:
+        return JSONResponse({"status": "ok"})
+
+    app.add_route("/healthz", handle_healthz, methods=["GET", "HEAD"], include_in_schema=False)
+
+    L.info(f"Registering GET http://{host}:{port}/readyz")
+
+    async def handle_readyz(req: Request) -> Response:
+        if not readiness.ready:
+            try:
+                await asyncio.wait_for(asyncio.shield(readiness.warm_up()), readiness_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if not readiness.ready:
+            return JSONResponse({"status": "unavailable"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return JSONResponse({"status": "ready", "pool": readiness.pool()})
+
+    app.add_route("/readyz", handle_readyz, methods=["GET", "HEAD"], include_in_schema=False)
@@ -0,0 +1,117 @@
+import json
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable, Type
+
+from edgedb import EdgeDBError
+from pydantic import BaseModel, ValidationError
+from starlette.requests import Request
+
+from libauthproxy.pagination import NDJSON_MEDIA_TYPE
+from libauthproxy.utils import L
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.errors: list[dict] = []
+        self.started = perf_counter()
+
+    def fail(self, row: int, err: Exception):
+        self.errors.append({"row": row, "error": str(err)})
+
+    def dict(self) -> dict:
+        seconds = perf_counter() - self.started
+        return {
+            "inserted": self.inserted,
+            "failed": len(self.errors),
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.inserted / seconds, 1) if seconds > 0 else None,
+        }
+
+
+async def iter_records(req: Request) -> AsyncIterator[tuple[int, dict | Exception]]:
+    """
+    Yields (row, record) from either an NDJSON body, which is parsed while it streams in,
+    or a JSON array. Rows that do not parse are yielded as the exception.
+    """
+    if NDJSON_MEDIA_TYPE in req.headers.get("content-type", ""):
+        row = 0
+        buffer = b""
+        async for chunk in req.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield row, _loads(line)
+                    row += 1
+        if buffer.strip():
+            yield row, _loads(buffer)
+        return
+
+    records = _loads(await req.body())
+    if not isinstance(records, list):
+        yield 0, ValueError("expected a JSON array or NDJSON")
+        return
+    for row, record in enumerate(records):
+        yield row, record
+
+
+def _loads(line: bytes) -> dict | Exception:
+    try:
+        return json.loads(line)
+    except ValueError as err:
+        return err
+
+
+async def import_records(
+        records: AsyncIterator[tuple[int, dict | Exception]],
+        model: Type[BaseModel],
+        tenant_of: Callable[[BaseModel], str],
+        insert_batch: Callable[[str, list[BaseModel]], Awaitable],
+        insert_one: Callable[[BaseModel], Awaitable],
+        batch_size: int,
+) -> dict:
+    """
+    Validates every record against `model` and inserts them in batches of `batch_size` per tenant,
+    so the tenant and its roles are resolved once per batch. If a batch is rejected its rows are
+    retried one by one, so that the report can point at the offending rows.
+    """
+    report = ImportReport()
+    batches: dict[str, list[tuple[int, BaseModel]]] = {}
+
+    async def flush(tenant: str, batch: list[tuple[int, BaseModel]]):
+        try:
+            await insert_batch(tenant, [item for _, item in batch])
+            report.inserted += len(batch)
+            return
+        except EdgeDBError as err:
+            L.warning("import_records: Batch of %s rows for tenant=%s failed, retrying row by row=%s",
+                      len(batch), tenant, err)
+        for row, item in batch:
+            try:
+                await insert_one(item)
+                report.inserted += 1
+            except EdgeDBError as err:
+                report.fail(row, err)
+
+    async for row, record in records:
+        if isinstance(record, Exception):
+            report.fail(row, record)
+            continue
+        try:
+            item = model.parse_obj(record)
+        except ValidationError as err:
+            report.fail(row, err)
+            continue
+        tenant = tenant_of(item)
+        batch = batches.setdefault(tenant, [])
+        batch.append((row, item))
+        if len(batch) >= batch_size:
+            await flush(tenant, batches.pop(tenant))
+
+    for tenant, batch in batches.items():
+        await flush(tenant, batch)
+
+    report.errors.sort(key=lambda e: e["row"])
+    return report.dict()
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import socket
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+from uuid import UUID, uuid4
+
+from edgedb import AsyncIOClient, EdgeDBError
+
+from db import list_changes, record_change
+from libauthproxy.utils import L
+
+Deliver = Callable[[dict], None]
+# bulk imports invalidate a whole batch with one message
+MAX_MESSAGE_SIZE = 1 << 20
+
+
+class Transport:
+    """
+    Carries invalidation messages to the other authproxy processes. Delivery is best effort,
+    the caches' TTLs bound how long a lost message leaves them stale.
+    """
+
+    async def start(self, deliver: Deliver):
+        pass
+
+    async def send(self, message: dict):
+        raise NotImplementedError()
+
+    async def stop(self):
+        pass
+
+
+class UnixSocketTransport(Transport):
+    """
+    Sends each message to the datagram sockets of the other workers of the host in `directory`.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.path = self.directory / f"{os.getpid()}.sock"
+        self._sock: Optional[socket.socket] = None
+
+    async def start(self, deliver: Deliver):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._sock.bind(str(self.path))
+        asyncio.get_running_loop().add_reader(self._sock.fileno(), self._read, deliver)
+
+    def _read(self, deliver: Deliver):
+        while True:
+            try:
+                data = self._sock.recv(MAX_MESSAGE_SIZE)
+            except BlockingIOError:
+                return
+            try:
+                deliver(json.loads(data))
+            except ValueError as err:
+                L.warning("UnixSocketTransport: Dropping malformed message=%s", err)
+
+    async def send(self, message: dict):
+        data = json.dumps(message, separators=(",", ":")).encode()
+        for peer in self.directory.glob("*.sock"):
+            if peer == self.path:
+                continue
+            try:
+                self._sock.sendto(data, str(peer))
+            except (ConnectionRefusedError, FileNotFoundError):
+                peer.unlink(missing_ok=True)
+            except OSError as err:
+                L.warning("UnixSocketTransport: Dropping message to %s=%s", peer, err)
+
+    async def stop(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+            self.path.unlink(missing_ok=True)
+
+
+class EdgeDBPollTransport(Transport):
+    """
+    Records every message in the Change table and polls it for the messages of other hosts.
+    """
+
+    def __init__(self, db: AsyncIOClient, interval: float, overlap: float = 5):
+        self.db = db
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.since: Optional[datetime] = None
+        self._seen: dict[UUID, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def poll(self, deliver: Deliver):
+        since = self.since - self.overlap if self.since is not None else None
+        result = await list_changes(self.db, since=since)
+        for change in result.changes:
+            if change.id in self._seen:
+                continue
+            self._seen[change.id] = change.created_at
+            if since is not None:
+                deliver(json.loads(change.event))
+        horizon = result.now - self.overlap
+        self._seen = {change_id: created_at for change_id, created_at in self._seen.items() if created_at > horizon}
+        self.since = result.now
+
+    async def _poll_forever(self, deliver: Deliver):
+        while True:
+            try:
+                await self.poll(deliver)
+            except EdgeDBError as err:
+                L.error("EdgeDBPollTransport(IV): Polling changes failed=%s", err)
+            await asyncio.sleep(self.interval)
+
+    async def start(self, deliver: Deliver):
+        self._task = asyncio.create_task(self._poll_forever(deliver))
+
+    async def send(self, message: dict):
+        await record_change(self.db, event=json.dumps(message, separators=(",", ":")))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class InvalidationBus:
+    """
+    Runs the subscribers of a kind of invalidation with its fields, here and in every other process.
+    """
+
+    def __init__(self, transports: Iterable[Transport] = ()):
+        self.origin = uuid4().hex
+        self.transports = list(transports)
+        self.published = 0
+        self.received = 0
+        self._subscribers: dict[str, list[Callable[..., None]]] = {}
+
+    def subscribe(self, kind: str, subscriber: Callable[..., None]):
+        self._subscribers.setdefault(kind, []).append(subscriber)
+
+    def _apply(self, kind: str, fields: dict):
+        for subscriber in self._subscribers.get(kind, ()):
+            subscriber(**fields)
+
+    def deliver(self, message: dict):
+        if message.get("origin") == self.origin:
+            return
+        try:
+            self._apply(message["kind"], message["fields"])
+        except (KeyError, TypeError) as err:
+            L.warning("InvalidationBus: Dropping malformed message=%s", err)
+            return
+        self.received += 1
+
+    async def publish(self, kind: str, **fields):
+        self._apply(kind, fields)
+        self.published += 1
+        message = {"origin": self.origin, "kind": kind, "fields": fields}
+        for transport in self.transports:
+            try:
+                await transport.send(message)
+            except (OSError, EdgeDBError) as err:
+                L.error("InvalidationBus(IV): Sending through %s failed=%s", type(transport).__name__, err)
+
+    async def start(self):
+        for transport in self.transports:
+            await transport.start(self.deliver)
+
+    async def stop(self):
+        for transport in self.transports:
+            await transport.stop()
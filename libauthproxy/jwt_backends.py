@@ -0,0 +1,151 @@
+import hashlib
+import hmac
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from calendar import timegm
+from datetime import datetime
+from time import time
+from typing import Optional
+
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+
+HMAC_ALGORITHMS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+TIME_CLAIMS = ("exp", "iat", "nbf")
+
+
+class JWTBackend:
+    """
+    Signs and verifies JWTs. Implementations raise jose's JWTError (or a subclass) for every
+    token they reject, so callers stay independent of the backend.
+    """
+
+    def encode(self, claims: dict, key, algorithm: str, headers: Optional[dict] = None) -> str:
+        raise NotImplementedError()
+
+    def decode(self, token: str, key, algorithms: list[str]) -> dict:
+        raise NotImplementedError()
+
+
+class JoseBackend(JWTBackend):
+    def encode(self, claims: dict, key, algorithm: str, headers: Optional[dict] = None) -> str:
+        return jwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+    def decode(self, token: str, key, algorithms: list[str]) -> dict:
+        return jwt.decode(token, key, algorithms=algorithms)
+
+
+def b64encode(data: bytes) -> bytes:
+    return urlsafe_b64encode(data).rstrip(b"=")
+
+
+def b64decode(data: str) -> bytes:
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def dumps(data: dict) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+class HMACBackend(JWTBackend):
+    """
+    HS256/HS384/HS512 without python-jose's per call key construction. The keyed HMAC state
+    and the encoded header are computed once per key and algorithm and copied for every token.
+    Anything else, asymmetric keys in particular, is handed to `fallback`.
+
+    Validates exp and nbf the way python-jose does.
+    """
+
+    def __init__(self, fallback: Optional[JWTBackend] = None):
+        self.fallback = fallback or JoseBackend()
+        self._macs: dict[tuple[str | bytes, str], "hmac.HMAC"] = {}
+        self._headers: dict[str, bytes] = {}
+
+    def _mac(self, key: str | bytes, algorithm: str) -> "hmac.HMAC":
+        mac = self._macs.get((key, algorithm))
+        if mac is None:
+            mac = hmac.new(key.encode() if isinstance(key, str) else key, digestmod=HMAC_ALGORITHMS[algorithm])
+            self._macs[(key, algorithm)] = mac
+        return mac.copy()
+
+    def _header(self, algorithm: str) -> bytes:
+        header = self._headers.get(algorithm)
+        if header is None:
+            header = b64encode(dumps({"alg": algorithm, "typ": "JWT"}))
+            self._headers[algorithm] = header
+        return header
+
+    def encode(self, claims: dict, key, algorithm: str, headers: Optional[dict] = None) -> str:
+        if headers or algorithm not in HMAC_ALGORITHMS or not isinstance(key, (str, bytes)):
+            return self.fallback.encode(claims, key, algorithm, headers)
+        claims = claims.copy()
+        for claim in TIME_CLAIMS:
+            if isinstance(claims.get(claim), datetime):
+                claims[claim] = timegm(claims[claim].utctimetuple())
+        signing_input = self._header(algorithm) + b"." + b64encode(dumps(claims))
+        mac = self._mac(key, algorithm)
+        mac.update(signing_input)
+        return (signing_input + b"." + b64encode(mac.digest())).decode()
+
+    def decode(self, token: str, key, algorithms: list[str]) -> dict:
+        if not isinstance(key, (str, bytes)):
+            return self.fallback.decode(token, key, algorithms)
+        signing_input, _, signature = token.rpartition(".")
+        header_segment, _, claims_segment = signing_input.partition(".")
+        try:
+            header = json.loads(b64decode(header_segment))
+        except (ValueError, TypeError) as err:
+            raise JWTError("Error decoding token headers.") from err
+        if not isinstance(header, dict):
+            raise JWTError("Invalid header string: must be a json object")
+
+        algorithm = header.get("alg")
+        if algorithm not in algorithms:
+            raise JWTError("The specified alg value is not allowed")
+        if algorithm not in HMAC_ALGORITHMS:
+            return self.fallback.decode(token, key, algorithms)
+
+        mac = self._mac(key, algorithm)
+        mac.update(signing_input.encode())
+        try:
+            valid = hmac.compare_digest(mac.digest(), b64decode(signature))
+        except (ValueError, TypeError) as err:
+            raise JWTError("Invalid crypto padding") from err
+        if not valid:
+            raise JWTError("Signature verification failed.")
+
+        try:
+            claims = json.loads(b64decode(claims_segment))
+        except (ValueError, TypeError) as err:
+            raise JWTError("Invalid payload string") from err
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload string: must be a json object")
+
+        now = time()
+        if "nbf" in claims:
+            if not isinstance(claims["nbf"], int):
+                raise JWTClaimsError("Not Before claim (nbf) must be an integer.")
+            if claims["nbf"] > now:
+                raise JWTClaimsError("The token is not yet valid (nbf)")
+        if "exp" in claims:
+            if not isinstance(claims["exp"], int):
+                raise JWTClaimsError("Expiration Time claim (exp) must be an integer.")
+            if claims["exp"] < now:
+                raise ExpiredSignatureError("Signature has expired.")
+        return claims
+
+
+JWT_BACKENDS = {
+    "jose": JoseBackend,
+    "hmac": HMACBackend,
+}
+
+
+def create_jwt_backend(name: str) -> JWTBackend:
+    if name not in JWT_BACKENDS:
+        raise ValueError(f"jwt backend has to be one of {tuple(JWT_BACKENDS)}, got {name!r}")
+    return JWT_BACKENDS[name]()
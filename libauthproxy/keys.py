@@ -0,0 +1,157 @@
+import json
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable, Optional
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    PublicFormat,
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from jose import jwk
+from jose.backends.base import Key
+
+EC_CURVES = {
+    "secp256r1": ("P-256", "ES256"),
+    "secp384r1": ("P-384", "ES384"),
+    "secp521r1": ("P-521", "ES512"),
+}
+RSA_ALGORITHMS = ("RS256", "RS384", "RS512")
+
+
+def b64(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def int_to_b64(value: int) -> str:
+    return b64(value.to_bytes((value.bit_length() + 7) // 8 or 1, "big"))
+
+
+class Ed25519Key(Key):
+    """
+    EdDSA support for python-jose, which only ships RSA, EC and HMAC keys.
+    """
+
+    def __init__(self, key, algorithm):
+        if not isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+            raise TypeError("Ed25519Key expects a cryptography Ed25519 key")
+        self.prepared_key = key
+        self._algorithm = algorithm
+
+    def sign(self, msg):
+        return self.prepared_key.sign(msg)
+
+    def verify(self, msg, sig):
+        public_key = self.prepared_key
+        if isinstance(public_key, ed25519.Ed25519PrivateKey):
+            public_key = public_key.public_key()
+        try:
+            public_key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key(self):
+        if isinstance(self.prepared_key, ed25519.Ed25519PublicKey):
+            return self
+        return Ed25519Key(self.prepared_key.public_key(), self._algorithm)
+
+
+jwk.register_key("EdDSA", Ed25519Key)
+
+
+def public_jwk(public_key) -> dict:
+    """
+    The public members of a key as a JWK, ordered as RFC 7638 wants them for thumbprints.
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        return {"e": int_to_b64(numbers.e), "kty": "RSA", "n": int_to_b64(numbers.n)}
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        size = (public_key.curve.key_size + 7) // 8
+        return {
+            "crv": EC_CURVES[public_key.curve.name][0],
+            "kty": "EC",
+            "x": b64(numbers.x.to_bytes(size, "big")),
+            "y": b64(numbers.y.to_bytes(size, "big")),
+        }
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return {"crv": "Ed25519", "kty": "OKP", "x": b64(public_key.public_bytes(Encoding.Raw, PublicFormat.Raw))}
+    raise TypeError(f"unsupported key type {type(public_key).__name__}")
+
+
+def thumbprint(public_key) -> str:
+    # https://www.rfc-editor.org/rfc/rfc7638
+    return b64(sha256(json.dumps(public_jwk(public_key), separators=(",", ":")).encode()).digest())
+
+
+def algorithm_for(key, preferred: str) -> str:
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return preferred if preferred in RSA_ALGORITHMS else "RS256"
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return EC_CURVES[key.curve.name][1]
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return "EdDSA"
+    raise TypeError(f"unsupported key type {type(key).__name__}")
+
+
+class SigningKey:
+    """
+    A PEM key parsed once into the python-jose key object used for every sign or verify call.
+    """
+    __slots__ = ("kid", "algorithm", "key", "verifier", "public_key", "can_sign")
+
+    def __init__(self, pem: bytes, preferred_algorithm: str = "RS256", kid: Optional[str] = None):
+        self.can_sign = b"PRIVATE KEY" in pem
+        if self.can_sign:
+            parsed = load_pem_private_key(pem, password=None)
+            self.public_key = parsed.public_key()
+        else:
+            parsed = load_pem_public_key(pem)
+            self.public_key = parsed
+        self.algorithm = algorithm_for(parsed, preferred_algorithm)
+        self.kid = kid or thumbprint(self.public_key)
+        # python-jose only accepts cryptography objects for public RSA/EC keys, so it gets to parse the PEM once itself
+        self.key = jwk.construct(parsed if self.algorithm == "EdDSA" else pem, self.algorithm)
+        self.verifier = self.key.public_key() if self.can_sign else self.key
+
+    def jwk(self) -> dict:
+        return {**public_jwk(self.public_key), "kid": self.kid, "alg": self.algorithm, "use": "sig"}
+
+
+class KeySet:
+    """
+    The key new tokens are signed with plus every key a token may still be verified with,
+    looked up by the token's `kid` header. Keep retired keys in here until the tokens they
+    signed have expired.
+    """
+
+    def __init__(self, signing_key: SigningKey, verification_keys: Iterable[SigningKey] = ()):
+        if not signing_key.can_sign:
+            raise ValueError(f"the signing key {signing_key.kid} is a public key")
+        self.signing_key = signing_key
+        self.keys = {key.kid: key for key in (signing_key, *verification_keys)}
+        self.jwks = json.dumps({"keys": [key.jwk() for key in self.keys.values()]}, separators=(",", ":")).encode()
+        self.etag = '"' + b64(sha256(self.jwks).digest()[:16]) + '"'
+
+    def get(self, kid: Optional[str]) -> Optional[SigningKey]:
+        return self.keys.get(kid)
+
+
+def load_key_set(private_key: str, key_id: Optional[str] = None, public_keys: Iterable[str] = (),
+                 algorithm: str = "RS256") -> KeySet:
+    """
+    :param private_key: Path to the PEM private key new tokens are signed with.
+    :param key_id: The kid of the signing key, defaults to its RFC 7638 thumbprint.
+    :param public_keys: Paths to PEM keys that tokens may still be verified with.
+    :param algorithm: Which RS* algorithm RSA keys use, EC and Ed25519 keys imply theirs.
+    """
+    return KeySet(
+        SigningKey(Path(private_key).read_bytes(), algorithm, key_id),
+        [SigningKey(Path(path).read_bytes(), algorithm) for path in public_keys if path],
+    )
@@ -0,0 +1,101 @@
+import atexit
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+
+LOG_MODES = ("sync", "queue")
+LOG_FORMATS = ("text", "json")
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `limit` records per call site through every `interval` seconds, so that a flood
+    of failed logins cannot turn into a flood of log lines. The first record after a window that
+    dropped some says how many.
+
+    Only records at `level` and above are limited.
+    """
+
+    def __init__(self, limit: int, interval: float, level: int = logging.WARNING, max_sites: int = 1024):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.level = level
+        self.max_sites = max_sites
+        self.suppressed = 0
+        # call site -> [window start, records in window, records dropped in window]
+        self._windows: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        site = (record.pathname, record.lineno)
+        now = monotonic()
+        window = self._windows.get(site)
+        if window is None or now - window[0] >= self.interval:
+            if window is None and len(self._windows) >= self.max_sites:
+                self._windows.clear()
+            if window is not None and window[2]:
+                record.msg = f"{record.msg} (suppressed {window[2]} similar messages)"
+            self._windows[site] = [now, 1, 0]
+            return True
+        window[1] += 1
+        if window[1] <= self.limit:
+            return True
+        window[2] += 1
+        self.suppressed += 1
+        return False
+
+
+def configure_logging(mode: str = "queue", fmt: str = "text", rate_limit: int = 10, rate_interval: float = 10):
+    """
+    Rearranges the handlers that logging.conf attached to the root logger.
+
+    :param mode: "sync" writes in the calling thread, "queue" hands records to a background thread
+        that owns the original handlers, so the event loop never blocks on stdout.
+    :param fmt: "text" keeps the formats of logging.conf, "json" writes one JSON object per line.
+    :param rate_limit: Warnings and errors let through per call site and `rate_interval`, 0 disables it.
+    """
+    if mode not in LOG_MODES:
+        raise ValueError(f"log mode has to be one of {LOG_MODES}, got {mode!r}")
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"log format has to be one of {LOG_FORMATS}, got {fmt!r}")
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if fmt == "json":
+        for handler in handlers:
+            handler.setFormatter(JSONFormatter())
+
+    if mode == "queue":
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            root.removeHandler(handler)
+        handlers = [QueueHandler(records)]
+        root.addHandler(handlers[0])
+        listener.start()
+        atexit.register(listener.stop)
+
+    if rate_limit > 0:
+        rate_limit_filter = RateLimitFilter(rate_limit, rate_interval)
+        for handler in handlers:
+            handler.addFilter(rate_limit_filter)
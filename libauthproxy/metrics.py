@@ -0,0 +1,328 @@
+import sys
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Iterable, Sequence
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# any other method is counted as OTHER, so that clients cannot mint label values
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """
+    A metric family in the Prometheus text format. Children are created per label values on
+    first use and then only ever incremented, which the event loop does without locks.
+
+    Unlabelled metrics forward `inc`, `dec`, `set` and `observe` to their only child.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        if not self.labelnames:
+            child = self.labels()
+            for method in ("inc", "dec", "set", "observe"):
+                if hasattr(child, method):
+                    setattr(self, method, getattr(child, method))
+
+    def _child(self):
+        return _Value()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._child()
+        return child
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_labels(self.labelnames, values)} {child.value}"
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _child(self):
+        return _Histogram(self.buckets)
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {child.sum}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+
+class CallbackMetric(Metric):
+    """
+    Reads its samples from `collect` at scrape time, for state that is already counted elsewhere
+    such as cache hits.
+
+    :param collect: Returns (label values, value) pairs.
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[tuple[tuple, float]]]):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for values, value in self.collect():
+            yield f"{self.name}{_labels(self.labelnames, values)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Registering a metric under a name that is taken replaces the previous one.
+        """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in list(self._metrics.values()) for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "authproxy_http_request_duration_seconds", "Time spent on a request, by route", ("route", "method", "status"),
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "authproxy_http_requests_in_flight", "Requests currently being handled",
+))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "authproxy_db_query_duration_seconds", "Time spent on an EdgeDB query, by db.py function", ("query",),
+))
+PASSWORD_SECONDS = REGISTRY.register(Histogram(
+    "authproxy_password_duration_seconds", "Time a worker spent hashing or verifying a password", ("operation",),
+    buckets=(.01, .025, .05, .1, .2, .3, .5, .75, 1, 2.5, 5),
+))
+PASSWORD_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "authproxy_password_queue_wait_seconds", "Time a password job waited for a worker", ("operation",),
+))
+JWT_SECONDS = REGISTRY.register(Histogram(
+    "authproxy_jwt_duration_seconds", "Time spent signing or verifying a JWT", ("operation",),
+    buckets=(.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01),
+))
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request, labelled by the name of the endpoint that handled it. A pure ASGI
+    middleware, so streamed responses are timed until their last chunk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            # the router stores the matched endpoint in the scope it shares with us
+            route = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+            HTTP_REQUEST_SECONDS.labels(route, method, status_code).observe(perf_counter() - start)
+
+
+class InstrumentedExecutor:
+    """
+    Wraps an EdgeDB client and times every query under the name of the function that issued it,
+    which for the generated queries is the `db.py` function.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def __getattr__(self, name):
+        return getattr(self._executor, name)
+
+    async def query(self, query: str, *args, **kwargs):
+        name = sys._getframe(1).f_code.co_name
+        start = perf_counter()
+        try:
+            return await self._executor.query(query, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.labels(name).observe(perf_counter() - start)
+
+    async def query_single(self, query: str, *args, **kwargs):
+        name = sys._getframe(1).f_code.co_name
+        start = perf_counter()
+        try:
+            return await self._executor.query_single(query, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.labels(name).observe(perf_counter() - start)
+
+    async def query_required_single(self, query: str, *args, **kwargs):
+        name = sys._getframe(1).f_code.co_name
+        start = perf_counter()
+        try:
+            return await self._executor.query_required_single(query, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.labels(name).observe(perf_counter() - start)
+
+    async def execute(self, query: str, *args, **kwargs):
+        name = sys._getframe(1).f_code.co_name
+        start = perf_counter()
+        try:
+            return await self._executor.execute(query, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.labels(name).observe(perf_counter() - start)
+
+
+def register_state_metrics(token_cache=None, read_cache=None, password_hasher=None, revocations=None,
+                           invalidations=None, flights: Iterable = (), login_rate_limiter=None,
+                           password_policies=None):
+    """
+    Exports the counters the caches, the password hasher, the revocation list, the invalidation
+    bus, the coalesced queries, the login rate limits and the password policies keep anyway. Any of
+    them may be None.
+    """
+    def cache_lookups(attribute: str):
+        def collect():
+            if token_cache is not None:
+                yield ("token",), getattr(token_cache.positive, attribute)
+                yield ("token_negative",), getattr(token_cache.negative, attribute)
+            if read_cache is not None:
+                yield ("read",), getattr(read_cache.lru, attribute)
+        return collect
+
+    REGISTRY.register(CallbackMetric(
+        "authproxy_cache_hits_total", "Cache lookups that found an entry", "counter", ("cache",),
+        cache_lookups("hits"),
+    ))
+    REGISTRY.register(CallbackMetric(
+        "authproxy_cache_misses_total", "Cache lookups that found nothing", "counter", ("cache",),
+        cache_lookups("misses"),
+    ))
+    flights = list(flights)
+    REGISTRY.register(CallbackMetric(
+        "authproxy_db_query_calls_total", "Calls of coalesced queries that ran a query", "counter", ("query",),
+        lambda: [((flight.name,), flight.calls) for flight in flights],
+    ))
+    REGISTRY.register(CallbackMetric(
+        "authproxy_db_query_coalesced_total", "Calls of coalesced queries that joined one in flight", "counter",
+        ("query",), lambda: [((flight.name,), flight.coalesced) for flight in flights],
+    ))
+    if password_hasher is not None:
+        REGISTRY.register(CallbackMetric(
+            "authproxy_password_jobs_pending", "Password jobs running or queued", "gauge", (),
+            lambda: [((), password_hasher.pending)],
+        ))
+        REGISTRY.register(CallbackMetric(
+            "authproxy_password_queue_depth", "Password jobs waiting for a free worker", "gauge", (),
+            lambda: [((), password_hasher.queue_depth)],
+        ))
+    if revocations is not None:
+        REGISTRY.register(CallbackMetric(
+            "authproxy_revocations", "Revoked tokens and revoke-all rules held in memory", "gauge", (),
+            lambda: [((), len(revocations))],
+        ))
+    if invalidations is not None:
+        REGISTRY.register(CallbackMetric(
+            "authproxy_invalidations_total", "Cache invalidations sent and received", "counter", ("direction",),
+            lambda: [(("published",), invalidations.published), (("received",), invalidations.received)],
+        ))
+
+    if login_rate_limiter is not None:
+        REGISTRY.register(CallbackMetric(
+            "authproxy_login_rate_limited_total", "Login attempts rejected by a rate limit", "counter", (),
+            lambda: [((), login_rate_limiter.rejected)],
+        ))
+    if password_policies is not None:
+        REGISTRY.register(CallbackMetric(
+            "authproxy_password_upgrades_total", "Password hashes rehashed under the current policy", "counter",
+            (), lambda: [((), password_policies.upgrades)],
+        ))
+
+
+async def handle_metrics(req: Request) -> Response:
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
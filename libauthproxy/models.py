@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, SecretStr, root_validator, validator
 
 
 class CreateTenant(BaseModel):
@@ -14,10 +17,30 @@ class CreateUser(BaseModel):
     email: str
     first_name: str
     last_name: str
-    password_hash: str
+    # either the hash, or the password for authproxy to hash under the policy of the tenant
+    password_hash: Optional[str] = None
+    password: Optional[SecretStr] = None
     tenant_name: str
     roles: str
 
+    @root_validator(skip_on_failure=True)
+    def password_or_hash(cls, values):
+        if (values.get("password") is None) == (values.get("password_hash") is None):
+            raise ValueError("exactly one of password and password_hash is required")
+        return values
+
+
+class CreateUserFromHash(CreateUser):
+    """
+    A CreateUser that arrived without TLS, where plaintext passwords are refused.
+    """
+
+    @validator("password")
+    def no_password(cls, password):
+        if password is not None:
+            raise ValueError("password is only accepted over TLS, send password_hash instead")
+        return password
+
 
 class DeleteUser(BaseModel):
     username: str
@@ -42,6 +65,14 @@ class DeleteTenant(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: int | None = None
+    refresh_token: str | None = None
+
+
+class RevokeToken(BaseModel):
+    jti: str
+    # defaults to the longest an access token can live
+    expires_at: datetime | None = None
 
 
 class User(BaseModel):
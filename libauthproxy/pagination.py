@@ -0,0 +1,46 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import AsyncIterator, Awaitable, Callable
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+Fetch = Callable[..., Awaitable[list]]
+
+
+def encode_cursor(last_id: UUID) -> str:
+    return urlsafe_b64encode(last_id.bytes).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> UUID:
+    """
+    :raises ValueError: If the cursor was not produced by `encode_cursor`.
+    """
+    try:
+        return UUID(bytes=urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as err:
+        raise ValueError(f"invalid cursor {cursor!r}") from err
+
+
+async def iter_pages(fetch: Fetch, limit: int, after: UUID | None = None) -> AsyncIterator[list]:
+    """
+    Calls `fetch(limit=..., after=...)` with the id of the last row of the previous page
+    until a page comes back short.
+    """
+    while True:
+        page = await fetch(limit=limit, after=after)
+        if page:
+            yield page
+        if len(page) < limit:
+            return
+        after = page[-1].id
+
+
+async def iter_ndjson(fetch: Fetch, limit: int, after: UUID | None = None) -> AsyncIterator[bytes]:
+    async for page in iter_pages(fetch, limit, after):
+        yield b"".join(
+            json.dumps(row, separators=(",", ":")).encode() + b"\n"
+            for row in jsonable_encoder(page)
+        )
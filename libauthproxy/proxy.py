@@ -0,0 +1,152 @@
+import json
+
+import httpx
+from edgedb import AsyncIOClient
+from fastapi import FastAPI, HTTPException
+from starlette import status
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from libauthproxy import (
+    PROXY_ROUTES,
+    PROXY_MAX_CONNECTIONS,
+    PROXY_MAX_KEEPALIVE_CONNECTIONS,
+    PROXY_KEEPALIVE_EXPIRY,
+    PROXY_TIMEOUT,
+    register_token_validator,
+)
+from libauthproxy.scopes import insufficient_scope, normalize_scope, scopes_of
+from libauthproxy.utils import header_value, L
+
+# https://www.rfc-editor.org/rfc/rfc9110#section-7.6.1
+HOP_BY_HOP_HEADERS = frozenset((
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"proxy-connection",
+    b"te",
+    b"trailer",
+    b"transfer-encoding",
+    b"upgrade",
+))
+IDENTITY_HEADER_PREFIX = b"x-auth-"
+HTTP_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+
+class ProxyRoute:
+    """
+    Maps every request below `prefix` to `upstream`, provided the token carries all of `scopes`.
+    """
+    __slots__ = ("prefix", "upstream", "scopes", "strip_prefix")
+
+    def __init__(self, prefix: str, upstream: str, scopes: list[str] | None = None, strip_prefix: bool = False):
+        self.prefix = "/" + prefix.strip("/")
+        self.upstream = upstream.rstrip("/")
+        self.scopes = tuple(sorted({normalize_scope(scope) for scope in scopes or ()}))
+        self.strip_prefix = strip_prefix
+
+    def upstream_path(self, path: str) -> str:
+        if self.strip_prefix:
+            path = path[len(self.prefix):]
+        return path if path.startswith("/") else "/" + path
+
+
+def parse_proxy_routes(routes: str | list) -> list[ProxyRoute]:
+    """
+    Parses route rules like `[{"prefix": "/billing", "upstream": "http://billing:8080", "scopes": ["billing"]}]`,
+    either from a JSON string or an already decoded list. Longer prefixes win.
+    """
+    if isinstance(routes, str):
+        routes = json.loads(routes) if routes else []
+    parsed = [r if isinstance(r, ProxyRoute) else ProxyRoute(**r) for r in routes]
+    return sorted(parsed, key=lambda r: len(r.prefix), reverse=True)
+
+
+def forwarded_request_headers(req: Request, claims: dict) -> list[tuple[bytes, bytes]]:
+    headers = [
+        (k, v) for k, v in req.headers.raw
+        if k not in HOP_BY_HOP_HEADERS and k != b"host" and not k.startswith(IDENTITY_HEADER_PREFIX)
+    ]
+    if req.client is not None:
+        forwarded_for = req.headers.get("x-forwarded-for")
+        client_host = req.client.host
+        headers.append((b"x-forwarded-for",
+                        (f"{forwarded_for}, {client_host}" if forwarded_for else client_host).encode("latin-1")))
+    headers.append((b"x-forwarded-proto", req.url.scheme.encode("latin-1")))
+    if "host" in req.headers:
+        headers.append((b"x-forwarded-host", req.headers["host"].encode("latin-1")))
+    headers.append((b"x-auth-user", header_value(claims["sub"]).encode("latin-1")))
+    headers.append((b"x-auth-tenant", header_value(claims["tenant"]).encode("latin-1")))
+    headers.append((b"x-auth-scopes", header_value(",".join(claims.get("scopes", ()))).encode("latin-1")))
+    return headers
+
+
+def register_proxy_routes(app: FastAPI, db: AsyncIOClient | None = None, **kwargs):
+    validator = register_token_validator(app, db, **kwargs)
+    routes = parse_proxy_routes(kwargs.get("proxy_routes", PROXY_ROUTES))
+
+    if not all((validator.secret_key, validator.jwt_algorithm, routes)):
+        raise EnvironmentError("$SECRET_KEY (or $JWT_PRIVATE_KEY), $JWT_ALGORITHM and $PROXY_ROUTES have to be set")
+
+    # one pooled keep-alive client for all upstreams
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=kwargs.get("proxy_max_connections", PROXY_MAX_CONNECTIONS),
+            max_keepalive_connections=kwargs.get("proxy_max_keepalive_connections", PROXY_MAX_KEEPALIVE_CONNECTIONS),
+            keepalive_expiry=kwargs.get("proxy_keepalive_expiry", PROXY_KEEPALIVE_EXPIRY),
+        ),
+        timeout=kwargs.get("proxy_timeout", PROXY_TIMEOUT),
+        transport=kwargs.get("proxy_transport"),
+        follow_redirects=False,
+    )
+    app.add_event_handler("shutdown", client.aclose)
+
+    def proxy_to(route: ProxyRoute):
+        async def handle_proxy(req: Request) -> Response:
+            scheme, _, token = req.headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return Response(status_code=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+            try:
+                entry = await validator.validate(token)
+                if entry.claims.get("disabled"):
+                    return Response(status_code=status.HTTP_403_FORBIDDEN)
+                if route.scopes and not scopes_of(entry).satisfies(route.scopes):
+                    raise insufficient_scope(route.scopes)
+            except HTTPException as err:
+                return Response(status_code=err.status_code, headers=err.headers)
+            claims = entry.claims
+
+            # only stream a request body if the client announced one, so GETs stay without Transfer-Encoding
+            has_body = "content-length" in req.headers or "transfer-encoding" in req.headers
+            upstream_req = client.build_request(
+                req.method,
+                httpx.URL(route.upstream + route.upstream_path(req.url.path), query=req.url.query.encode("latin-1")),
+                headers=forwarded_request_headers(req, claims),
+                content=req.stream() if has_body else None,
+            )
+            try:
+                upstream_res = await client.send(upstream_req, stream=True)
+            except httpx.TimeoutException as err:
+                L.error("handle_proxy: Upstream %s timed out=%s", route.upstream, err)
+                return Response(status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+            except httpx.HTTPError as err:
+                L.error("handle_proxy: Upstream %s failed=%s", route.upstream, err)
+                return Response(status_code=status.HTTP_502_BAD_GATEWAY)
+
+            res = StreamingResponse(
+                upstream_res.aiter_raw(),
+                status_code=upstream_res.status_code,
+                background=BackgroundTask(upstream_res.aclose),
+            )
+            res.raw_headers = [(k, v) for k, v in upstream_res.headers.raw if k.lower() not in HOP_BY_HOP_HEADERS]
+            return res
+
+        return handle_proxy
+
+    for route in routes:
+        L.info(f"Registering proxy {route.prefix} -> {route.upstream}")
+        handler = proxy_to(route)
+        app.add_route(route.prefix, handler, methods=HTTP_METHODS, include_in_schema=False)
+        app.add_route(route.prefix.rstrip("/") + "/{path:path}", handler, methods=HTTP_METHODS, include_in_schema=False)
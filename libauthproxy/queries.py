@@ -0,0 +1,21 @@
+import db
+from libauthproxy.singleflight import coalesce
+
+# the read queries of db.py, coalesced so that concurrent identical lookups share one round trip;
+# mutations are not coalesced, import those from db directly, and neither are the admin reads, as
+# ReadCache coalesces those itself
+check_session = coalesce(db.check_session)
+get_user_by_email = coalesce(db.get_user_by_email)
+get_user_by_username = coalesce(db.get_user_by_username)
+list_scopes = coalesce(db.list_scopes)
+read_scope_dictionary = coalesce(db.read_scope_dictionary)
+
+FLIGHTS = [
+    query.flight for query in (
+        check_session,
+        get_user_by_email,
+        get_user_by_username,
+        list_scopes,
+        read_scope_dictionary,
+    )
+]
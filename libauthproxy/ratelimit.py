@@ -0,0 +1,91 @@
+from array import array
+from time import monotonic
+from typing import Hashable, Optional
+
+
+class TokenBuckets:
+    """
+    Token buckets refilled at `rate` per second up to `burst`, in fixed size arrays so that cycling
+    through usernames or addresses cannot grow memory. A new key evicts the fuller of its two slots.
+    """
+
+    def __init__(self, rate: float, burst: float, slots: int = 65536):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        self.evictions = 0
+        # 0 marks a free slot
+        self._keys = array("q", [0]) * slots
+        self._tokens = array("d", [0.0]) * slots
+        self._stamps = array("d", [0.0]) * slots
+
+    def _level(self, slot: int, now: float) -> float:
+        if not self._keys[slot]:
+            return float("inf")
+        return min(self.burst, self._tokens[slot] + (now - self._stamps[slot]) * self.rate)
+
+    def _slot(self, key: Hashable, now: float) -> int:
+        fingerprint = hash(key) or 1
+        first = fingerprint % self.slots
+        second = (fingerprint // self.slots) % self.slots
+        if self._keys[first] == fingerprint:
+            return first
+        if self._keys[second] == fingerprint:
+            return second
+        slot = first if self._level(first, now) >= self._level(second, now) else second
+        if self._keys[slot]:
+            self.evictions += 1
+        self._keys[slot] = fingerprint
+        self._tokens[slot] = self.burst
+        self._stamps[slot] = now
+        return slot
+
+    def take(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Takes a token from the bucket of `key`.
+
+        :return: 0 if there was one, otherwise the seconds until there will be.
+        """
+        now = monotonic() if now is None else now
+        slot = self._slot(key, now)
+        tokens = self._level(slot, now)
+        self._stamps[slot] = now
+        if tokens >= 1:
+            self._tokens[slot] = tokens - 1
+            return 0.0
+        self._tokens[slot] = tokens
+        return (1 - tokens) / self.rate
+
+
+class LoginRateLimiter:
+    """
+    Limits logins per client address, per tenant and per user. Any of the limits may be None.
+    """
+
+    def __init__(self, ip: Optional[TokenBuckets], tenant: Optional[TokenBuckets], user: Optional[TokenBuckets]):
+        self.ip = ip
+        self.tenant = tenant
+        self.user = user
+        self.rejected = 0
+
+    def check_ip(self, ip: Optional[str]) -> float:
+        """
+        :return: 0 if the client may try to log in, otherwise the seconds until it may.
+        """
+        if self.ip is None or ip is None:
+            return 0.0
+        wait = self.ip.take(ip)
+        self.rejected += wait > 0
+        return wait
+
+    def check_user(self, tenant: str, username: str) -> float:
+        """
+        :return: 0 if the user may try to log in, otherwise the seconds until they may.
+        """
+        wait = 0.0
+        if self.tenant is not None:
+            wait = self.tenant.take(tenant)
+        if not wait and self.user is not None:
+            wait = self.user.take((tenant, username))
+        self.rejected += wait > 0
+        return wait
@@ -0,0 +1,57 @@
+import secrets
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from uuid import UUID, uuid4
+
+from edgedb import AsyncIOClient
+
+from db import (
+    create_refresh_token,
+    read_refresh_token,
+    revoke_refresh_token_family,
+    use_refresh_token,
+    UseRefreshTokenResult,
+)
+from libauthproxy.utils import L
+
+
+def hash_refresh_token(token: str) -> str:
+    return sha256(token.encode()).hexdigest()
+
+
+async def issue_refresh_token(db: AsyncIOClient, user_id: UUID, expires_delta: timedelta,
+                              family: UUID | None = None) -> str:
+    """
+    Stores the hash of a new opaque refresh token and returns the token. Tokens rotated from
+    the same login share a family.
+    """
+    token = secrets.token_urlsafe(32)
+    await create_refresh_token(
+        db,
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family=family or uuid4(),
+        expires_at=datetime.now(timezone.utc) + expires_delta,
+    )
+    return token
+
+
+async def redeem_refresh_token(db: AsyncIOClient, token: str) -> UseRefreshTokenResult | None:
+    """
+    Marks a refresh token as used and returns it together with its user, or None if it cannot be used.
+
+    A token that was already rotated and is presented again has most likely been stolen, so its
+    whole family is revoked and the legitimate client has to log in again.
+    """
+    token_hash = hash_refresh_token(token)
+    redeemed = await use_refresh_token(db, token_hash=token_hash)
+    if redeemed is not None:
+        if redeemed.expires_at <= datetime.now(timezone.utc):
+            return None
+        return redeemed
+
+    known = await read_refresh_token(db, token_hash=token_hash)
+    if known is not None and known.used:
+        L.warning("redeem_refresh_token: Rotated refresh token was reused, revoking family=%s", known.family)
+        await revoke_refresh_token_family(db, family=known.family)
+    return None
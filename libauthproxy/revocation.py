@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+from time import time
+from typing import Optional
+
+from edgedb import AsyncIOClient, EdgeDBError
+
+from db import list_revocations
+from libauthproxy.utils import L
+
+
+class RevocationList:
+    """
+    The unexpired revoked `jti`s and the revoke-all rules in memory, refreshed with what was
+    revoked since the previous refresh.
+    """
+
+    def __init__(self, refresh_interval: float, overlap: float = 5):
+        self.refresh_interval = refresh_interval
+        # revocations are read by creation time, re-read a little of the past in case a transaction committed late
+        self.overlap = timedelta(seconds=overlap)
+        self.jtis: dict[str, float] = {}
+        self.rules: dict[tuple[str, Optional[str]], float] = {}
+        self.since: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.jtis) + len(self.rules)
+
+    def revoke(self, jti: str, expires_at: datetime):
+        self.jtis[jti] = expires_at.timestamp()
+
+    def revoke_all(self, tenant: str, username: Optional[str], not_before: datetime):
+        key = (tenant, username)
+        # tokens with a whole second "iat", from other issuers, are revoked for all of that second
+        self.rules[key] = max(self.rules.get(key, 0), not_before.timestamp())
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self.jtis:
+            return True
+        if not self.rules:
+            return False
+        issued_at = claims.get("iat", 0)
+        tenant = claims.get("tenant")
+        return issued_at < self.rules.get((tenant, None), 0) or \
+            issued_at < self.rules.get((tenant, claims.get("sub")), 0)
+
+    async def refresh(self, db: AsyncIOClient):
+        since = self.since - self.overlap if self.since is not None else None
+        result = await list_revocations(db, since=since)
+        for token in result.tokens:
+            self.revoke(token.jti, token.expires_at)
+        for rule in result.rules:
+            self.revoke_all(rule.tenant.name, rule.username, rule.not_before)
+        now = time()
+        for jti in [jti for jti, expires_at in self.jtis.items() if expires_at <= now]:
+            del self.jtis[jti]
+        self.since = result.now
+
+    async def _refresh_forever(self, db: AsyncIOClient):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(db)
+            except EdgeDBError as err:
+                L.error("RevocationList(IV): Refreshing failed, keeping the previous list=%s", err)
+
+    async def start(self, db: AsyncIOClient):
+        try:
+            await self.refresh(db)
+        except EdgeDBError as err:
+            L.error("RevocationList(IV): Initial load failed=%s", err)
+        self._task = asyncio.create_task(self._refresh_forever(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
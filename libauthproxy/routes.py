@@ -1,16 +1,20 @@
-from datetime import timedelta
-from typing import Annotated
-
-from edgedb import AsyncIOClient
-from fastapi import Depends, FastAPI, HTTPException, status, Form, Path
+import asyncio
+import json
+import math
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Annotated, Callable, Hashable
+
+from edgedb import AsyncIOClient, MissingRequiredError
+from fastapi import Depends, FastAPI, HTTPException, status, Form, Path, Query
 from fastapi.openapi.docs import (
     get_redoc_html,
     get_swagger_ui_html,
     get_swagger_ui_oauth2_redirect_html,
 )
-from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
 
 from db import (
     create_tenant,
@@ -18,16 +22,26 @@ from db import (
     create_role,
     delete_role,
     delete_tenant,
-    GetUserByUsernameResult, delete_user, read_role, list_roles, read_tenant, list_tenants, read_user, list_users,
+    GetUserByUsernameResult, delete_user,
     update_tenant,
+    import_users,
+    import_roles,
+    revoke_token,
+    revoke_all_tokens,
+    read_role,
+    list_roles,
+    read_tenant,
+    list_tenants,
+    read_user,
+    list_users,
 )
 from libauthproxy import (
     authenticate_user,
     create_access_token,
     get_current_active_user,
-    SECRET_KEY,
-    JWT_ALGORITHM,
+    JWKS_MAX_AGE,
     ACCESS_TOKEN_EXPIRY,
+    TOKEN_CLAIMS,
     HOST,
     PORT,
     ADMIN_USERNAME,
@@ -35,26 +49,179 @@ from libauthproxy import (
     get_current_user,
     OAUTH2,
     DEBUG,
+    PASSWORD_EXECUTOR,
+    PASSWORD_WORKERS,
+    PASSWORD_QUEUE_SIZE,
+    create_password_hasher,
+    FORWARD_AUTH_CHECK_USER,
+    get_current_session,
+    LIST_PAGE_SIZE,
+    LIST_MAX_PAGE_SIZE,
+    IMPORT_BATCH_SIZE,
+    REFRESH_TOKEN_EXPIRY,
+    READ_CACHE_SIZE,
+    READ_CACHE_TTL,
+    create_read_cache,
+    INVALIDATION_SOCKET_DIR,
+    INVALIDATION_POLL_INTERVAL,
+    create_invalidation_bus,
+    LOGIN_IP_RATE,
+    LOGIN_IP_BURST,
+    LOGIN_TENANT_RATE,
+    LOGIN_TENANT_BURST,
+    LOGIN_USER_RATE,
+    LOGIN_USER_BURST,
+    LOGIN_RATE_LIMIT_SLOTS,
+    create_login_rate_limiter,
+    PASSWORD_POLICY,
+    PASSWORD_TENANT_POLICIES,
+    create_password_policies,
+    PLAINTEXT_PASSWORDS,
+    register_token_validator,
 )
-from libauthproxy.models import CreateUser, CreateRole, Token, CreateTenant, DeleteRole, DeleteTenant, DeleteUser, \
-    UpdateTenant
-from libauthproxy.utils import generate_basic_auth, flatten, L
+from libauthproxy.hashing import HasherOverloaded
+from libauthproxy.importing import import_records, iter_records
+from libauthproxy.metrics import register_state_metrics
+from libauthproxy.queries import FLIGHTS
+from libauthproxy.pagination import decode_cursor, encode_cursor, iter_ndjson, NDJSON_MEDIA_TYPE, Fetch
+from libauthproxy.refresh_tokens import issue_refresh_token, redeem_refresh_token
+from libauthproxy.models import CreateUser, CreateUserFromHash, CreateRole, Token, CreateTenant, DeleteRole, DeleteTenant, DeleteUser, \
+    UpdateTenant, RevokeToken
+from libauthproxy.claims import CLAIMS_MODES
+from libauthproxy.scopes import normalize_scopes
+from libauthproxy.utils import generate_basic_auth, flatten, header_value, L
 
 
 def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
-    secret_key = kwargs.get("secret_key", SECRET_KEY)
-    jwt_algorithm = kwargs.get("jwt_algorithm", JWT_ALGORITHM)
+    validator = register_token_validator(app, db, **kwargs)
+    key_set, secret_key, jwt_algorithm = validator.key_set, validator.secret_key, validator.jwt_algorithm
+    token_cache, revocations = validator.token_cache, validator.revocations
+    scope_dictionaries = validator.scope_dictionaries
     access_token_expiry = kwargs.get("access_token_expiry", ACCESS_TOKEN_EXPIRY)
+    refresh_token_expiry = kwargs.get("refresh_token_expiry", REFRESH_TOKEN_EXPIRY)
+    token_claims = kwargs.get("token_claims", TOKEN_CLAIMS)
+    if token_claims not in CLAIMS_MODES:
+        raise EnvironmentError(f"$TOKEN_CLAIMS has to be one of {CLAIMS_MODES}, got {token_claims!r}")
     admin_user = kwargs.get("admin_username", ADMIN_USERNAME)
     admin_password = kwargs.get("admin_password", ADMIN_PASSWORD)
     host = kwargs.get("host", HOST)
     port = kwargs.get("port", PORT)
     debug = kwargs.get("debug", DEBUG)
+    jwks_max_age = kwargs.get("jwks_max_age", JWKS_MAX_AGE)
+    password_hasher = kwargs.get("password_hasher") or create_password_hasher(
+        mode=kwargs.get("password_executor", PASSWORD_EXECUTOR),
+        workers=kwargs.get("password_workers", PASSWORD_WORKERS),
+        queue_size=kwargs.get("password_queue_size", PASSWORD_QUEUE_SIZE),
+    )
+    app.add_event_handler("shutdown", password_hasher.shutdown)
+    read_cache = kwargs.get("read_cache") or create_read_cache(
+        maxsize=kwargs.get("read_cache_size", READ_CACHE_SIZE),
+        ttl=kwargs.get("read_cache_ttl", READ_CACHE_TTL),
+    )
+    invalidations = kwargs.get("invalidations") or create_invalidation_bus(
+        db,
+        socket_dir=kwargs.get("invalidation_socket_dir", INVALIDATION_SOCKET_DIR),
+        poll_interval=kwargs.get("invalidation_poll_interval", INVALIDATION_POLL_INTERVAL),
+    )
+    invalidations.subscribe("tenant", read_cache.invalidate_tenant)
+    invalidations.subscribe("role", read_cache.invalidate_role)
+    invalidations.subscribe("user", read_cache.invalidate_user)
+    invalidations.subscribe("roles", read_cache.invalidate_roles)
+    invalidations.subscribe("users", read_cache.invalidate_users)
+    if token_cache is not None:
+        invalidations.subscribe("tenant", token_cache.invalidate_tenant)
+        invalidations.subscribe("user", token_cache.invalidate_user)
+        invalidations.subscribe("users", token_cache.invalidate_users)
+        for kind in ("role", "roles"):
+            invalidations.subscribe(kind, token_cache.invalidate_roles)
+    for kind in ("tenant", "role", "roles"):
+        invalidations.subscribe(kind, scope_dictionaries.invalidate)
+    app.add_event_handler("startup", invalidations.start)
+    app.add_event_handler("shutdown", invalidations.stop)
+    login_rate_limiter = kwargs.get("login_rate_limiter") or create_login_rate_limiter(
+        ip=(kwargs.get("login_ip_rate", LOGIN_IP_RATE), kwargs.get("login_ip_burst", LOGIN_IP_BURST)),
+        tenant=(kwargs.get("login_tenant_rate", LOGIN_TENANT_RATE), kwargs.get("login_tenant_burst", LOGIN_TENANT_BURST)),
+        user=(kwargs.get("login_user_rate", LOGIN_USER_RATE), kwargs.get("login_user_burst", LOGIN_USER_BURST)),
+        slots=kwargs.get("login_rate_limit_slots", LOGIN_RATE_LIMIT_SLOTS),
+    )
+    password_policies = kwargs.get("password_policies") or create_password_policies(
+        kwargs.get("password_policy", PASSWORD_POLICY),
+        kwargs.get("password_tenant_policies", PASSWORD_TENANT_POLICIES),
+    )
+    register_state_metrics(token_cache, read_cache, password_hasher, revocations, invalidations,
+                           FLIGHTS + [read_cache.flight],
+                           login_rate_limiter, password_policies)
+    forward_auth_check_user = kwargs.get("forward_auth_check_user", FORWARD_AUTH_CHECK_USER)
+    list_page_size = kwargs.get("list_page_size", LIST_PAGE_SIZE)
+    list_max_page_size = kwargs.get("list_max_page_size", LIST_MAX_PAGE_SIZE)
+    import_batch_size = kwargs.get("import_batch_size", IMPORT_BATCH_SIZE)
+    plaintext_passwords = kwargs.get("plaintext_passwords", PLAINTEXT_PASSWORDS)
+    if plaintext_passwords not in ("off", "tls", "any"):
+        raise EnvironmentError(f"$PLAINTEXT_PASSWORDS has to be one of off, tls or any, got {plaintext_passwords!r}")
     get_current_username = generate_basic_auth(admin_user, admin_password)
 
     if not all((secret_key, jwt_algorithm, access_token_expiry, admin_user, admin_password)):
-        raise EnvironmentError("$SECRET_KEY, $JWT_ALGORITHM, $ACCESS_TOKEN_EXPIRY, "
+        raise EnvironmentError("$SECRET_KEY (or $JWT_PRIVATE_KEY), $JWT_ALGORITHM, $ACCESS_TOKEN_EXPIRY, "
                                "$ADMIN_USERNAME and $ADMIN_PASSWORD have to be set")
+
+    async def respond_with_page(req: Request, res: Response, fetch: Fetch, key: Callable[[int], Hashable], limit: int,
+                                cursor: str | None):
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        if NDJSON_MEDIA_TYPE in req.headers.get("accept", ""):
+            return StreamingResponse(iter_ndjson(fetch, limit, after), media_type=NDJSON_MEDIA_TYPE)
+        if after is None:
+            # only first pages are cached, the pages of a walk or a stream are mostly read once
+            page = await read_cache.get_or_fetch(key(limit), partial(fetch, limit=limit, after=None))
+        else:
+            page = await fetch(limit=limit, after=after)
+        if len(page) == limit:
+            res.headers["X-Next-Cursor"] = encode_cursor(page[-1].id)
+        return page
+
+    def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def accepts_passwords(req: Request) -> bool:
+        if plaintext_passwords == "tls":
+            return req.url.scheme == "https"
+        return plaintext_passwords == "any"
+
+    async def hash_password_of(user: CreateUser):
+        """
+        Replaces the password of `user` by its hash. In place, so that the rows of a failed import
+        batch are not hashed again when they are retried one by one.
+        """
+        if user.password is None:
+            return
+        user.password_hash = await password_hasher.hash(user.password.get_secret_value(),
+                                                        password_policies.policy(user.tenant_name))
+        user.password = None
+
+    async def hash_passwords_of(users: list[CreateUser]):
+        # keeps at most one job per worker in the pool, so an import does not push logins out of the queue
+        slots = asyncio.Semaphore(password_hasher.workers)
+
+        async def hash_one(user: CreateUser):
+            async with slots:
+                while True:
+                    try:
+                        return await hash_password_of(user)
+                    except HasherOverloaded:
+                        await asyncio.sleep(max(0.05, password_hasher.retry_after()))
+
+        await asyncio.gather(*(hash_one(user) for user in users if user.password is not None))
+
+    page_limit = Query(ge=1, le=list_max_page_size,
+                       title="How many rows to return, X-Next-Cursor is set if there might be more")
+    page_cursor = Query(title="The X-Next-Cursor of the previous page")
+
     if debug:
         app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -87,16 +254,29 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             tenant: CreateTenant
     ):
-        return await create_tenant(db, **tenant.dict())
+        result = await create_tenant(db, **tenant.dict())
+        await invalidations.publish("tenant", tenant=tenant.tenant)
+        return result
 
     L.info(f"Registering POST http://{host}:{port}/users")
 
     @app.post("/users")
     async def handle_create_user(
             _: Annotated[str, Depends(get_current_username)],
+            req: Request,
             user: CreateUser,
     ):
-        return await create_user(db, **user.dict())
+        if user.password is not None and not accepts_passwords(req):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="password is only accepted over TLS, send password_hash instead")
+        try:
+            await hash_password_of(user)
+        except HasherOverloaded as err:
+            L.warning("handle_create_user: Rejecting, %s (queue_depth=%s)", err, password_hasher.queue_depth)
+            raise too_many_requests("Too many concurrent password jobs", password_hasher.retry_after())
+        result = await create_user(db, **user.dict(exclude={"password"}))
+        await invalidations.publish("user", tenant=user.tenant_name, username=user.username)
+        return result
 
     L.info(f"Registering POST http://{host}:{port}/roles")
 
@@ -105,7 +285,53 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             role: CreateRole,
     ):
-        return await create_role(db, **role.dict())
+        result = await create_role(db, **role.dict())
+        await invalidations.publish("role", tenant=role.tenant, name=role.name)
+        return result
+
+    L.info(f"Registering POST http://{host}:{port}/users/import")
+
+    @app.post("/users/import")
+    async def handle_import_users(
+            _: Annotated[str, Depends(get_current_username)],
+            req: Request,
+    ):
+        async def insert_batch(tenant: str, users: list[CreateUser]):
+            await hash_passwords_of(users)
+            result = await import_users(db, tenant=tenant,
+                                        users=json.dumps([user.dict(exclude={"password"}) for user in users]))
+            await invalidations.publish("users", tenant=tenant, usernames=[user.username for user in users])
+            return result
+
+        async def insert_one(user: CreateUser):
+            await hash_passwords_of([user])
+            result = await create_user(db, **user.dict(exclude={"password"}))
+            await invalidations.publish("user", tenant=user.tenant_name, username=user.username)
+            return result
+
+        model = CreateUser if accepts_passwords(req) else CreateUserFromHash
+        return await import_records(iter_records(req), model, lambda user: user.tenant_name,
+                                    insert_batch, insert_one, import_batch_size)
+
+    L.info(f"Registering POST http://{host}:{port}/roles/import")
+
+    @app.post("/roles/import")
+    async def handle_import_roles(
+            _: Annotated[str, Depends(get_current_username)],
+            req: Request,
+    ):
+        async def insert_batch(tenant: str, roles: list[CreateRole]):
+            result = await import_roles(db, tenant=tenant, roles=json.dumps([role.dict() for role in roles]))
+            await invalidations.publish("roles", tenant=tenant, names=[role.name for role in roles])
+            return result
+
+        async def insert_one(role: CreateRole):
+            result = await create_role(db, **role.dict())
+            await invalidations.publish("role", tenant=role.tenant, name=role.name)
+            return result
+
+        return await import_records(iter_records(req), CreateRole, lambda role: role.tenant,
+                                    insert_batch, insert_one, import_batch_size)
 
     L.info(f"Registering DELETE http://{host}:{port}/roles")
 
@@ -114,7 +340,9 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             role: DeleteRole,
     ):
-        return await delete_role(db, **role.dict())
+        result = await delete_role(db, **role.dict())
+        await invalidations.publish("role", tenant=role.tenant, name=role.name)
+        return result
 
     L.info(f"Registering DELETE http://{host}:{port}/tenants")
 
@@ -123,7 +351,9 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             tenant: DeleteTenant,
     ):
-        return await delete_tenant(db, **tenant.dict())
+        result = await delete_tenant(db, **tenant.dict())
+        await invalidations.publish("tenant", tenant=tenant.tenant)
+        return result
 
     L.info(f"Registering PATCH http://{host}:{port}/tenants")
 
@@ -132,7 +362,10 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             tenant: UpdateTenant,
     ):
-        return await update_tenant(db, **tenant.dict())
+        result = await update_tenant(db, **tenant.dict())
+        await invalidations.publish("tenant", tenant=tenant.tenant)
+        await invalidations.publish("tenant", tenant=tenant.new_tenant)
+        return result
 
     L.info(f"Registering DELETE http://{host}:{port}/users")
 
@@ -141,7 +374,51 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             user: DeleteUser,
     ):
-        return await delete_user(db, **user.dict())
+        result = await delete_user(db, **user.dict())
+        await invalidations.publish("user", tenant=user.tenant, username=user.username)
+        return result
+
+    L.info(f"Registering POST http://{host}:{port}/tokens/revoke")
+
+    @app.post("/tokens/revoke")
+    async def handle_revoke_token(
+            _: Annotated[str, Depends(get_current_username)],
+            token: RevokeToken,
+    ):
+        expires_at = token.expires_at or datetime.now(timezone.utc) + timedelta(seconds=access_token_expiry)
+        result = await revoke_token(db, jti=token.jti, expires_at=expires_at)
+        if revocations is not None:
+            revocations.revoke(token.jti, expires_at)
+        return result
+
+    async def revoke_all(tenant: str, username: str | None):
+        try:
+            result = await revoke_all_tokens(db, tenant=tenant, username=username)
+        except MissingRequiredError:
+            # the rule's tenant is required, so an unknown tenant fails the INSERT
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown tenant")
+        if revocations is not None:
+            revocations.revoke_all(tenant, username, result.not_before)
+        return result
+
+    L.info(f"Registering POST http://{host}:{port}/<tenant>/revoke")
+
+    @app.post("/tenants/{tenant}/revoke")
+    async def handle_revoke_tenant_tokens(
+            _: Annotated[str, Depends(get_current_username)],
+            tenant: Annotated[str, Path(title="The name of the tenant")],
+    ):
+        return await revoke_all(tenant, None)
+
+    L.info(f"Registering POST http://{host}:{port}/<tenant>/users/<username>/revoke")
+
+    @app.post("/tenants/{tenant}/users/{username}/revoke")
+    async def handle_revoke_user_tokens(
+            _: Annotated[str, Depends(get_current_username)],
+            tenant: Annotated[str, Path(title="The name of the tenant")],
+            username: Annotated[str, Path(title="The name of the user")],
+    ):
+        return await revoke_all(tenant, username)
 
     L.info(f"Registering GET http://{host}:{port}/<tenant>/roles/<name>")
 
@@ -151,7 +428,8 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             tenant: Annotated[str, Path(title="The tenant under which the role is saved")],
             name: Annotated[str, Path(title="The name of the role")],
     ):
-        return await read_role(db, name=name, tenant=tenant)
+        return await read_cache.get_or_fetch(read_cache.role_key(tenant, name),
+                                             lambda: read_role(db, name=name, tenant=tenant))
 
     L.info(f"Registering GET http://{host}:{port}/<tenant>/users")
 
@@ -159,8 +437,13 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
     async def handle_list_users(
             _: Annotated[str, Depends(get_current_username)],
             tenant: Annotated[str, Path(title="The name of the tenant")],
+            req: Request,
+            res: Response,
+            limit: Annotated[int, page_limit] = list_page_size,
+            cursor: Annotated[str | None, page_cursor] = None,
     ):
-        return await list_users(db, tenant=tenant)
+        return await respond_with_page(req, res, partial(list_users, db, tenant=tenant),
+                                       partial(read_cache.users_key, tenant), limit, cursor)
 
     L.info(f"Registering GET http://{host}:{port}/<tenant>/users/<username>")
 
@@ -170,7 +453,8 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             tenant: Annotated[str, Path(title="The name of the tenant")],
             username: Annotated[str, Path(title="The name of the user")],
     ):
-        return await read_user(db, username=username, tenant=tenant)
+        return await read_cache.get_or_fetch(read_cache.user_key(tenant, username),
+                                             lambda: read_user(db, username=username, tenant=tenant))
 
     L.info(f"Registering GET http://{host}:{port}/tenants/<name>")
 
@@ -179,15 +463,19 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
             _: Annotated[str, Depends(get_current_username)],
             name: Annotated[str, Path(title="The name of the tenant")],
     ):
-        return await read_tenant(db, tenant=name)
+        return await read_cache.get_or_fetch(read_cache.tenant_key(name), lambda: read_tenant(db, tenant=name))
 
     L.info(f"Registering GET http://{host}:{port}/tenants")
 
     @app.get("/tenants")
     async def handle_list_tenants(
             _: Annotated[str, Depends(get_current_username)],
+            req: Request,
+            res: Response,
+            limit: Annotated[int, page_limit] = list_page_size,
+            cursor: Annotated[str | None, page_cursor] = None,
     ):
-        return await list_tenants(db)
+        return await respond_with_page(req, res, partial(list_tenants, db), read_cache.tenants_key, limit, cursor)
 
     L.info(f"Registering GET http://{host}:{port}/<tenant>/roles")
 
@@ -195,37 +483,93 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
     async def handle_list_roles(
             _: Annotated[str, Depends(get_current_username)],
             tenant: Annotated[str, Path(title="The tenant under which the role is saved")],
+            req: Request,
+            res: Response,
+            limit: Annotated[int, page_limit] = list_page_size,
+            cursor: Annotated[str | None, page_cursor] = None,
     ):
-        return await list_roles(db, tenant=tenant)
+        return await respond_with_page(req, res, partial(list_roles, db, tenant=tenant),
+                                       partial(read_cache.roles_key, tenant), limit, cursor)
 
     L.info(f"Registering POST http://{host}:{port}/tokens")
 
-    @app.post("/tokens", response_model=Token)
+    def invalid_grant(detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=detail,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    async def password_grant(client: str | None, username: str | None, password: str | None, tenant: str | None):
+        # refreshing needs a secret that cannot be guessed, so only passwords are limited per address
+        wait = login_rate_limiter.check_ip(client)
+        if wait:
+            L.warning("handle_create_token: Rate limiting logins from ip=%s", client)
+            raise too_many_requests("Too many login attempts", wait)
+        if not (username and password and tenant):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="username, password and tenant are required")
+        wait = login_rate_limiter.check_user(tenant, username)
+        if wait:
+            L.warning("handle_create_token: Rate limiting logins of (username,tenant)=%s", (username, tenant))
+            raise too_many_requests("Too many login attempts", wait)
+        try:
+            user = await authenticate_user(db, username, password, tenant, password_hasher, password_policies,
+                                           invalidations)
+        except HasherOverloaded as err:
+            L.warning("handle_create_token: Rejecting login, %s (queue_depth=%s)", err, password_hasher.queue_depth)
+            raise too_many_requests("Too many concurrent logins", password_hasher.retry_after())
+        if not user:
+            raise invalid_grant("Incorrect username or password")
+        return user, None
+
+    async def refresh_token_grant(refresh_token: str | None):
+        if not refresh_token:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="refresh_token is required")
+        redeemed = await redeem_refresh_token(db, refresh_token)
+        if redeemed is None:
+            raise invalid_grant("Invalid refresh token")
+        return redeemed.user, redeemed.family
+
+    @app.post("/tokens", response_model=Token, response_model_exclude_none=True)
     async def handle_create_token(
-            form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-            tenant: Annotated[str, Form()]
+            req: Request,
+            grant_type: Annotated[str, Form(regex="^(password|refresh_token)$")] = "password",
+            username: Annotated[str | None, Form()] = None,
+            password: Annotated[str | None, Form()] = None,
+            tenant: Annotated[str | None, Form()] = None,
+            refresh_token: Annotated[str | None, Form()] = None,
     ):
-        user = await authenticate_user(db, form_data.username, form_data.password, tenant)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect username or password",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        access_token_expires = timedelta(seconds=access_token_expiry)
-        access_token = create_access_token(
-            secret_key,
-            jwt_algorithm,
-            data={
+        if grant_type == "refresh_token":
+            user, family = await refresh_token_grant(refresh_token)
+        else:
+            user, family = await password_grant(req.client.host if req.client else None, username, password, tenant)
+
+        scopes = normalize_scopes(flatten([role.scopes for role in user.roles]))
+        if token_claims == "compact":
+            # /users/me has the email, and disabled is only worth its bytes when it is true
+            data = {
+                "sub": user.username,
+                "tenant": user.tenant.name,
+                **(await scope_dictionaries.compact(user.tenant.name, scopes) or {"scopes": scopes}),
+            }
+            if user.disabled:
+                data["disabled"] = True
+        else:
+            data = {
                 "sub": user.username,
                 "tenant": user.tenant.name,
                 "email": user.email,
                 "disabled": user.disabled,
-                "scopes": flatten([role.scopes for role in user.roles])
-            },
-            expires_delta=access_token_expires
-        )
-        return {"access_token": access_token, "token_type": "bearer"}
+                "scopes": scopes,
+            }
+        access_token_expires = timedelta(seconds=access_token_expiry)
+        access_token = create_access_token(secret_key, jwt_algorithm, data=data, expires_delta=access_token_expires)
+        token = {"access_token": access_token, "token_type": "bearer", "expires_in": access_token_expiry}
+        if refresh_token_expiry > 0:
+            token["refresh_token"] = await issue_refresh_token(db, user.id, timedelta(seconds=refresh_token_expiry),
+                                                               family)
+        return token
 
     L.info(f"Registering POST http://{host}:{port}/users/me")
 
@@ -233,4 +577,44 @@ def register_routes(app: FastAPI, db: AsyncIOClient, **kwargs):
     async def handle_read_users_me(
             req: Request,
     ):
-        return get_current_active_user(await get_current_user(db, secret_key, jwt_algorithm, await OAUTH2(req)))
+        user = await get_current_user(db, secret_key, jwt_algorithm, await OAUTH2(req), token_cache, revocations)
+        return get_current_active_user(user)
+
+    L.info(f"Registering * http://{host}:{port}/auth")
+
+    # a plain starlette endpoint, reverse proxies call this once per proxied request
+    async def handle_forward_auth(req: Request) -> Response:
+        scheme, _, token = req.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return Response(status_code=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+        try:
+            claims = (await validator.validate(token)).claims
+            # tokens of disabled users carry the claim, so the stateless path can refuse them too
+            if claims.get("disabled"):
+                return Response(status_code=status.HTTP_403_FORBIDDEN)
+            if forward_auth_check_user:
+                get_current_active_user(
+                    await get_current_session(db, secret_key, jwt_algorithm, token, token_cache, revocations)
+                )
+        except HTTPException as err:
+            return Response(status_code=err.status_code, headers=err.headers)
+        return Response(headers={
+            "X-Auth-User": header_value(claims["sub"]),
+            "X-Auth-Tenant": header_value(claims["tenant"]),
+            "X-Auth-Scopes": header_value(",".join(claims.get("scopes", ()))),
+        })
+
+    app.add_route("/auth", handle_forward_auth, methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+                  include_in_schema=False)
+
+    if key_set is not None:
+        L.info(f"Registering GET http://{host}:{port}/.well-known/jwks.json")
+
+        jwks_headers = {"ETag": key_set.etag, "Cache-Control": f"public, max-age={jwks_max_age}"}
+
+        async def handle_jwks(req: Request) -> Response:
+            if req.headers.get("if-none-match") == key_set.etag:
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=jwks_headers)
+            return Response(key_set.jwks, media_type="application/json", headers=jwks_headers)
+
+        app.add_route("/.well-known/jwks.json", handle_jwks, methods=["GET", "HEAD"], include_in_schema=False)
@@ -0,0 +1,111 @@
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, Request, status
+
+from libauthproxy.cache import TokenCacheEntry
+from libauthproxy.utils import OAUTH2
+
+SEPARATOR = ":"
+# as a segment it stands for any one segment, as the last segment for one or more
+WILDCARD = "*"
+_END = None
+
+
+def normalize_scope(scope: str) -> str:
+    """
+    Strips whitespace and empty segments, so `" billing::read: "` becomes `"billing:read"`.
+    Scopes stay case-sensitive.
+    """
+    return SEPARATOR.join(part for part in (p.strip() for p in scope.split(SEPARATOR)) if part)
+
+
+def _match(node: dict, parts: list[str], i: int) -> bool:
+    if i == len(parts):
+        return _END in node
+    child = node.get(parts[i])
+    if child is not None and _match(child, parts, i + 1):
+        return True
+    wildcard = node.get(WILDCARD)
+    if wildcard is None:
+        return False
+    return _END in wildcard or _match(wildcard, parts, i + 1)
+
+
+class ScopeSet:
+    """
+    The scopes of a token, compiled for lookups: plain scopes go into a frozenset, wildcard ones
+    such as `billing:*` or `*:read` into a trie that is only walked when the set misses.
+    """
+    __slots__ = ("scopes", "_exact", "_trie")
+
+    def __init__(self, scopes: Iterable[str]):
+        self.scopes = tuple(scopes)
+        self._exact = frozenset(self.scopes)
+        self._trie: Optional[dict] = None
+        for scope in self._exact:
+            parts = scope.split(SEPARATOR)
+            if WILDCARD not in parts:
+                continue
+            node = self._trie = {} if self._trie is None else self._trie
+            for part in parts:
+                node = node.setdefault(part, {})
+            node[_END] = True
+
+    def __contains__(self, scope: str) -> bool:
+        if scope in self._exact:
+            return True
+        return self._trie is not None and _match(self._trie, scope.split(SEPARATOR), 0)
+
+    def satisfies(self, required: Iterable[str]) -> bool:
+        return all(scope in self for scope in required)
+
+
+def normalize_scopes(scopes: Iterable[str]) -> list[str]:
+    """
+    What goes into a token: normalized, deduplicated and sorted so that equal grants produce equal
+    claims. Scopes covered by a wildcard are kept, what covers what is up to ScopeSet.
+    """
+    return sorted({normalize_scope(scope) for scope in scopes} - {""})
+
+
+@lru_cache(maxsize=4096)
+def compile_scopes(scopes: tuple[str, ...]) -> ScopeSet:
+    # tokens of users with the same roles carry the same scopes and share one ScopeSet
+    return ScopeSet(scopes)
+
+
+def scopes_of(entry: TokenCacheEntry) -> ScopeSet:
+    """
+    The compiled scopes of a validated token, kept on its cache entry.
+    """
+    if entry.scope_set is None:
+        entry.scope_set = compile_scopes(tuple(entry.claims.get("scopes", ())))
+    return entry.scope_set
+
+
+def insufficient_scope(required: Iterable[str]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Insufficient scope",
+        headers={"WWW-Authenticate": f'Bearer error="insufficient_scope", scope="{" ".join(required)}"'},
+    )
+
+
+def require_scopes(*scopes: str):
+    """
+    A dependency that lets a request through if its bearer token carries all of `scopes` and
+    returns the token's claims, e.g. `claims: Annotated[dict, Depends(require_scopes("billing:read"))]`.
+
+    Tokens are validated by the coroutine `app.state.decode_token`, which register_token_validator
+    sets up.
+    """
+    required = tuple(sorted({normalize_scope(scope) for scope in scopes}))
+
+    async def dependency(req: Request) -> dict:
+        entry = await req.app.state.decode_token(await OAUTH2(req))
+        if not scopes_of(entry).satisfies(required):
+            raise insufficient_scope(required)
+        return entry.claims
+
+    return dependency
@@ -0,0 +1,62 @@
+import asyncio
+from functools import wraps
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a call for their key is
+    in flight wait for it and share its result, or its exception, instead of starting another.
+
+    The call runs in its own task, so a caller that is cancelled does not cancel it for the others.
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # marks the exception as retrieved in case every caller was cancelled
+            future.exception()
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        key = (asyncio.get_running_loop(), key)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(fn(*args, **kwargs))
+        self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+
+
+def coalesce(fn: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Wraps a `db.py` query function so that concurrent calls with the same client and arguments
+    share one query. The `SingleFlight` is available as `.flight`.
+    """
+    flight = SingleFlight(fn.__name__)
+
+    @wraps(fn)
+    async def wrapper(executor, **kwargs):
+        key = (executor, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return await fn(executor, **kwargs)
+        return await flight.do(key, fn, executor, **kwargs)
+
+    wrapper.flight = flight
+    return wrapper
@@ -2,14 +2,19 @@ import secrets
 from contextlib import contextmanager
 from logging import getLogger as get_logger
 from logging.config import fileConfig as logger_file_config
+from os import environ
 from pathlib import Path
 from typing import Dict, Optional, Annotated
+from urllib.parse import quote
 
 from fastapi import Depends, HTTPException
-from fastapi.security import HTTPBasicCredentials, HTTPBasic
+from fastapi.security import HTTPBasicCredentials, HTTPBasic, OAuth2PasswordBearer
 from starlette import status
 
+from libauthproxy.logs import configure_logging
+
 security = HTTPBasic()
+OAUTH2 = OAuth2PasswordBearer(tokenUrl="token")
 
 
 @contextmanager
@@ -96,5 +101,25 @@ def flatten(l):
     return [item for sublist in l for item in sublist]
 
 
+# printable ASCII passes unchanged, so only identities outside of it look different in a header
+_HEADER_SAFE = "".join(chr(c) for c in range(0x20, 0x7f) if chr(c) != "%")
+
+
+def header_value(value: str) -> str:
+    """
+    Percent-encodes what a latin-1 header cannot carry, e.g. `"Łukasz"` becomes `"%C5%81ukasz"`.
+    """
+    return quote(value, safe=_HEADER_SAFE)
+
+
 logger_file_config(str(Path(__file__).parent / 'logging.conf'), disable_existing_loggers=False)
+configure_logging(
+    # queue writes from a background thread, sync from the logging one
+    mode=environ.get("LOG_MODE", "queue"),
+    # text or json
+    fmt=environ.get("LOG_FORMAT", "text"),
+    # warnings and errors per call site and interval, 0 disables the limit
+    rate_limit=int(environ.get("LOG_RATE_LIMIT", "10")),
+    rate_interval=float(environ.get("LOG_RATE_INTERVAL", "10")),
+)
 L = get_logger(__name__)
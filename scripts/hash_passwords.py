@@ -0,0 +1,52 @@
+"""
+Hashes the passwords of NDJSON records on all cores, e.g. to prepare a /users/import body:
+
+    poetry run python3 scripts/hash_passwords.py < users.ndjson > users-hashed.ndjson
+
+Every line is an object with a "password", it is written out in input order as soon as it is done,
+with a "password_hash" in its place, hashed under the policy of its "tenant_name" as configured by
+$PASSWORD_POLICY and $PASSWORD_TENANT_POLICIES. Lines that cannot be hashed are reported on stderr.
+"""
+import json
+import sys
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from os import cpu_count
+
+from libauthproxy import DEFAULT_PASSWORD_POLICIES, hash_password
+
+
+def hash_line(line: str) -> tuple[str | None, str | None]:
+    """
+    :return: The hashed record or None for blank lines, and an error message if it failed.
+    """
+    if not line.strip():
+        return None, None
+    try:
+        record = json.loads(line)
+        password = record.pop("password")
+        record["password_hash"] = hash_password(password, DEFAULT_PASSWORD_POLICIES.policy(record.get("tenant_name")))
+    except (ValueError, TypeError, KeyError, AttributeError) as err:
+        return None, f"{type(err).__name__}: {err}"
+    return json.dumps(record), None
+
+
+def main() -> int:
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type=int, default=cpu_count() or 1, help="processes, defaults to one per core")
+    parser.add_argument("--chunk-size", type=int, default=4, help="lines handed to a worker at once")
+    args = parser.parse_args()
+
+    failed = 0
+    with Pool(args.workers) as pool:
+        for row, (output, error) in enumerate(pool.imap(hash_line, sys.stdin, args.chunk_size)):
+            if error:
+                failed += 1
+                print(f"line {row + 1}: {error}", file=sys.stderr)
+            elif output:
+                print(output, flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import asyncio
+from datetime import timedelta
+from time import sleep
+from uuid import UUID
+
+import pytest
+from fastapi import HTTPException
+
+from db import GetUserByEmailResult, GetUserByEmailResultTenant, CheckSessionResult
+from libauthproxy import get_current_user, get_current_session, create_access_token
+from libauthproxy.cache import LRUCache, ReadCache, TokenCache
+
+
+class CountingDBMock:
+    def __init__(self, *, query_single_result=None):
+        self.query_single_result = query_single_result
+        self.calls = 0
+
+    async def query_single(self, *args, **kwargs):
+        self.calls += 1
+        return self.query_single_result
+
+
+def make_user(disabled=False):
+    return GetUserByEmailResult(
+        id=UUID('12345678123456781234567812345678'),
+        username="buffy",
+        email="buffy@buff.com",
+        first_name="not-needed",
+        last_name="not-needed",
+        password_hash="not-needed",
+        disabled=disabled,
+        roles=[],
+        tenant=GetUserByEmailResultTenant(id=UUID('12345678123456781234567812345678'), name="aldi")
+    )
+
+
+def test_lru_cache__evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache__expires():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_token_cache__ttl_bounded_by_exp():
+    cache = TokenCache(ttl=60)
+    digest = cache.digest("token")
+    cache.set_valid(digest, {"exp": 0})
+    assert cache.get(digest) is None
+
+
+@pytest.mark.asyncio
+async def test_get_current_user__cached():
+    mock = CountingDBMock(query_single_result=make_user())
+    cache = TokenCache()
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+
+    for _ in range(3):
+        user = await get_current_user(mock, "habins", "HS256", token, cache)
+        assert user.username == "buffy"
+    assert mock.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_get_current_user__negative_cached():
+    mock = CountingDBMock(query_single_result=make_user())
+    cache = TokenCache()
+    token = create_access_token("wrong-secret", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as err:
+            await get_current_user(mock, "habins", "HS256", token, cache)
+        assert err.value.status_code == 401
+    assert len(cache.negative) == 1
+    assert cache.negative.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_get_current_session__cached_next_to_user():
+    session = CheckSessionResult(id=UUID('12345678123456781234567812345678'), disabled=False, roles_version=None)
+    mock = CountingDBMock(query_single_result=session)
+    cache = TokenCache()
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+
+    for _ in range(3):
+        assert await get_current_session(mock, "habins", "HS256", token, cache) is session
+    assert mock.calls == 1
+
+    mock.query_single_result = make_user()
+    assert (await get_current_user(mock, "habins", "HS256", token, cache)).username == "buffy"
+    assert mock.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_token_cache__user_writes_drop_resolved_user():
+    mock = CountingDBMock(query_single_result=make_user())
+    cache = TokenCache()
+    buffy = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    willow = create_access_token("habins", "HS256", {"sub": "willow", "tenant": "aldi"}, timedelta(days=1))
+    await get_current_user(mock, "habins", "HS256", buffy, cache)
+    await get_current_user(mock, "habins", "HS256", willow, cache)
+
+    cache.invalidate_user("aldi", "buffy")
+    await get_current_user(mock, "habins", "HS256", buffy, cache)
+    await get_current_user(mock, "habins", "HS256", willow, cache)
+    assert mock.calls == 3
+
+    cache.invalidate_tenant("aldi")
+    await get_current_user(mock, "habins", "HS256", willow, cache)
+    assert mock.calls == 4
+
+    cache.invalidate_roles("aldi", name="admin")
+    await get_current_user(mock, "habins", "HS256", buffy, cache)
+    assert mock.calls == 5
+
+
+@pytest.mark.asyncio
+async def test_read_cache__invalidates_exact_keys():
+    cache = ReadCache(maxsize=100, ttl=60)
+    fetches = []
+
+    async def fetch(value):
+        fetches.append(value)
+        return value
+
+    assert await cache.get_or_fetch(cache.role_key("aldi", "admin"), lambda: fetch(1)) == 1
+    assert await cache.get_or_fetch(cache.role_key("aldi", "admin"), lambda: fetch(2)) == 1
+    assert await cache.get_or_fetch(cache.role_key("aldi", "viewer"), lambda: fetch(3)) == 3
+    assert await cache.get_or_fetch(cache.user_key("aldi", "buffy"), lambda: fetch(4)) == 4
+
+    cache.invalidate_role("aldi", "admin")
+    assert await cache.get_or_fetch(cache.role_key("aldi", "admin"), lambda: fetch(5)) == 5
+    assert await cache.get_or_fetch(cache.role_key("aldi", "viewer"), lambda: fetch(6)) == 3
+    # users embed their roles
+    assert await cache.get_or_fetch(cache.user_key("aldi", "buffy"), lambda: fetch(7)) == 7
+    assert fetches == [1, 3, 4, 5, 7]
+
+
+@pytest.mark.asyncio
+async def test_read_cache__tenant_change_cascades():
+    cache = ReadCache(maxsize=100, ttl=60)
+
+    async def fetch(value):
+        return value
+
+    await cache.get_or_fetch(cache.users_key("aldi", 10), lambda: fetch("users"))
+    await cache.get_or_fetch(cache.role_key("lidl", "admin"), lambda: fetch("role"))
+    cache.invalidate_tenant("aldi")
+    assert await cache.get_or_fetch(cache.users_key("aldi", 10), lambda: fetch("fresh")) == "fresh"
+    assert await cache.get_or_fetch(cache.role_key("lidl", "admin"), lambda: fetch("fresh")) == "role"
+
+
+@pytest.mark.asyncio
+async def test_read_cache__does_not_store_fetches_overlapping_a_write():
+    cache = ReadCache(maxsize=100, ttl=60)
+
+    async def fetch():
+        cache.invalidate_tenant("aldi")
+        return "stale"
+
+    assert await cache.get_or_fetch(cache.tenant_key("aldi"), fetch) == "stale"
+    assert len(cache.lru) == 0
+
+
+@pytest.mark.asyncio
+async def test_read_cache__does_not_join_fetches_from_before_a_write():
+    cache = ReadCache(maxsize=100, ttl=60)
+    row = "old"
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def fetch():
+        value = row
+        started.set()
+        await release.wait()
+        return value
+
+    first = asyncio.create_task(cache.get_or_fetch(cache.tenant_key("aldi"), fetch))
+    await started.wait()
+    row = "new"
+    cache.invalidate_tenant("aldi")
+    second = asyncio.create_task(cache.get_or_fetch(cache.tenant_key("aldi"), fetch))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first == "old"
+    assert await second == "new"
+    assert await cache.get_or_fetch(cache.tenant_key("aldi"), fetch) == "new"
@@ -0,0 +1,89 @@
+import pytest
+from jose import jwt
+from starlette import status
+from starlette.testclient import TestClient
+from uuid import UUID
+
+from authproxy import init_app
+from db import GetUserByUsernameResult, GetUserByEmailResultRolesItem, GetUserByEmailResultTenant
+from libauthproxy.cache import TokenCacheEntry
+from libauthproxy.claims import ScopeDictionaries, ScopeDictionary, decode_bitmap, encode_bitmap
+
+# obtained by running `poetry run python3 scripts/hash_password.py password`
+PASSWORD_HASH = "$2b$12$lYWCG4Gu9mRViAKBjKW0zudnt9eXeQb0SHEIfJ4fSz3JJ2P1Zdyea"
+
+
+class ScopesDBMock:
+    def __init__(self, scopes: list[str], user=None):
+        self.scopes = scopes
+        self.user = user
+        self.dictionaries = {}
+        self.lists = 0
+
+    async def query(self, query, **kwargs):
+        self.lists += 1
+        return list(self.scopes)
+
+    async def query_single(self, query, **kwargs):
+        if "INSERT ScopeDictionary" in query:
+            self.dictionaries[(kwargs["tenant"], kwargs["version"])] = kwargs["scopes"]
+        elif "ScopeDictionary" in query:
+            return self.dictionaries.get((kwargs["tenant"], kwargs["version"]))
+        else:
+            return self.user
+
+
+def test_bitmap_roundtrip():
+    assert decode_bitmap(encode_bitmap([])) == 0
+    assert decode_bitmap(encode_bitmap([0, 9, 70])) == 1 | 1 << 9 | 1 << 70
+
+
+def test_scope_dictionary__content_addressed():
+    dictionary = ScopeDictionary(["b", "a", "c", "a"])
+    assert dictionary.scopes == ("a", "b", "c")
+    assert dictionary.version == ScopeDictionary(["c", "b", "a"]).version
+    assert dictionary.version != ScopeDictionary(["a", "b"]).version
+    assert dictionary.decode(dictionary.encode(["c", "a"])) == ["a", "c"]
+    assert dictionary.encode(["d"]) is None
+
+
+@pytest.mark.asyncio
+async def test_scope_dictionaries__compact_and_expand_elsewhere():
+    db = ScopesDBMock(["billing:read", "shipping"])
+    issuer = ScopeDictionaries(db)
+    claims = await issuer.compact("aldi", ["shipping"])
+    assert await issuer.compact("aldi", ["billing:read"]) is not None
+    assert db.lists == 1
+    # a role gained a scope after the dictionary was built
+    db.scopes.append("stock")
+    assert await issuer.compact("aldi", ["stock"]) is not None
+    assert db.lists == 2
+    assert len(db.dictionaries) == 2
+
+    # another instance resolves the first version from the database
+    entry = TokenCacheEntry({"sub": "buffy", "tenant": "aldi", **claims})
+    assert await ScopeDictionaries(db).expand(entry)
+    assert entry.claims["scopes"] == ["shipping"]
+    assert not await ScopeDictionaries(None).expand(TokenCacheEntry({"sub": "buffy", "tenant": "aldi", **claims}))
+
+
+def test_create_token__compact_claims():
+    user = GetUserByUsernameResult(
+        id=UUID(int=1), username="buffy", email="buffy@buff.com", first_name="", last_name="",
+        password_hash=PASSWORD_HASH, disabled=False, tenant=GetUserByEmailResultTenant(id=UUID(int=2), name="aldi"),
+        roles=[GetUserByEmailResultRolesItem(id=UUID(int=3), name="clerk", scopes=["billing:read", "shipping"])],
+    )
+    db = ScopesDBMock(["admin", "billing:read", "shipping"], user)
+    app = init_app(db=db, secret_key="habins", admin_username="admin", admin_password="admin",
+                   token_claims="compact", refresh_token_expiry=0)
+    client = TestClient(app)
+    res = client.post("/tokens", data={"username": "buffy", "password": "password", "tenant": "aldi"})
+    assert res.status_code == status.HTTP_200_OK
+    token = res.json()["access_token"]
+    claims = jwt.get_unverified_claims(token)
+    assert "scopes" not in claims and "email" not in claims and "disabled" not in claims
+    assert set(claims) >= {"sub", "tenant", "sv", "sb"}
+
+    res = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["x-auth-scopes"] == "billing:read,shipping"
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from uuid import UUID
+
+from db import GetUserByUsernameResult, GetUserByEmailResultTenant
+from libauthproxy import authenticate_user, create_password_hasher, hash_password
+from libauthproxy.hashing import PasswordHasher, HasherOverloaded, PasswordPolicies, crypt_context
+from libauthproxy.invalidation import InvalidationBus
+
+# obtained by running `poetry run python3 scripts/hash_password.py password`
+PASSWORD_HASH = "$2b$12$lYWCG4Gu9mRViAKBjKW0zudnt9eXeQb0SHEIfJ4fSz3JJ2P1Zdyea"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["inline", "thread", "process"])
+async def test_password_hasher__verify(mode):
+    hasher = create_password_hasher(mode=mode, workers=2)
+    try:
+        assert await hasher.verify("password", PASSWORD_HASH)
+        assert not await hasher.verify("BIGMOE", PASSWORD_HASH)
+        assert hasher.pending == 0
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_password_hasher__hash_roundtrip():
+    hasher = create_password_hasher(mode="thread", workers=1)
+    try:
+        hashed = await hasher.hash("password")
+        assert await hasher.verify("password", hashed)
+    finally:
+        hasher.shutdown()
+
+
+def slow_verify(plain_password, hashed_password):
+    time.sleep(0.2)
+    return True
+
+
+@pytest.mark.asyncio
+async def test_password_hasher__overloaded():
+    hasher = PasswordHasher(slow_verify, hash_password, mode="thread", workers=1, queue_size=1)
+    try:
+        jobs = [asyncio.ensure_future(hasher.verify("a", "b")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert hasher.queue_depth == 1
+        with pytest.raises(HasherOverloaded):
+            await hasher.verify("a", "b")
+        assert await asyncio.gather(*jobs) == [True, True]
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_password_hasher__retry_after():
+    hasher = PasswordHasher(slow_verify, hash_password, mode="thread", workers=1, queue_size=4)
+    try:
+        await hasher.verify("a", "b")
+        assert hasher.average_seconds >= 0.2
+        jobs = [asyncio.ensure_future(hasher.verify("a", "b")) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert hasher.retry_after() >= 0.4
+        await asyncio.gather(*jobs)
+        assert hasher.retry_after() == 0
+    finally:
+        hasher.shutdown()
+
+
+class UserDBMock:
+    def __init__(self, user):
+        self.user = user
+        self.updates = []
+
+    async def query_single(self, query, **kwargs):
+        if query.lstrip().startswith("UPDATE"):
+            self.updates.append(kwargs)
+        return self.user
+
+
+@pytest.mark.asyncio
+async def test_authenticate_user__upgrades_hash_in_background():
+    policies = PasswordPolicies(
+        {"schemes": ["bcrypt"], "deprecated": "auto", "bcrypt__rounds": 5},
+        {"svc": {"schemes": ["bcrypt"], "deprecated": "auto", "bcrypt__rounds": 4}},
+    )
+    old_hash = crypt_context(policies.policy("svc")).hash("password")
+    assert not policies.needs_update("svc", old_hash)
+    db = UserDBMock(GetUserByUsernameResult(
+        id=UUID(int=1), username="buffy", email="buffy@buff.com", first_name="", last_name="",
+        password_hash=old_hash, disabled=False, roles=[], tenant=GetUserByEmailResultTenant(id=UUID(int=2), name="aldi"),
+    ))
+    invalidations = InvalidationBus()
+    invalidated = []
+    invalidations.subscribe("user", lambda **fields: invalidated.append(fields))
+    hasher = create_password_hasher(mode="thread", workers=1)
+    try:
+        assert await authenticate_user(db, "buffy", "password", "aldi", hasher, policies, invalidations)
+        assert policies.upgrades == 1
+        await asyncio.gather(*policies._upgrading)
+        assert invalidated == [{"tenant": "aldi", "username": "buffy"}]
+        [update] = db.updates
+        assert update["old_password_hash"] == old_hash
+        assert update["password_hash"].startswith("$2b$05$")
+        assert await hasher.verify("password", update["password_hash"], policies.policy("aldi"))
+
+        assert not await authenticate_user(db, "buffy", "wrong", "aldi", hasher, policies)
+        assert policies.upgrades == 1
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,44 @@
+import httpx
+from edgedb.errors import ClientConnectionFailedError
+from fastapi import FastAPI
+from starlette import status
+from starlette.testclient import TestClient
+
+from libauthproxy.health import register_health_routes
+
+
+class PoolDBMock:
+    def __init__(self, *, failures=0):
+        self.failures = failures
+        self.queries = 0
+        self.max_concurrency = 8
+        self.free_size = 6
+
+    async def ensure_connected(self):
+        if self.failures:
+            self.failures -= 1
+            raise ClientConnectionFailedError("no server")
+
+    async def query_single(self, query):
+        self.queries += 1
+
+
+def test_readyz__reports_pool_after_warm_up():
+    mock = PoolDBMock()
+    app = FastAPI()
+    register_health_routes(app, mock, db_warm_connections=3)
+    with TestClient(app) as client:
+        res: httpx.Response = client.get("/readyz")
+        assert res.status_code == status.HTTP_200_OK
+        assert res.json()["pool"] == {"max_concurrency": 8, "free": 6, "in_use": 2, "saturation": 0.25}
+        assert client.get("/healthz").status_code == status.HTTP_200_OK
+    assert mock.queries == 3
+
+
+def test_readyz__retries_a_failed_warm_up():
+    mock = PoolDBMock(failures=2)
+    app = FastAPI()
+    register_health_routes(app, mock)
+    with TestClient(app) as client:
+        assert client.get("/readyz").status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert client.get("/readyz").status_code == status.HTTP_200_OK
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+import pytest
+
+from db import ListChangesResult, ListChangesResultChangesItem
+from libauthproxy.invalidation import EdgeDBPollTransport, InvalidationBus, UnixSocketTransport
+
+
+@pytest.mark.asyncio
+async def test_unix_socket_transport__fans_out_to_other_workers(tmp_path):
+    received = []
+    publisher = InvalidationBus([UnixSocketTransport(str(tmp_path))])
+    subscriber = InvalidationBus([UnixSocketTransport(str(tmp_path))])
+    # both live in this process, give the subscriber its own socket name
+    subscriber.transports[0].path = tmp_path / "other.sock"
+    publisher.subscribe("user", lambda **fields: received.append(("publisher", fields)))
+    subscriber.subscribe("user", lambda **fields: received.append(("subscriber", fields)))
+    (tmp_path / "dead.sock").touch()
+    await publisher.start()
+    await subscriber.start()
+    try:
+        await publisher.publish("user", tenant="aldi", username="buffy")
+        for _ in range(100):
+            if subscriber.received:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await publisher.stop()
+        await subscriber.stop()
+
+    assert received == [("publisher", {"tenant": "aldi", "username": "buffy"}),
+                        ("subscriber", {"tenant": "aldi", "username": "buffy"})]
+    assert not (tmp_path / "dead.sock").exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+class ChangesDBMock:
+    def __init__(self):
+        self.changes = []
+
+    async def query_single(self, query, **kwargs):
+        return ListChangesResult(changes=list(self.changes), now=datetime.now(timezone.utc))
+
+
+@pytest.mark.asyncio
+async def test_edgedb_poll_transport__delivers_new_changes_once():
+    mock = ChangesDBMock()
+    mock.changes = [ListChangesResultChangesItem(
+        id=UUID(int=1), event='{"kind":"tenant","fields":{"tenant":"old"}}',
+        created_at=datetime.now(timezone.utc) - timedelta(seconds=1),
+    )]
+    delivered = []
+    transport = EdgeDBPollTransport(mock, interval=1)
+    await transport.poll(delivered.append)
+    assert delivered == []
+
+    mock.changes.append(ListChangesResultChangesItem(
+        id=UUID(int=2), event='{"kind":"tenant","fields":{"tenant":"aldi"}}', created_at=datetime.now(timezone.utc),
+    ))
+    await transport.poll(delivered.append)
+    await transport.poll(delivered.append)
+    assert delivered == [{"kind": "tenant", "fields": {"tenant": "aldi"}}]
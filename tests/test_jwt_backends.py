@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+import pytest
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from libauthproxy.jwt_backends import HMACBackend, JoseBackend
+
+CLAIMS = {"sub": "buffy", "tenant": "aldi", "scopes": ["a", "b"]}
+
+
+@pytest.mark.parametrize("algorithm", ["HS256", "HS384", "HS512"])
+def test_hmac_backend__interoperates_with_jose(algorithm):
+    fast, jose = HMACBackend(), JoseBackend()
+    claims = {**CLAIMS, "exp": datetime.utcnow() + timedelta(minutes=5)}
+
+    token = fast.encode(claims, "habins", algorithm)
+    assert jose.decode(token, "habins", [algorithm])["sub"] == "buffy"
+
+    token = jose.encode(claims, "habins", algorithm)
+    assert fast.decode(token, "habins", [algorithm]) == jose.decode(token, "habins", [algorithm])
+
+
+def test_hmac_backend__rejects():
+    fast = HMACBackend()
+    token = fast.encode(CLAIMS, "habins", "HS256")
+
+    with pytest.raises(JWTError):
+        fast.decode(token, "not-habins", ["HS256"])
+    with pytest.raises(JWTError):
+        fast.decode(token, "habins", ["HS512"])
+    with pytest.raises(JWTError):
+        fast.decode(token[:-2], "habins", ["HS256"])
+    with pytest.raises(JWTError):
+        fast.decode("not.a.token", "habins", ["HS256"])
+    with pytest.raises(ExpiredSignatureError):
+        fast.decode(fast.encode({**CLAIMS, "exp": datetime.utcnow() - timedelta(minutes=5)}, "habins", "HS256"),
+                    "habins", ["HS256"])
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, PublicFormat
+from fastapi import HTTPException
+from starlette import status
+from starlette.testclient import TestClient
+
+from authproxy import init_app
+from libauthproxy import create_access_token, decode_access_token, create_key_set
+
+
+def write_key(path, private_key) -> tuple[str, str]:
+    private_path, public_path = path / "key.pem", path / "key.pub.pem"
+    private_path.write_bytes(private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()))
+    public_path.write_bytes(private_key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo))
+    return str(private_path), str(public_path)
+
+
+@pytest.mark.parametrize("private_key,algorithm", [
+    (rsa.generate_private_key(public_exponent=65537, key_size=2048), "RS256"),
+    (ec.generate_private_key(ec.SECP256R1()), "ES256"),
+    (ed25519.Ed25519PrivateKey.generate(), "EdDSA"),
+])
+def test_key_set__sign_and_verify(tmp_path, private_key, algorithm):
+    private_path, _ = write_key(tmp_path, private_key)
+    key_set = create_key_set(private_path, algorithm="RS256")
+    assert key_set.signing_key.algorithm == algorithm
+
+    token = create_access_token(key_set, "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    assert decode_access_token(key_set, "HS256", token).claims["sub"] == "buffy"
+
+
+def test_key_set__rotation(tmp_path):
+    (tmp_path / "old").mkdir()
+    (tmp_path / "new").mkdir()
+    old_private, old_public = write_key(tmp_path / "old", ec.generate_private_key(ec.SECP256R1()))
+    new_private, _ = write_key(tmp_path / "new", ed25519.Ed25519PrivateKey.generate())
+
+    old_token = create_access_token(create_key_set(old_private), "", {"sub": "buffy", "tenant": "aldi"},
+                                    timedelta(days=1))
+    rotated = create_key_set(new_private, public_keys=[old_public])
+    assert decode_access_token(rotated, "", old_token).claims["sub"] == "buffy"
+
+    with pytest.raises(HTTPException) as err:
+        decode_access_token(create_key_set(new_private), "", old_token)
+    assert err.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_jwks__etag(tmp_path):
+    private_path, _ = write_key(tmp_path, ed25519.Ed25519PrivateKey.generate())
+    app = init_app(db=None, jwt_private_key=private_path, admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    res: httpx.Response = client.get("/.well-known/jwks.json")
+    assert res.status_code == status.HTTP_200_OK
+    (key,) = res.json()["keys"]
+    assert key["kty"] == "OKP"
+    assert key["alg"] == "EdDSA"
+    assert "d" not in key
+
+    res = client.get("/.well-known/jwks.json", headers={"if-none-match": res.headers["etag"]})
+    assert res.status_code == status.HTTP_304_NOT_MODIFIED
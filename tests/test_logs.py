@@ -0,0 +1,29 @@
+import json
+import logging
+
+from libauthproxy.logs import JSONFormatter, RateLimitFilter
+
+
+def make_record(msg: str, lineno: int = 1, level: int = logging.ERROR, *args) -> logging.LogRecord:
+    return logging.LogRecord("libauthproxy", level, "routes.py", lineno, msg, args, None, func="handle")
+
+
+def test_rate_limit_filter__limits_per_call_site():
+    rate_limit_filter = RateLimitFilter(limit=2, interval=60)
+    assert [rate_limit_filter.filter(make_record("failed")) for _ in range(4)] == [True, True, False, False]
+    assert rate_limit_filter.filter(make_record("other site", lineno=2))
+    assert rate_limit_filter.filter(make_record("info", level=logging.INFO))
+    assert rate_limit_filter.suppressed == 2
+
+    rate_limit_filter.interval = 0
+    record = make_record("failed")
+    assert rate_limit_filter.filter(record)
+    assert record.msg == "failed (suppressed 2 similar messages)"
+
+
+def test_json_formatter():
+    entry = json.loads(JSONFormatter().format(make_record("user=%s", 7, logging.ERROR, "buffy")))
+    assert entry["message"] == "user=buffy"
+    assert entry["level"] == "ERROR"
+    assert entry["func"] == "handle"
+    assert entry["line"] == 7
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+import httpx
+import pytest
+from starlette import status
+from starlette.testclient import TestClient
+
+from authproxy import init_app
+from db import read_tenant
+from libauthproxy import create_access_token
+from libauthproxy.metrics import Histogram, InstrumentedExecutor, DB_QUERY_SECONDS
+
+
+class DBMock:
+    async def query_single(self, *args, **kwargs):
+        return None
+
+
+def test_histogram__renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    histogram.labels("a").observe(0.05)
+    histogram.labels("a").observe(0.5)
+    histogram.labels("a").observe(5)
+    assert list(histogram.render()) == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="a",le="0.1"} 1',
+        'latency_seconds_bucket{route="a",le="1"} 2',
+        'latency_seconds_bucket{route="a",le="+Inf"} 3',
+        'latency_seconds_sum{route="a"} 5.55',
+        'latency_seconds_count{route="a"} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_instrumented_executor__labels_by_db_function():
+    before = DB_QUERY_SECONDS.labels("read_tenant").counts[:]
+    await read_tenant(InstrumentedExecutor(DBMock()), tenant="aldi")
+    assert sum(DB_QUERY_SECONDS.labels("read_tenant").counts) == sum(before) + 1
+
+
+def test_metrics__exposes_routes_and_state():
+    app = init_app(db=DBMock(), secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    assert client.get("/auth", headers={"authorization": f"Bearer {token}"}).status_code == status.HTTP_200_OK
+
+    res: httpx.Response = client.get("/metrics")
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'authproxy_http_request_duration_seconds_count{route="handle_forward_auth",method="GET",status="200"}' \
+           in res.text
+    assert 'authproxy_jwt_duration_seconds_count{operation="decode"}' in res.text
+    assert 'authproxy_cache_misses_total{cache="token"} 1' in res.text
+    assert "authproxy_password_queue_depth 0" in res.text
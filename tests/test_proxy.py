@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+from uuid import UUID
+
+import httpx
+from fastapi import FastAPI
+from jose import jwt
+from starlette import status
+from starlette.requests import Request
+from starlette.testclient import TestClient
+
+from authproxy import init_proxy_app
+from db import ListRevocationsResult, ListRevocationsResultTokensItem
+from libauthproxy import create_access_token
+
+
+def create_upstream() -> FastAPI:
+    upstream = FastAPI()
+
+    @upstream.api_route("/{path:path}", methods=["GET", "POST"])
+    async def echo(path: str, req: Request):
+        return {
+            "path": "/" + path,
+            "query": req.url.query,
+            "body": (await req.body()).decode(),
+            "user": req.headers.get("x-auth-user"),
+            "scopes": req.headers.get("x-auth-scopes"),
+        }
+
+    return upstream
+
+
+class RevocationDBMock:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    async def query_single(self, query, **kwargs):
+        return ListRevocationsResult(tokens=self.tokens, rules=[], now=datetime.now(timezone.utc))
+
+
+def create_client(**kwargs) -> TestClient:
+    # without a db the proxy would connect to EdgeDB for revocations
+    kwargs.setdefault("revocation_refresh_interval", 0)
+    app = init_proxy_app(
+        secret_key="habins",
+        proxy_routes=[
+            {"prefix": "/billing", "upstream": "http://billing", "scopes": ["billing"]},
+            {"prefix": "/public", "upstream": "http://public", "strip_prefix": True},
+        ],
+        proxy_transport=httpx.ASGITransport(app=create_upstream()),
+        **kwargs
+    )
+    return TestClient(app)
+
+
+def bearer(scopes: list[str]) -> dict:
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi", "scopes": scopes},
+                                timedelta(days=1))
+    return {"authorization": f"Bearer {token}"}
+
+
+def test_proxy__forwards_request_and_identity():
+    client = create_client()
+    res: httpx.Response = client.post("/billing/invoices?page=2", content=b"hello",
+                                      headers={**bearer(["billing"]), "x-auth-user": "spoofed"})
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json() == {
+        "path": "/billing/invoices",
+        "query": "page=2",
+        "body": "hello",
+        "user": "buffy",
+        "scopes": "billing",
+    }
+
+
+def test_proxy__non_ascii_identity():
+    client = create_client()
+    token = create_access_token("habins", "HS256", {"sub": "Łukasz", "tenant": "aldi", "scopes": ["billing"]},
+                                timedelta(days=1))
+    res: httpx.Response = client.get("/billing/invoices", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_200_OK
+    assert unquote(res.json()["user"]) == "Łukasz"
+
+
+def test_proxy__strip_prefix():
+    client = create_client()
+    res: httpx.Response = client.get("/public/status", headers=bearer([]))
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json()["path"] == "/status"
+
+
+def test_proxy__missing_scope():
+    client = create_client()
+    res: httpx.Response = client.get("/billing/invoices", headers=bearer(["shipping"]))
+    assert res.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_proxy__disabled_user():
+    client = create_client()
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi", "scopes": ["billing"],
+                                                    "disabled": True}, timedelta(days=1))
+    res: httpx.Response = client.get("/billing/invoices", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_proxy__revoked_token():
+    headers = bearer(["billing"])
+    jti = jwt.get_unverified_claims(headers["authorization"].partition(" ")[2])["jti"]
+    mock = RevocationDBMock([ListRevocationsResultTokensItem(
+        id=UUID(int=1), jti=jti, expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )])
+    with create_client(db=mock, revocation_refresh_interval=5) as client:
+        res: httpx.Response = client.get("/billing/invoices", headers=headers)
+        assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_proxy__invalid_token():
+    client = create_client()
+    assert client.get("/billing/invoices").status_code == status.HTTP_401_UNAUTHORIZED
+    res: httpx.Response = client.get("/billing/invoices", headers={"authorization": "Bearer nope"})
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_proxy__unknown_prefix():
+    client = create_client()
+    assert client.get("/shipping", headers=bearer([])).status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_proxy__wildcard_scope():
+    client = TestClient(init_proxy_app(
+        secret_key="habins",
+        proxy_routes=[{"prefix": "/billing", "upstream": "http://billing", "scopes": ["billing:invoices:read"]}],
+        proxy_transport=httpx.ASGITransport(app=create_upstream()),
+        revocation_refresh_interval=0,
+    ))
+    assert client.get("/billing/invoices", headers=bearer(["billing:*"])).status_code == status.HTTP_200_OK
+    assert client.get("/billing/invoices", headers=bearer(["billing"])).status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,28 @@
+from libauthproxy.ratelimit import TokenBuckets, LoginRateLimiter
+
+
+def test_token_buckets__burst_then_refill():
+    buckets = TokenBuckets(rate=1, burst=3, slots=16)
+    assert [buckets.take("a", now=0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a", now=0) == 1
+    assert buckets.take("a", now=0.5) == 0.5
+    assert buckets.take("a", now=1.5) == 0
+    # other keys have buckets of their own
+    assert buckets.take("b", now=1.5) == 0
+
+
+def test_token_buckets__fixed_size_evicts_idle_keys():
+    buckets = TokenBuckets(rate=1, burst=1, slots=4)
+    for i in range(100):
+        buckets.take(i, now=i)
+    assert buckets.evictions > 0
+    assert len(buckets._keys) == 4
+
+
+def test_login_rate_limiter__per_user_and_disabled_limits():
+    limiter = LoginRateLimiter(ip=None, tenant=None, user=TokenBuckets(rate=0.1, burst=1))
+    assert limiter.check_ip("10.0.0.1") == 0
+    assert limiter.check_user("aldi", "alice") == 0
+    assert limiter.check_user("aldi", "alice") > 0
+    assert limiter.check_user("aldi", "bob") == 0
+    assert limiter.rejected == 1
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+from time import sleep
+from uuid import UUID
+
+import httpx
+import pytest
+from edgedb import MissingRequiredError
+from jose import jwt
+from starlette import status
+from starlette.testclient import TestClient
+
+from authproxy import init_app
+from db import (
+    GetUserByEmailResultTenant,
+    ListRevocationsResult,
+    ListRevocationsResultRulesItem,
+    ListRevocationsResultTokensItem,
+    RevokeAllTokensResult,
+)
+from libauthproxy import create_access_token
+from libauthproxy.revocation import RevocationList
+
+
+class RevocationDBMock:
+    def __init__(self, *, tokens=(), rules=()):
+        self.tokens = list(tokens)
+        self.rules = list(rules)
+        self.since = []
+
+    async def query_single(self, query, **kwargs):
+        if "RevokedToken {jti, expires_at}" in query:
+            self.since.append(kwargs["since"])
+            result = ListRevocationsResult(tokens=self.tokens, rules=self.rules, now=datetime.now(timezone.utc))
+            self.tokens, self.rules = [], []
+            return result
+        if "INSERT RevocationRule" in query:
+            if kwargs["tenant"] != "aldi":
+                raise MissingRequiredError("missing value for required link 'tenant'")
+            return RevokeAllTokensResult(id=UUID(int=1), not_before=datetime.now(timezone.utc), refresh_tokens=0)
+        if "INSERT RevokedToken" in query:
+            return None
+
+
+def in_an_hour() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(hours=1)
+
+
+@pytest.mark.asyncio
+async def test_revocation_list__refresh_is_incremental():
+    mock = RevocationDBMock(
+        tokens=[ListRevocationsResultTokensItem(id=UUID(int=1), jti="a", expires_at=in_an_hour()),
+                ListRevocationsResultTokensItem(id=UUID(int=2), jti="b", expires_at=datetime.now(timezone.utc))],
+        rules=[ListRevocationsResultRulesItem(
+            id=UUID(int=3),
+            tenant=GetUserByEmailResultTenant(id=UUID(int=4), name="aldi"),
+            username="buffy",
+            not_before=datetime.now(timezone.utc),
+        )],
+    )
+    revocations = RevocationList(refresh_interval=5)
+    await revocations.refresh(mock)
+    await revocations.refresh(mock)
+
+    assert mock.since[0] is None
+    assert mock.since[1] is not None
+    assert set(revocations.jtis) == {"a"}
+    assert revocations.is_revoked({"jti": "a"})
+    assert not revocations.is_revoked({"jti": "c", "sub": "buffy", "tenant": "aldi", "iat": 2 ** 40})
+    assert revocations.is_revoked({"jti": "c", "sub": "buffy", "tenant": "aldi", "iat": 0})
+    assert not revocations.is_revoked({"jti": "c", "sub": "willow", "tenant": "aldi", "iat": 0})
+
+
+def test_create_access_token__sets_jti():
+    first = jwt.get_unverified_claims(create_access_token("habins", "HS256", {"sub": "buffy"}, timedelta(days=1)))
+    second = jwt.get_unverified_claims(create_access_token("habins", "HS256", {"sub": "buffy"}, timedelta(days=1)))
+    assert first["jti"] != second["jti"]
+    assert first["iat"] <= first["exp"]
+
+
+def test_forward_auth__revoked_token():
+    mock = RevocationDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    with TestClient(app) as client:
+        assert client.get("/auth", headers={"authorization": f"Bearer {token}"}).status_code == status.HTTP_200_OK
+
+        res: httpx.Response = client.post("/tokens/revoke", json={"jti": jwt.get_unverified_claims(token)["jti"]},
+                                          auth=("admin", "admin"))
+        assert res.status_code == status.HTTP_200_OK
+
+        res = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+        assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_revocation_list__same_second():
+    revocations = RevocationList(refresh_interval=5)
+    not_before = datetime(2023, 1, 1, 12, 0, 0, 700000, tzinfo=timezone.utc)
+    revocations.revoke_all("aldi", None, not_before)
+    revoked_at = not_before.timestamp()
+    assert revocations.is_revoked({"sub": "buffy", "tenant": "aldi", "iat": revoked_at - 0.2})
+    assert not revocations.is_revoked({"sub": "buffy", "tenant": "aldi", "iat": revoked_at + 0.2})
+    # a whole second "iat" could be from before the revocation
+    assert revocations.is_revoked({"sub": "buffy", "tenant": "aldi", "iat": int(revoked_at)})
+
+
+def test_forward_auth__revoked_tenant():
+    mock = RevocationDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    with TestClient(app) as client:
+        res: httpx.Response = client.post("/tenants/aldi/revoke", auth=("admin", "admin"))
+        assert res.status_code == status.HTTP_200_OK
+
+        res = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+        assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_forward_auth__issued_after_revoke():
+    mock = RevocationDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    with TestClient(app) as client:
+        res: httpx.Response = client.post("/tenants/aldi/revoke", auth=("admin", "admin"))
+        assert res.status_code == status.HTTP_200_OK
+
+        # "iat" is rounded down to milliseconds, within the same one the token counts as revoked
+        sleep(0.002)
+        token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+        res = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+        assert res.status_code == status.HTTP_200_OK
+
+
+def test_revoke_all__unknown_tenant():
+    mock = RevocationDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    with TestClient(app) as client:
+        res: httpx.Response = client.post("/tenants/lidl/users/buffy/revoke", auth=("admin", "admin"))
+        assert res.status_code == status.HTTP_404_NOT_FOUND
@@ -1,15 +1,27 @@
-from datetime import timedelta
+import json
+from datetime import timedelta, datetime, timezone
+from urllib.parse import unquote
 from uuid import UUID
 
 import httpx
 import pytest
+from edgedb.errors import ConstraintViolationError
 from fastapi import HTTPException
 from starlette import status
 from starlette.testclient import TestClient
 
 from authproxy import init_app
-from db import GetUserByEmailResult, GetUserByEmailResultTenant
-from libauthproxy import get_current_user, create_access_token
+from db import (
+    GetUserByEmailResult,
+    GetUserByEmailResultTenant,
+    CheckSessionResult,
+    ListTenantsResult,
+    ReadRefreshTokenResult,
+    UseRefreshTokenResult,
+    UseRefreshTokenResultUser,
+)
+from libauthproxy import get_current_user, create_access_token, verify_password
+from libauthproxy.pagination import decode_cursor, encode_cursor
 
 
 class DBMock:
@@ -211,3 +223,295 @@ async def test_users_me__happy_flow():
         token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
         res: httpx.Response = client.get("/users/me", headers={"authorization": f"Bearer {token}"})
         assert res.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_forward_auth__happy_flow():
+    mock = DBMock(query_single_result=None)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi", "scopes": ["a", "b"]},
+                                timedelta(days=1))
+    res: httpx.Response = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["x-auth-user"] == "buffy"
+    assert res.headers["x-auth-tenant"] == "aldi"
+    assert res.headers["x-auth-scopes"] == "a,b"
+
+
+def test_forward_auth__non_latin1_identity():
+    mock = DBMock(query_single_result=None)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    for username in ("Łukasz", "用户"):
+        token = create_access_token("habins", "HS256", {"sub": username, "tenant": "aldi", "scopes": ["a"]},
+                                    timedelta(days=1))
+        res: httpx.Response = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+        assert res.status_code == status.HTTP_200_OK
+        assert unquote(res.headers["x-auth-user"]) == username
+        assert res.headers["x-auth-tenant"] == "aldi"
+
+
+def test_forward_auth__invalid_token():
+    mock = DBMock(query_single_result=None)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    token = create_access_token("not-habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    assert client.get("/auth").status_code == status.HTTP_401_UNAUTHORIZED
+    res: httpx.Response = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+    assert res.headers["www-authenticate"] == "Bearer"
+
+
+def test_forward_auth__check_user_disabled():
+    mock = DBMock(query_single_result=CheckSessionResult(
+        id=UUID('12345678123456781234567812345678'),
+        disabled=True,
+        roles_version=None,
+    ))
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin",
+                   forward_auth_check_user=True)
+    client = TestClient(app)
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    res: httpx.Response = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_forward_auth__disabled_claim():
+    mock = DBMock(query_single_result=None)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi", "disabled": True},
+                                timedelta(days=1))
+    res: httpx.Response = client.get("/auth", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_403_FORBIDDEN
+    assert "x-auth-user" not in res.headers
+
+
+def test_forward_auth__any_method():
+    mock = DBMock(query_single_result=None)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi"}, timedelta(days=1))
+    res: httpx.Response = client.post("/auth", headers={"authorization": f"Bearer {token}"})
+    assert res.status_code == status.HTTP_200_OK
+
+
+def test_list_tenants__paginated():
+    tenants = [
+        ListTenantsResult(id=UUID(int=i), name=f"tenant-{i}", created_at=datetime(2023, 1, 1))
+        for i in range(1, 3)
+    ]
+    mock = DBMock(query_result=tenants)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    res: httpx.Response = client.get("/tenants", params={"limit": 2}, auth=("admin", "admin"))
+    assert res.status_code == status.HTTP_200_OK
+    assert [t["name"] for t in res.json()] == ["tenant-1", "tenant-2"]
+    assert decode_cursor(res.headers["x-next-cursor"]) == UUID(int=2)
+
+    res = client.get("/tenants", params={"limit": 3}, auth=("admin", "admin"))
+    assert "x-next-cursor" not in res.headers
+
+    res = client.get("/tenants", params={"cursor": "!"}, auth=("admin", "admin"))
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_list_tenants__caches_first_pages_only():
+    tenants = [ListTenantsResult(id=UUID(int=1), name="tenant-1", created_at=datetime(2023, 1, 1))]
+    mock = DBMock(query_result=tenants)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    cursor = encode_cursor(UUID(int=1))
+    client.get("/tenants", auth=("admin", "admin"))
+    client.get("/tenants", params={"cursor": cursor}, auth=("admin", "admin"))
+    client.get("/tenants", auth=("admin", "admin"), headers={"accept": "application/x-ndjson"})
+
+    mock.query_result = []
+    assert client.get("/tenants", auth=("admin", "admin")).json()[0]["name"] == "tenant-1"
+    assert client.get("/tenants", params={"cursor": cursor}, auth=("admin", "admin")).json() == []
+    res: httpx.Response = client.get("/tenants", auth=("admin", "admin"), headers={"accept": "application/x-ndjson"})
+    assert res.text == ""
+
+
+def test_list_tenants__ndjson():
+    tenants = [
+        ListTenantsResult(id=UUID(int=i), name=f"tenant-{i}", created_at=datetime(2023, 1, 1))
+        for i in range(1, 3)
+    ]
+    mock = DBMock(query_result=tenants)
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    res: httpx.Response = client.get("/tenants", params={"limit": 10}, auth=("admin", "admin"),
+                                     headers={"accept": "application/x-ndjson"})
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["name"] for line in res.text.splitlines()] == ["tenant-1", "tenant-2"]
+
+
+class ImportDBMock:
+    def __init__(self, *, fail_batches=False, bad_usernames=()):
+        self.fail_batches = fail_batches
+        self.bad_usernames = bad_usernames
+        self.batches = []
+        self.singles = []
+
+    async def query(self, query, **kwargs):
+        if self.fail_batches:
+            raise ConstraintViolationError("duplicate")
+        self.batches.append(json.loads(kwargs["users"]))
+        return []
+
+    async def query_single(self, query, **kwargs):
+        if kwargs["username"] in self.bad_usernames:
+            raise ConstraintViolationError("duplicate")
+        self.singles.append(kwargs["username"])
+
+
+def import_user(username: str, tenant: str = "aldi") -> dict:
+    return {
+        "username": username,
+        "email": f"{username}@buff.com",
+        "first_name": "not-needed",
+        "last_name": "not-needed",
+        "password_hash": "not-needed",
+        "tenant_name": tenant,
+        "roles": "admin",
+    }
+
+
+def test_import_users__batched_per_tenant():
+    mock = ImportDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin", import_batch_size=2)
+    client = TestClient(app)
+    rows = [import_user("a"), import_user("b", tenant="lidl"), {"username": "broken"}, import_user("c"),
+            import_user("d")]
+    res: httpx.Response = client.post("/users/import", json=rows, auth=("admin", "admin"))
+    assert res.status_code == status.HTTP_200_OK
+    body = res.json()
+    assert body["inserted"] == 4
+    assert [e["row"] for e in body["errors"]] == [2]
+    assert sorted([u["username"] for u in batch] for batch in mock.batches) == [["a", "c"], ["b"], ["d"]]
+
+
+def test_import_users__ndjson_falls_back_to_single_rows():
+    mock = ImportDBMock(fail_batches=True, bad_usernames=("b",))
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    body = "\n".join(json.dumps(import_user(name)) for name in "abc") + "\nnot json\n"
+    res: httpx.Response = client.post("/users/import", content=body, auth=("admin", "admin"),
+                                      headers={"content-type": "application/x-ndjson"})
+    assert res.status_code == status.HTTP_200_OK
+    body = res.json()
+    assert body["inserted"] == 2
+    assert [e["row"] for e in body["errors"]] == [1, 3]
+    assert mock.singles == ["a", "c"]
+
+
+def test_import_users__hashes_plaintext_passwords_over_tls():
+    mock = ImportDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin",
+                   password_policy={"schemes": ["bcrypt"], "bcrypt__rounds": 4})
+    rows = [{**import_user(name), "password_hash": None, "password": "password"} for name in "ab"]
+    rows.append(import_user("c"))
+
+    res = TestClient(app).post("/users/import", json=rows, auth=("admin", "admin"))
+    assert res.status_code == status.HTTP_200_OK
+    assert [e["row"] for e in res.json()["errors"]] == [0, 1]
+
+    res = TestClient(app, base_url="https://testserver").post("/users/import", json=rows, auth=("admin", "admin"))
+    assert res.json()["inserted"] == 3
+    [_, batch] = mock.batches
+    assert all("password" not in user for user in batch)
+    assert verify_password("password", batch[0]["password_hash"])
+    assert batch[2]["password_hash"] == "not-needed"
+
+
+class RefreshDBMock:
+    def __init__(self, *, redeemed=None, known=None):
+        self.redeemed = redeemed
+        self.known = known
+        self.created = []
+        self.revoked = []
+
+    async def query_single(self, query, **kwargs):
+        if "INSERT RefreshToken" in query:
+            self.created.append(kwargs)
+        elif "UPDATE RefreshToken" in query:
+            return self.redeemed
+        elif "SELECT RefreshToken" in query:
+            return self.known
+
+    async def query(self, query, **kwargs):
+        if "DELETE RefreshToken" in query:
+            self.revoked.append(kwargs["family"])
+        return []
+
+
+def test_create_token__refresh_grant_rotates():
+    family = UUID(int=7)
+    mock = RefreshDBMock(redeemed=UseRefreshTokenResult(
+        id=UUID(int=1),
+        family=family,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=1),
+        user=UseRefreshTokenResultUser(
+            id=UUID('12345678123456781234567812345678'),
+            username="buffy",
+            email="buffy@buff.com",
+            disabled=False,
+            roles=[],
+            tenant=GetUserByEmailResultTenant(id=UUID('12345678123456781234567812345678'), name="aldi"),
+        ),
+    ))
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    res: httpx.Response = client.post("/tokens", data={"grant_type": "refresh_token", "refresh_token": "old"})
+    assert res.status_code == status.HTTP_200_OK
+    body = res.json()
+    assert body["refresh_token"] != "old"
+    assert body["expires_in"] == 3600
+    (created,) = mock.created
+    assert created["family"] == family
+    assert created["token_hash"] != body["refresh_token"]
+
+
+def test_create_token__refresh_grant_reuse_revokes_family():
+    family = UUID(int=7)
+    mock = RefreshDBMock(redeemed=None, known=ReadRefreshTokenResult(id=UUID(int=1), family=family, used=True))
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    res: httpx.Response = client.post("/tokens", data={"grant_type": "refresh_token", "refresh_token": "old"})
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+    assert mock.revoked == [family]
+    assert mock.created == []
+
+
+def test_create_token__refresh_grant_unknown():
+    mock = RefreshDBMock()
+    app = init_app(db=mock, secret_key="habins", admin_username="admin", admin_password="admin")
+    client = TestClient(app)
+    res: httpx.Response = client.post("/tokens", data={"grant_type": "refresh_token", "refresh_token": "nope"})
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+    assert mock.revoked == []
+
+
+def test_create_token__rate_limited_per_user():
+    app = init_app(db=DBMock(query_single_result=None), secret_key="habins", admin_username="admin",
+                   admin_password="admin", login_user_rate=0.01, login_user_burst=2)
+    client = TestClient(app)
+    data = {"username": "some-user", "password": "password", "tenant": "aldi"}
+    assert [client.post("/tokens", data=data).status_code for _ in range(2)] == [401, 401]
+    res = client.post("/tokens", data=data)
+    assert res.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(res.headers["retry-after"]) >= 1
+    # other users of the tenant are not affected
+    assert client.post("/tokens", data={**data, "username": "other-user"}).status_code == 401
+
+
+def test_create_token__refresh_not_rate_limited_per_ip():
+    app = init_app(db=DBMock(query_single_result=None), secret_key="habins", admin_username="admin",
+                   admin_password="admin", login_ip_rate=0.01, login_ip_burst=1)
+    client = TestClient(app)
+    data = {"grant_type": "refresh_token", "refresh_token": "some-token"}
+    assert [client.post("/tokens", data=data).status_code for _ in range(2)] == [401, 401]
+    data = {"username": "some-user", "password": "password", "tenant": "aldi"}
+    assert [client.post("/tokens", data=data).status_code for _ in range(2)] == [401, 429]
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from typing import Annotated
+
+from fastapi import Depends
+from starlette import status
+from starlette.testclient import TestClient
+
+from authproxy import init_app
+from libauthproxy import create_access_token
+from libauthproxy.scopes import ScopeSet, normalize_scopes, require_scopes
+
+
+def test_normalize_scopes__dedupes_and_keeps_covered():
+    assert normalize_scopes(["billing:read", " billing::read ", "billing:*", "shipping", "", "*:read"]) == \
+           ["*:read", "billing:*", "billing:read", "shipping"]
+    assert normalize_scopes(["*", "billing:*", "shipping"]) == ["*", "billing:*", "shipping"]
+
+
+def test_scope_set__wildcards_and_hierarchy():
+    scopes = ScopeSet(["billing:*", "*:read", "shipping:orders:*:write", "admin"])
+    assert "admin" in scopes
+    assert "billing:invoices" in scopes
+    assert "billing:invoices:write" in scopes
+    assert "billing" not in scopes
+    assert "stock:read" in scopes
+    assert "stock:write" not in scopes
+    assert "shipping:orders:42:write" in scopes
+    assert "shipping:orders:42:read" not in scopes
+    assert scopes.satisfies(["admin", "stock:read"])
+    assert not scopes.satisfies(["admin", "stock:write"])
+
+
+def test_require_scopes():
+    app = init_app(db=None, secret_key="habins", admin_username="admin", admin_password="admin")
+
+    @app.get("/invoices")
+    async def handle_invoices(claims: Annotated[dict, Depends(require_scopes("billing:invoices:read"))]):
+        return {"user": claims["sub"]}
+
+    def bearer(scopes: list[str]) -> dict:
+        token = create_access_token("habins", "HS256", {"sub": "buffy", "tenant": "aldi", "scopes": scopes},
+                                    timedelta(days=1))
+        return {"authorization": f"Bearer {token}"}
+
+    client = TestClient(app)
+    assert client.get("/invoices").status_code == status.HTTP_401_UNAUTHORIZED
+    res = client.get("/invoices", headers=bearer(["billing:*"]))
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json() == {"user": "buffy"}
+    res = client.get("/invoices", headers=bearer(["billing:invoices:write"]))
+    assert res.status_code == status.HTTP_403_FORBIDDEN
+    assert 'scope="billing:invoices:read"' in res.headers["www-authenticate"]
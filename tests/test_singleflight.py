@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from libauthproxy.singleflight import SingleFlight, coalesce
+
+
+class SlowDBMock:
+    def __init__(self):
+        self.calls = 0
+
+    async def query_single(self, *args, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return kwargs
+
+
+async def read(executor, *, name: str):
+    return await executor.query_single("SELECT", name=name)
+
+
+@pytest.mark.asyncio
+async def test_coalesce__shares_concurrent_identical_calls():
+    mock = SlowDBMock()
+    coalesced = coalesce(read)
+    results = await asyncio.gather(*(coalesced(mock, name="a") for _ in range(10)), coalesced(mock, name="b"))
+    assert results[:10] == [{"name": "a"}] * 10
+    assert results[10] == {"name": "b"}
+    assert mock.calls == 2
+    assert coalesced.flight.calls == 2
+    assert coalesced.flight.coalesced == 9
+    assert coalesced.flight.inflight == 0
+
+    await coalesced(mock, name="a")
+    assert mock.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight__shares_exceptions_and_survives_cancellation():
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def fail():
+        started.set()
+        await asyncio.sleep(0.01)
+        raise ValueError("nope")
+
+    first = asyncio.ensure_future(flight.do("k", fail))
+    await started.wait()
+    second = asyncio.ensure_future(flight.do("k", fail))
+    first.cancel()
+    with pytest.raises(ValueError):
+        await second
+    assert flight.calls == 1
+    assert flight.coalesced == 1